@@ -0,0 +1,46 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+""" Per-call latency of ConsulApi with and without keep-alive connections """
+
+import argparse
+import logging
+import timeit
+from fake_consul_agent import FakeConsulAgent
+from envmgr_healthchecks.api.consul.consul_api import ConsulApi
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(config, calls):
+    samples = []
+    with ConsulApi(config) as consul_api:
+        for index in range(calls):
+            start = timeit.default_timer()
+            consul_api.register_http_check(
+                'service', 'service:check-{0}'.format(index), 'check-{0}'.format(index),
+                'http://localhost/health', '10s')
+            samples.append((timeit.default_timer() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    with FakeConsulAgent() as agent:
+        for keep_alive in (False, True):
+            config = dict(agent.config, keep_alive=keep_alive)
+            samples = measure(config, args.calls)
+            print('keep_alive={0:<5} calls={1} mean={2:.3f}ms p50={3:.3f}ms p99={4:.3f}ms'.format(
+                keep_alive, args.calls, sum(samples) / len(samples),
+                percentile(samples, 0.5), percentile(samples, 0.99)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+""" Local stand-in for the Consul agent HTTP API, used by the benchmarks """
+
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+DEFAULT_WAIT = 300
+MAX_WAIT = 600
+WAIT_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_wait(wait):
+    """ Seconds in a Consul wait duration such as '10s' or '5m' """
+    if not wait:
+        return DEFAULT_WAIT
+    match = re.match(r'^(\d+(?:\.\d+)?)(ms|s|m|h)?$', wait)
+    if match is None:
+        return DEFAULT_WAIT
+    return min(MAX_WAIT, float(match.group(1)) * WAIT_UNITS[match.group(2) or 's'])
+
+
+AGENT_ROUTES = {
+    ('GET', 'self'): '_get_self',
+    ('GET', 'checks'): '_get_checks',
+    ('PUT', 'check/register'): '_put_check_register',
+    ('PUT', 'service/register'): '_put_service_register'
+}
+
+AGENT_PREFIX_ROUTES = {
+    ('PUT', 'check/deregister/'): '_put_check_deregister',
+    ('PUT', 'service/deregister/'): '_put_service_deregister'
+}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _AgentState(object):
+    """ Checks, services and key-value entries held by the fake agent """
+
+    def __init__(self):
+        self.checks = {}
+        self.services = {}
+        self.entries = {}
+        self.index = 1
+        self.condition = threading.Condition()
+
+    def next_index(self):
+        self.index += 1
+        return self.index
+
+    def services_hash(self):
+        return hashlib.sha1(json.dumps(self.services, sort_keys=True)).hexdigest()[:16]
+
+    def prefix_index(self, prefix):
+        indexes = [entry['ModifyIndex'] for key, entry in self.entries.iteritems()
+                   if key.startswith(prefix)]
+        return max(indexes) if indexes else self.index
+
+
+class _AgentRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def agent(self):
+        return self.server.agent
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        length = int(self.headers.getheader('Content-Length', 0) or 0)
+        body = self.rfile.read(length) if length else ''
+        (path, _, query_string) = self.path.partition('?')
+        query = dict((name, values[-1]) for name, values in
+                     urlparse.parse_qs(query_string, keep_blank_values=True).iteritems())
+        agent = self.agent
+        if agent.latency:
+            time.sleep(agent.latency)
+        if agent.error_rate and agent.random.random() < agent.error_rate:
+            return self._respond(500, 'Injected error', raw=True)
+        if path.startswith('/v1/kv/'):
+            return self._handle_kv(method, path[len('/v1/kv/'):], query, body)
+        route = path[len('/v1/agent/'):] if path.startswith('/v1/agent/') else None
+        if (method, route) == ('GET', 'services'):
+            return self._get_services(query)
+        if (method, route) in AGENT_ROUTES:
+            return getattr(self, AGENT_ROUTES[(method, route)])(body)
+        for (route_method, prefix), handler_name in AGENT_PREFIX_ROUTES.iteritems():
+            if method == route_method and route is not None and route.startswith(prefix):
+                return getattr(self, handler_name)(route[len(prefix):])
+        self._respond(404, None)
+
+    def _get_self(self, body):
+        self._respond(200, {'Config': {}, 'Member': {}})
+
+    def _get_services(self, query):
+        state = self.agent.state
+        with state.condition:
+            if query.get('hash'):
+                # Blocking query, held until the services no longer match the client's hash
+                deadline = time.time() + parse_wait(query.get('wait'))
+                while state.services_hash() == query['hash']:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    state.condition.wait(remaining)
+            self._respond(200, dict(state.services),
+                          headers={'X-Consul-ContentHash': state.services_hash()})
+
+    def _get_checks(self, body):
+        with self.agent.state.condition:
+            self._respond(200, dict(self.agent.state.checks))
+
+    def _put_check_register(self, body):
+        definition = json.loads(body)
+        state = self.agent.state
+        with state.condition:
+            state.checks[definition.get('ID') or definition['Name']] = {
+                'CheckID': definition.get('ID') or definition['Name'],
+                'Name': definition['Name'],
+                'ServiceID': definition.get('ServiceID', ''),
+                'Notes': definition.get('Notes', ''),
+                'Status': 'critical',
+                'Output': ''
+            }
+        self._respond(200, None)
+
+    def _put_check_deregister(self, check_id):
+        state = self.agent.state
+        with state.condition:
+            if state.checks.pop(check_id, None) is None:
+                return self._respond(500, 'Unknown check "{0}"'.format(check_id), raw=True)
+        self._respond(200, None)
+
+    def _put_service_register(self, body):
+        definition = json.loads(body)
+        state = self.agent.state
+        service_id = definition.get('ID') or definition['Name']
+        with state.condition:
+            state.services[service_id] = {
+                'ID': service_id,
+                'Service': definition['Name'],
+                'Address': definition.get('Address', ''),
+                'Port': definition.get('Port', 0),
+                'Tags': definition.get('Tags') or []
+            }
+            for check in definition.get('Checks') or []:
+                check_id = check.get('CheckID') or check['Name']
+                state.checks[check_id] = {
+                    'CheckID': check_id, 'Name': check['Name'], 'ServiceID': service_id,
+                    'Notes': check.get('Notes', ''), 'Status': 'critical', 'Output': ''}
+            state.condition.notify_all()
+        self._respond(200, None)
+
+    def _put_service_deregister(self, service_id):
+        state = self.agent.state
+        with state.condition:
+            if state.services.pop(service_id, None) is None:
+                return self._respond(500, 'Unknown service "{0}"'.format(service_id), raw=True)
+            state.condition.notify_all()
+        self._respond(200, None)
+
+    def _handle_kv(self, method, key, query, body):
+        state = self.agent.state
+        with state.condition:
+            if method == 'GET':
+                return self._get_kv(state, key, query)
+            if method == 'PUT':
+                entry = state.entries.get(key)
+                if 'cas' in query:
+                    cas = int(query['cas'])
+                    current = entry['ModifyIndex'] if entry is not None else 0
+                    if cas != current:
+                        return self._respond(200, False)
+                index = state.next_index()
+                state.entries[key] = {
+                    'Key': key, 'Flags': 0, 'LockIndex': 0,
+                    'CreateIndex': entry['CreateIndex'] if entry is not None else index,
+                    'ModifyIndex': index, 'Value': base64.b64encode(body)}
+            else:
+                keys = [existing for existing in state.entries
+                        if existing == key or ('recurse' in query and existing.startswith(key))]
+                for existing in keys:
+                    del state.entries[existing]
+                state.next_index()
+            state.condition.notify_all()
+        self._respond(200, True)
+
+    def _get_kv(self, state, key, query):
+        is_prefix = 'recurse' in query or 'keys' in query
+        if 'index' in query and query['index']:
+            # Blocking query, held until the index moves past the one the client knows
+            deadline = time.time() + parse_wait(query.get('wait'))
+            known_index = int(query['index'])
+            while self._kv_index(state, key, is_prefix) <= known_index:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                state.condition.wait(remaining)
+        index = self._kv_index(state, key, is_prefix)
+        headers = {'X-Consul-Index': str(index)}
+        if 'keys' in query:
+            separator = query.get('separator')
+            keys = set()
+            for existing in state.entries:
+                if existing.startswith(key):
+                    remainder = existing[len(key):]
+                    if separator and separator in remainder:
+                        remainder = remainder[:remainder.index(separator) + len(separator)]
+                    keys.add(key + remainder)
+            return self._respond(200 if keys else 404, sorted(keys) if keys else None, headers=headers)
+        if 'recurse' in query:
+            entries = [entry for existing, entry in sorted(state.entries.iteritems())
+                       if existing.startswith(key)]
+        else:
+            entries = [state.entries[key]] if key in state.entries else []
+        self._respond(200 if entries else 404, entries or None, headers=headers)
+
+    def _kv_index(self, state, key, is_prefix):
+        if is_prefix:
+            return state.prefix_index(key)
+        entry = state.entries.get(key)
+        return entry['ModifyIndex'] if entry is not None else state.index
+
+    def _respond(self, status, content, headers=None, raw=False):
+        if raw:
+            body = content
+        else:
+            body = '' if content is None else json.dumps(content)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain' if raw else 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+
+class FakeConsulAgent(object):
+    """
+    Fake Consul agent listening on an ephemeral local port. It keeps registered
+    checks, services and key-value entries in memory, answers blocking queries,
+    and can add latency to, or fail a fraction of, every request.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.state = _AgentState()
+        self._server = _ThreadingHTTPServer((host, port), _AgentRequestHandler)
+        self._server.agent = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    @property
+    def config(self):
+        """ Consul section of the registrar configuration pointing at this agent """
+        host, port = self._server.server_address
+        return {'scheme': 'http', 'host': host, 'port': port, 'version': 'v1', 'acl_token': None}
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def reset(self):
+        """ Forget every registered check, service and key-value entry """
+        self.state = _AgentState()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
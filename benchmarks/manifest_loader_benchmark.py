@@ -0,0 +1,63 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+""" Parse time of large health check manifests """
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+import yaml
+from envmgr_healthchecks.health_checks.manifest_loader import ManifestLoader
+
+
+def write_manifest(directory, checks):
+    path = os.path.join(directory, 'healthchecks-{0}.yml'.format(checks))
+    manifest = {'sensu_healthchecks': dict(
+        ('check_{0}'.format(index), {
+            'name': 'check-{0}'.format(index),
+            'local_script': 'scripts/check_{0}.sh'.format(index),
+            'interval': 30,
+            'override_notification_email': ['team@example.com'],
+            'runbook': 'https://example.com/runbook/{0}'.format(index)
+        }) for index in range(checks))}
+    with open(path, 'w') as manifest_file:
+        yaml.dump(manifest, manifest_file, default_flow_style=False)
+    return path
+
+
+def time_call(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--checks', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        for checks in args.checks:
+            path = write_manifest(directory, checks)
+            loader = ManifestLoader()
+
+            def pure_python():
+                with open(path) as stream:
+                    yaml.load(stream, Loader=yaml.Loader)
+
+            def uncached():
+                loader.clear()
+                loader.load(path)
+
+            loader.load(path)
+            print('checks={0:<6} yaml.load={1:.1f}ms loader={2:.1f}ms cached={3:.1f}ms'.format(
+                checks, time_call(pure_python, args.repeat), time_call(uncached, args.repeat),
+                time_call(lambda: loader.load(path), args.repeat)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+"""
+Registrar throughput against a local fake Consul agent. Reports ops/sec, p50/p99
+request latency and peak memory for synthetic manifests, and compares them with
+a baseline written by --output to catch regressions. Every run happens in a
+process of its own, so that its peak memory is not that of an earlier run.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import resource
+import shutil
+import sys
+import tempfile
+import timeit
+from fake_consul_agent import FakeConsulAgent
+from envmgr_healthchecks.api.consul.consul_api import ConsulApi, ConsulError
+from envmgr_healthchecks.health_checks.consul_health_check import ConsulHealthCheck
+from envmgr_healthchecks.health_checks.health_check_errors import RegisterError
+from envmgr_healthchecks.metrics import Metrics
+
+
+class SampleSink(object):
+    """ Keeps every Consul request latency, for percentiles """
+
+    def __init__(self):
+        self.samples = []
+
+    def timing(self, name, seconds, tags):
+        if name == 'consul.request.duration':
+            self.samples.append(seconds * 1000)
+
+    def increment(self, name, value, tags):
+        pass
+
+    def flush(self):
+        pass
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def create_appspec(checks):
+    return {'consul_healthchecks': dict(
+        ('check_{0}'.format(index), {
+            'name': 'check-{0}'.format(index),
+            'type': 'http',
+            'http': 'http://localhost:8080/health/{0}'.format(index),
+            'interval': '10s'
+        }) for index in range(checks))}
+
+
+def register_checks(config, archive_dir, checks, mode, metrics):
+    with ConsulApi(config, metrics) as consul_api:
+        health_check = ConsulHealthCheck(
+            name='ConsulHealthCheck', api=consul_api, service_id='benchmark',
+            archive_dir=archive_dir, appspec=create_appspec(checks),
+            batch=mode == 'batch', metrics=metrics)
+        health_check.register()
+
+
+def write_keys(config, archive_dir, checks, mode, metrics):
+    with ConsulApi(dict(config, optimistic_writes=mode == 'optimistic'), metrics) as consul_api:
+        for index in range(checks):
+            consul_api.write_value('benchmark/key-{0}'.format(index), {'index': index})
+        consul_api.get_tree('benchmark/')
+
+
+SCENARIOS = {
+    'register': (register_checks, ('sequential', 'batch')),
+    'kv': (write_keys, ('default', 'optimistic'))
+}
+
+
+def measure(config, archive_dir, scenario, mode, checks, results):
+    func = SCENARIOS[scenario][0]
+    sink = SampleSink()
+    initial_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = timeit.default_timer()
+    error = None
+    try:
+        func(config, archive_dir, checks, mode, Metrics([sink]))
+    except (ConsulError, RegisterError) as e:
+        error = str(e)
+    elapsed = timeit.default_timer() - start
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put({
+        'scenario': scenario, 'mode': mode, 'checks': checks,
+        'ops_per_sec': checks / elapsed, 'requests': len(sink.samples),
+        'p50_ms': percentile(sink.samples, 0.5), 'p99_ms': percentile(sink.samples, 0.99),
+        'max_rss_kb': max_rss_kb, 'rss_growth_kb': max_rss_kb - initial_rss_kb, 'error': error
+    })
+
+
+def run(agent, archive_dir, scenario, mode, checks):
+    # The agent keeps its state in this process, the run gets a process of its own
+    agent.reset()
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=measure, args=(agent.config, archive_dir, scenario, mode, checks, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def find_regressions(results, baseline, tolerance):
+    expected = dict(((result['scenario'], result['mode'], result['checks']), result) for result in baseline)
+    regressions = []
+    for result in results:
+        previous = expected.get((result['scenario'], result['mode'], result['checks']))
+        if previous is None:
+            continue
+        if result['ops_per_sec'] < previous['ops_per_sec'] * (1 - tolerance):
+            regressions.append('{0}/{1} checks={2}: {3:.0f} ops/sec, baseline {4:.0f}'.format(
+                result['scenario'], result['mode'], result['checks'],
+                result['ops_per_sec'], previous['ops_per_sec']))
+        if 'rss_growth_kb' in previous and \
+                result['rss_growth_kb'] > max(previous['rss_growth_kb'], 1024) * (1 + tolerance):
+            regressions.append('{0}/{1} checks={2}: {3}KB memory growth, baseline {4}KB'.format(
+                result['scenario'], result['mode'], result['checks'],
+                result['rss_growth_kb'], previous['rss_growth_kb']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--checks', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.0, help='added to every request, in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failed with 500')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare ops/sec and memory growth with results written by --output')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    results = []
+    archive_dir = tempfile.mkdtemp()
+    try:
+        with FakeConsulAgent(latency=args.latency / 1000, error_rate=args.error_rate, seed=1) as agent:
+            for scenario in args.scenarios:
+                for mode in SCENARIOS[scenario][1]:
+                    for checks in args.checks:
+                        result = run(agent, archive_dir, scenario, mode, checks)
+                        results.append(result)
+                        print('{scenario:<9} {mode:<10} checks={checks:<6} ops/sec={ops_per_sec:<9.0f} '
+                              'requests={requests:<6} p50={p50_ms:.3f}ms p99={p99_ms:.3f}ms '
+                              'max_rss={max_rss_kb}KB rss_growth={rss_growth_kb}KB{0}'.format(
+                                  ' error={0}'.format(result['error']) if result['error'] else '', **result))
+    finally:
+        shutil.rmtree(archive_dir)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION {0}'.format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+""" Sensu definition write time and size for each definition layout and output profile """
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+from mock import Mock
+from envmgr_healthchecks.health_checks.sensu_heath_check import SensuHealthCheck
+
+
+class NullLogger(object):
+    def __init__(self):
+        self.info = self.error = self.debug = self.warning = self.exception = Mock()
+
+
+def create_sut(directory, checks, definition_layout, output_profile):
+    return SensuHealthCheck(
+        logger=NullLogger(),
+        platform='linux',
+        instance_tags={},
+        service_id='my-service',
+        archive_dir=directory,
+        appspec={'sensu_healthchecks': checks},
+        sensu={'healthcheck_search_paths': [directory],
+               'sensu_check_path': os.path.join(directory, definition_layout),
+               'definition_layout': definition_layout,
+               'output_profile': output_profile})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--checks', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--profiles', nargs='+', default=['pretty', 'compact', 'canonical'])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        open(os.path.join(directory, 'check.sh'), 'w').close()
+        for checks in args.checks:
+            manifest = dict(
+                ('check_{0}'.format(index),
+                 {'name': 'check-{0}'.format(index), 'server_script': 'check.sh', 'interval': 30})
+                for index in range(checks))
+            for definition_layout in ('per_check', 'bundle'):
+                for output_profile in args.profiles:
+                    check_path = os.path.join(directory, definition_layout)
+
+                    def register():
+                        shutil.rmtree(check_path, ignore_errors=True)
+                        os.makedirs(check_path)
+                        create_sut(directory, manifest, definition_layout, output_profile).register()
+
+                    elapsed = min(timeit.repeat(register, number=1, repeat=args.repeat)) * 1000
+                    filenames = os.listdir(check_path)
+                    size = sum(os.path.getsize(os.path.join(check_path, filename)) for filename in filenames)
+                    print('checks={0:<6} layout={1:<9} profile={2:<9} write={3:.1f}ms files={4} bytes={5}'.format(
+                        checks, definition_layout, output_profile, elapsed, len(filenames), size))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+""" Per check cost of generating Sensu check definitions for a large manifest """
+
+import argparse
+import timeit
+from mock import Mock
+from envmgr_healthchecks.health_checks.sensu_definition_generator import SensuCheckDefinitionGenerator
+
+INSTANCE_TAGS = dict([('aws:cloudformation:stack-name', 'stack'), ('Environment', 'prod'),
+                      ('OwningCluster', 'platform'), ('Role', 'web'), ('SecurityZone', 'public')])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--checks', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    checks = dict(
+        ('check_{0}'.format(index), {
+            'name': 'check-{0}'.format(index),
+            'local_script': 'check_{0}.sh'.format(index),
+            'interval': 30,
+            'override_notification_email': ['team@example.com'],
+            'override_chat_channel': ['#team']
+        }) for index in range(args.checks))
+    script_paths = dict((check_id, '/opt/' + check['local_script']) for check_id, check in checks.iteritems())
+    logger = Mock()
+
+    def per_check():
+        # Instance level fields worked out again for every check
+        for check_id, check in checks.iteritems():
+            SensuCheckDefinitionGenerator(logger, 'linux', 'blue', INSTANCE_TAGS).generate(
+                check, script_paths[check_id])
+
+    def compiled():
+        SensuCheckDefinitionGenerator(logger, 'linux', 'blue', INSTANCE_TAGS).generate_all(
+            checks, script_paths)
+
+    for label, func in (('per check', per_check), ('compiled', compiled)):
+        elapsed = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print('{0:<10} checks={1} total={2:.1f}ms per_check={3:.2f}us'.format(
+            label, args.checks, elapsed * 1000, elapsed * 1000000 / args.checks))
+
+
+if __name__ == '__main__':
+    main()
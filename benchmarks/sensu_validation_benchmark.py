@@ -0,0 +1,45 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+""" Validation time of large Sensu manifests, per-check validators versus the shared validator """
+
+import argparse
+import re
+import timeit
+from jsonschema import Draft4Validator
+from envmgr_healthchecks.health_checks.sensu_check_validator import SENSU_CHECK_SCHEMA, SensuCheckValidator
+
+
+def create_manifest(checks):
+    return dict(('check_{0}'.format(index), {
+        'name': 'check-{0}'.format(index),
+        'local_script': 'scripts/check_{0}.sh'.format(index),
+        'interval': 30,
+        'override_notification_email': ['team@example.com'],
+        'standalone': True
+    }) for index in range(checks))
+
+
+def validate_per_check(manifest):
+    for check in manifest.values():
+        Draft4Validator(SENSU_CHECK_SCHEMA).validate(check)
+        re.match(r'^[\w\.-]+$', check['name'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--checks', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    validator = SensuCheckValidator()
+    for checks in args.checks:
+        manifest = create_manifest(checks)
+        per_check = min(timeit.repeat(lambda: validate_per_check(manifest), number=1, repeat=args.repeat))
+        shared = min(timeit.repeat(lambda: validator.validate_manifest(manifest), number=1, repeat=args.repeat))
+        print('checks={0:<6} per-check validator={1:.1f}ms shared validator={2:.1f}ms'.format(
+            checks, per_check * 1000, shared * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import threading
+from multiprocessing.pool import ThreadPool
+from envmgr_healthchecks.api.consul.consul_api import ConsulApi
+
+DEFAULT_MAX_WORKERS = 64
+DEFAULT_MAX_BLOCKING_QUERIES = 64
+
+
+class AsyncConsulApi(object):
+    """
+    Non-blocking counterpart of ConsulApi. Every call is scheduled on a shared
+    worker pool and returns an AsyncResult; use get() to wait for the value.
+
+    Blocking queries (wait_for_change) run on a separate pool of
+    max_blocking_queries threads, so long-polls never hold up other calls.
+    Each one still holds a thread, so at most max_blocking_queries of them are
+    in flight at once and further ones queue until a long-poll returns.
+    """
+
+    def __init__(self, consul_config, max_workers=None, metrics=None, max_blocking_queries=None):
+        if max_workers is None:
+            max_workers = consul_config.get('max_workers', DEFAULT_MAX_WORKERS)
+        if max_blocking_queries is None:
+            max_blocking_queries = consul_config.get('max_blocking_queries', DEFAULT_MAX_BLOCKING_QUERIES)
+        # Size the connection pool so that every worker can hold a keep-alive connection
+        pool_size = max(consul_config.get('pool_size', 0), max_workers + max_blocking_queries)
+        self._api = ConsulApi(dict(consul_config, pool_size=pool_size), metrics)
+        self._pool = ThreadPool(processes=max_workers)
+        self._blocking_pool = ThreadPool(processes=max_blocking_queries)
+        self._lock = threading.Lock()
+        self._last_known_modify_indexes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._pool.close()
+        self._blocking_pool.close()
+        self._pool.join()
+        self._blocking_pool.join()
+        self._api.close()
+
+    def _submit(self, func, *args):
+        return self._pool.apply_async(func, args)
+
+    def check_connectivity(self):
+        return self._submit(self._api.check_connectivity)
+
+    def get_keys(self, key_prefix):
+        return self._submit(self._api.get_keys, key_prefix)
+
+    def get_service_catalogue(self):
+        return self._submit(self._api.get_service_catalogue)
+
+    def get_value(self, key):
+        return self._submit(self._api.get_value, key)
+
+    def key_exists(self, key):
+        return self._submit(self._api.key_exists, key)
+
+    def write_value(self, key, value):
+        return self._submit(self._api.write_value, key, value)
+
+    def deregister_check(self, id):
+        return self._submit(self._api.deregister_check, id)
+
+    def register_http_check(self, service_id, id, name, url, interval):
+        return self._submit(self._api.register_http_check, service_id, id, name, url, interval)
+
+    def register_script_check(self, service_id, id, name, script_path, interval):
+        return self._submit(self._api.register_script_check, service_id, id, name, script_path, interval)
+
+    def register_service(self, id, name, address, port, tags, checks=None):
+        return self._submit(self._api.register_service, id, name, address, port, tags, checks)
+
+    def wait_for_change(self, key_prefix, wait=None):
+        # Each key prefix keeps its own modify index so that concurrent
+        # blocking queries on different prefixes do not interfere
+        def wait_for_prefix():
+            with self._lock:
+                last_known_modify_index = self._last_known_modify_indexes.get(key_prefix, 0)
+            (modify_index, is_changed) = self._api._wait_for_change(
+                key_prefix, last_known_modify_index, wait)
+            with self._lock:
+                self._last_known_modify_indexes[key_prefix] = modify_index
+            return is_changed
+        return self._blocking_pool.apply_async(wait_for_prefix)
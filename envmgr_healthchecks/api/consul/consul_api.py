@@ -4,8 +4,33 @@
 import base64
 import json
 import logging
+import random
+import re
+import threading
+import time
 import requests
-from retrying import retry
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from envmgr_healthchecks.api.consul.consul_cache import ConsulReadCache
+from envmgr_healthchecks.api.consul.consul_kv import EncodedValue, KeyValueTree, iter_json_array
+from envmgr_healthchecks.api.consul.consul_retry import CircuitOpenError, RetryPolicy
+from envmgr_healthchecks.concurrency import map_concurrently
+from envmgr_healthchecks.metrics import shared_metrics
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+STREAM_CHUNK_SIZE = 64 * 1024
+DEFAULT_READ_CACHE_TTL = 60
+DEFAULT_CAS_INDEX_CACHE_SIZE = 10000
+DEFAULT_BLOCKING_WAIT = '5m'
+# Consul adds up to wait / 16 to a blocking query, the client allows for that and the round trip
+BLOCKING_TIMEOUT_MARGIN = 5
+INDEX_BACKOFF_BASE = 1.0
+INDEX_BACKOFF_MAX = 30.0
+WAIT_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+# Check and service registrations run during deploys, so they give up sooner
+AGENT_WRITE_RETRY_DEADLINE = 30
+AGENT_WRITE_RETRY_MAX_DELAY = 5.0
 
 
 class ConsulError(RuntimeError):
@@ -23,52 +48,196 @@ def handle_connection_error(func):
     return handle_error
 
 
-def retry_if_connection_error(exception):
-    return isinstance(exception, requests.exceptions.ConnectionError)
+def consul_endpoint(relative_url):
+    """ Low cardinality name of the endpoint a request goes to, for metrics """
+    segments = relative_url.split('?', 1)[0].split('/')
+    if segments[0] == 'kv':
+        return 'kv'
+    return '/'.join(segments[:3])
+
+
+def parse_wait(wait):
+    """ Seconds in a Consul wait duration such as '10s' or '5m', or in a number of seconds """
+    if isinstance(wait, (int, long, float)):
+        return float(wait)
+    match = re.match(r'^(\d+(?:\.\d+)?)(ms|s|m|h)?$', wait)
+    if match is None:
+        raise ValueError('Invalid Consul wait duration \'{0}\''.format(wait))
+    return float(match.group(1)) * WAIT_UNITS[match.group(2) or 's']
+
+
+def format_wait(wait):
+    if isinstance(wait, (int, long, float)):
+        return '{0}s'.format(wait)
+    return wait
+
+
+def http_check_definition(service_id, id, name, url, interval):
+    return {'ServiceID': service_id, 'ID': id, 'Name': name, 'HTTP': url, 'Interval': interval}
+
+
+def script_check_definition(service_id, id, name, script_path, interval):
+    return {'ServiceID': service_id, 'ID': id, 'Name': name, 'Script': script_path, 'Interval': interval}
+
+
+def service_check_definition(definition):
+    # Checks registered with their service take a CheckID and belong to it implicitly
+    check = dict((field, value) for field, value in definition.iteritems()
+                 if field not in ('ID', 'ServiceID'))
+    check['CheckID'] = definition['ID']
+    return check
 
 
 class ConsulApi(object):
-    def __init__(self, consul_config):
+    def __init__(self, consul_config, metrics=None, retry_policy=None):
         self._config = consul_config
+        self._metrics = metrics or shared_metrics
+        self.retry_policy = retry_policy or RetryPolicy.from_config(consul_config)
         self._base_url = '{0}://{1}:{2}/{3}'.format(
             self._config['scheme'], self._config['host'], self._config['port'], self._config['version'])
         self._last_known_modify_index = 0
+        self._timeout = (self._config.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+                         self._config.get('read_timeout', None))
+        self._session = self._create_session()
+        self._optimistic_writes = self._config.get('optimistic_writes', False)
+        # Modify indexes seen by reads, used by optimistic writes only
+        self._cas_indexes = OrderedDict()
+        self._cas_indexes_size = self._config.get('cas_index_cache_size', DEFAULT_CAS_INDEX_CACHE_SIZE)
+        self._cas_indexes_lock = threading.Lock()
+        self._index_backoff_attempts = {}
+        self._index_backoff_lock = threading.Lock()
+        self._sleep = time.sleep
+        read_cache_size = self._config.get('read_cache_size', 0)
+        self._read_cache = ConsulReadCache(
+            read_cache_size, self._config.get('read_cache_ttl', DEFAULT_READ_CACHE_TTL)) if read_cache_size else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _create_session(self):
+        # A single pool of keep-alive connections to the agent is shared by every verb
+        pool_size = self.pool_size
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self._config.get('keep_alive', True):
+            session.headers['Connection'] = 'close'
+        return session
+
+    @property
+    def pool_size(self):
+        """ Number of keep-alive connections to the agent that are kept open """
+        return self._config.get('pool_size', DEFAULT_POOL_SIZE)
+
+    def close(self):
+        logging.debug('Closing Consul HTTP API connection pool')
+        self._session.close()
 
     @handle_connection_error
-    @retry(retry_on_exception=retry_if_connection_error, wait_exponential_multiplier=1000, wait_exponential_max=60000)
-    def _api_get(self, relative_url):
+    def _api_get(self, relative_url, stream=False, retry_policy=None, timeout=None):
         url = '{0}/{1}'.format(self._base_url, relative_url)
         logging.debug('Consul HTTP API request: {0}'.format(url))
-        response = requests.get(
-            url, headers={'X-Consul-Token': self._config['acl_token']})
+        tags = {'method': 'GET', 'endpoint': consul_endpoint(relative_url)}
+
+        def send():
+            with self._metrics.timer('consul.request.duration', **tags):
+                return self._session.get(
+                    url, headers={'X-Consul-Token': self._config['acl_token']},
+                    timeout=timeout or self._timeout, stream=stream)
+        response = self._send_with_retries(send, tags, retry_policy)
         logging.debug('Response status code: {0}'.format(response.status_code))
-        logging.debug('Response content: {0}'.format(response.text))
+        if not stream:
+            logging.debug('Response content: {0}'.format(response.text))
+            self._metrics.increment('consul.request.bytes_received', len(response.content), **tags)
+        elif 'Content-Length' in response.headers:
+            self._metrics.increment(
+                'consul.request.bytes_received', int(response.headers['Content-Length']), **tags)
         if response.status_code == 500:
             raise ConsulError(
                 'Consul HTTP API internal error. Response content: {0}'.format(response.text))
         return response
 
     @handle_connection_error
-    @retry(retry_on_exception=retry_if_connection_error, wait_exponential_multiplier=1000, wait_exponential_max=60000)
-    def _api_put(self, relative_url, content):
+    def _api_put(self, relative_url, content, retry_policy=None):
         url = '{0}/{1}'.format(self._base_url, relative_url)
         logging.debug('Consul HTTP API PUT request URL: {0}'.format(url))
         logging.debug(
             'Consul HTTP API PUT request content: {0}'.format(content))
-        response = requests.put(url, data=content, headers={
-                                'X-Consul-Token': self._config['acl_token']})
+        tags = {'method': 'PUT', 'endpoint': consul_endpoint(relative_url)}
+
+        def send():
+            with self._metrics.timer('consul.request.duration', **tags):
+                return self._session.put(url, data=content, headers={
+                                         'X-Consul-Token': self._config['acl_token']}, timeout=self._timeout)
+        response = self._send_with_retries(send, tags, retry_policy)
         logging.debug('Response status code: {0}'.format(response.status_code))
         logging.debug('Response content: {0}'.format(response.text))
+        self._metrics.increment('consul.request.bytes_sent', len(content or ''), **tags)
+        self._metrics.increment('consul.request.bytes_received', len(response.content), **tags)
         if response.status_code == 500:
             raise ConsulError(
                 'Consul HTTP API internal error. Response content: {0}'.format(response.text))
         return response
 
-    @retry(wait_fixed=5000, stop_max_attempt_number=12)
-    def _get_modify_index(self, key, for_write_operation):
+    def _blocking_timeout(self, wait):
+        wait_seconds = parse_wait(wait)
+        return (self._timeout[0], wait_seconds + wait_seconds / 16 + BLOCKING_TIMEOUT_MARGIN)
+
+    def _api_blocking_get(self, relative_url, wait, retry_policy=None):
+        # A blocking query that times out is reported to the caller rather than
+        # retried, so that its client timeout bounds the whole call
+        return self._api_get(relative_url, retry_policy=self._without_timeout_retries(retry_policy),
+                             timeout=self._blocking_timeout(wait))
+
+    def _send_with_retries(self, send, tags, retry_policy=None):
+        policy = retry_policy or self.retry_policy
+        try:
+            return policy.call(
+                send, tags['endpoint'], lambda: self._metrics.increment('consul.request.retries', **tags))
+        except CircuitOpenError as e:
+            raise ConsulError(str(e))
+
+    def _without_timeout_retries(self, retry_policy=None):
+        # Derived on every call, so that a policy assigned to retry_policy later applies
+        return (retry_policy or self.retry_policy).replace(retry_on_timeout=False)
+
+    def _agent_write_retry_policy(self, retry_policy=None):
+        if retry_policy is not None:
+            return retry_policy
+        policy = self.retry_policy
+        deadline = AGENT_WRITE_RETRY_DEADLINE if policy.deadline is None else \
+            min(policy.deadline, AGENT_WRITE_RETRY_DEADLINE)
+        return policy.replace(deadline=deadline, max_delay=min(policy.max_delay, AGENT_WRITE_RETRY_MAX_DELAY))
+
+    def get_retry_counts(self):
+        """ Number of retries made so far, by endpoint """
+        return self.retry_policy.retry_counts
+
+    def _remember_modify_index(self, key, modify_index):
+        self._remember_modify_indexes([(key, modify_index)])
+
+    def _remember_modify_indexes(self, modify_indexes):
+        if not self._optimistic_writes:
+            return
+        with self._cas_indexes_lock:
+            for (key, modify_index) in modify_indexes:
+                self._cas_indexes.pop(key, None)
+                self._cas_indexes[key] = modify_index
+            while len(self._cas_indexes) > self._cas_indexes_size:
+                self._cas_indexes.popitem(last=False)
+
+    def _forget_modify_index(self, key):
+        with self._cas_indexes_lock:
+            self._cas_indexes.pop(key, None)
+
+    def _get_modify_index(self, key, for_write_operation, retry_policy=None):
         logging.debug(
             'Retrieving Consul key-value store modify index for key: {0}'.format(key))
-        response = self._api_get('kv/{0}?index'.format(key))
+        response = self._api_get('kv/{0}?index'.format(key), retry_policy=retry_policy)
         # For new values modify_index == 0
         if response.status_code == 404 and for_write_operation == True:
             modify_index = 0
@@ -76,14 +245,21 @@ class ConsulApi(object):
             modify_index = response.headers.get('X-Consul-Index')
         logging.debug(
             'Consul key-value store modify index for key \'{0}\': {1}'.format(key, modify_index))
+        if self._read_cache is not None and modify_index is not None:
+            self._read_cache.invalidate(key, int(modify_index))
         return modify_index
 
-    def check_connectivity(self):
+    def get_read_cache_stats(self):
+        if self._read_cache is None:
+            return None
+        return self._read_cache.stats()
+
+    def check_connectivity(self, retry_policy=None):
         logging.info('Checking Consul HTTP API connectivity')
-        self._api_get('agent/self')
+        self._api_get('agent/self', retry_policy=retry_policy)
         logging.info('Consul HTTP API connectivity OK ')
 
-    def get_keys(self, key_prefix):
+    def get_keys(self, key_prefix, retry_policy=None):
         def decode():
             return response.json()
 
@@ -91,71 +267,250 @@ class ConsulApi(object):
             logging.warning(
                 'Consul key-value store does not contain key prefix \'{0}\''.format(key_prefix))
             return []
-        response = self._api_get('kv/{0}?keys'.format(key_prefix))
+        response = self._api_get('kv/{0}?keys'.format(key_prefix), retry_policy=retry_policy)
         cases = {200: decode, 404: not_found}
         return cases[response.status_code]()
 
-    def get_service_catalogue(self):
-        response = self._api_get('agent/services')
+    def _get_recurse(self, key_prefix, index=None, wait=None, retry_policy=None):
+        query = ['recurse']
+        if index:
+            query.append('index={0}'.format(index))
+        if wait is not None:
+            query.append('wait={0}'.format(wait))
+        relative_url = 'kv/{0}?{1}'.format(key_prefix, '&'.join(query))
+        if wait is not None:
+            response = self._api_blocking_get(relative_url, wait, retry_policy)
+        else:
+            response = self._api_get(relative_url, retry_policy=retry_policy)
+        modify_index = response.headers.get('X-Consul-Index')
+        if response.status_code == 404:
+            return (modify_index, [])
+        entries = response.json()
+        self._remember_modify_indexes((entry['Key'], entry['ModifyIndex']) for entry in entries)
+        if self._read_cache is not None:
+            self._read_cache.invalidate_prefix(
+                key_prefix, dict((entry['Key'], entry['ModifyIndex']) for entry in entries))
+        return (modify_index, entries)
+
+    def get_key_indexes(self, key_prefix, index=None, wait=None, retry_policy=None):
+        (modify_index, entries) = self._get_recurse(key_prefix, index, wait, retry_policy)
+        return (modify_index, dict((entry['Key'], entry['ModifyIndex']) for entry in entries))
+
+    def get_tree(self, key_prefix, retry_policy=None):
+        (modify_index, entries) = self._get_recurse(key_prefix, retry_policy=retry_policy)
+        return KeyValueTree(entries, modify_index)
+
+    def iter_tree(self, key_prefix, retry_policy=None):
+        # Entries are parsed from the response as it arrives, so memory use does
+        # not grow with the size of the subtree
+        response = self._api_get('kv/{0}?recurse'.format(key_prefix), stream=True, retry_policy=retry_policy)
+        try:
+            if response.status_code == 404:
+                return
+            for entry in iter_json_array(response.iter_content(STREAM_CHUNK_SIZE)):
+                self._remember_modify_index(entry['Key'], entry['ModifyIndex'])
+                if self._read_cache is not None:
+                    self._read_cache.invalidate(entry['Key'], entry['ModifyIndex'])
+                yield (entry['Key'], entry['ModifyIndex'], EncodedValue(entry.get('Value')))
+        finally:
+            response.close()
+
+    def get_checks(self, retry_policy=None):
+        response = self._api_get('agent/checks', retry_policy=retry_policy)
+        return response.json()
+
+    def get_service_catalogue(self, retry_policy=None):
+        response = self._api_get('agent/services', retry_policy=retry_policy)
         return response.json()
 
-    def get_value(self, key):
+    def get_services(self, content_hash=None, wait=None, retry_policy=None):
+        """
+        Returns the agent's content hash and services. When content_hash is given
+        the query blocks until the services no longer match it, or wait elapses.
+        """
+        query = []
+        if content_hash:
+            query.append('hash={0}'.format(content_hash))
+            wait = wait or self._config.get('blocking_wait', DEFAULT_BLOCKING_WAIT)
+        if wait is not None:
+            query.append('wait={0}'.format(format_wait(wait)))
+        relative_url = 'agent/services{0}'.format('?' + '&'.join(query) if query else '')
+        if wait is not None:
+            response = self._api_blocking_get(relative_url, wait, retry_policy)
+        else:
+            response = self._api_get(relative_url, retry_policy=retry_policy)
+        return (response.headers.get('X-Consul-ContentHash'), response.json())
+
+    def get_value(self, key, retry_policy=None):
         def decode():
             values = response.json()
             for value in values:
                 value['Value'] = json.loads(base64.b64decode(value['Value']))
+            self._remember_read(key, values[0].get('Value'), values[0].get('ModifyIndex'))
             return values[0].get('Value')
 
         def not_found():
             logging.warning(
                 'Consul key-value store does not contain a value for key \'{0}\''.format(key))
+            self._remember_read(key, None, 0)
             return None
-        response = self._api_get('kv/{0}'.format(key))
+        if self._read_cache is not None:
+            entry = self._read_cache.get(key)
+            if entry is not None:
+                return entry.value
+        response = self._api_get('kv/{0}'.format(key), retry_policy=retry_policy)
         cases = {200: decode, 404: not_found}
         return cases[response.status_code]()
 
-    def key_exists(self, key):
-        return self.get_value(key) is not None
+    def _remember_read(self, key, value, modify_index):
+        self._remember_modify_index(key, modify_index)
+        if self._read_cache is not None:
+            self._read_cache.put(key, value, modify_index)
 
-    def deregister_check(self, id):
-        response = self._api_put('agent/check/deregister/{0}'.format(id), {})
-        return response.status_code == 200
+    def key_exists(self, key, retry_policy=None):
+        if self._read_cache is not None:
+            entry = self._read_cache.get(key)
+            if entry is not None:
+                return entry.value is not None
+        # Listing the key names avoids transferring and decoding the value
+        response = self._api_get('kv/{0}?keys&separator=/'.format(key), retry_policy=retry_policy)
+        return response.status_code == 200 and key in response.json()
 
-    def register_http_check(self, service_id, id, name, url, interval):
-        response = self._api_put('agent/check/register', json.dumps(
-            {'ServiceID': service_id, 'ID': id, 'Name': name, 'HTTP': url, 'Interval': interval}))
+    def deregister_check(self, id, retry_policy=None):
+        response = self._api_put('agent/check/deregister/{0}'.format(id), {},
+                                 retry_policy=self._agent_write_retry_policy(retry_policy))
         return response.status_code == 200
 
-    def register_script_check(self, service_id, id, name, script_path, interval):
-        response = self._api_put('agent/check/register', json.dumps(
-            {'ServiceID': service_id, 'ID': id, 'Name': name, 'Script': script_path, 'Interval': interval}))
+    def register_check(self, definition, retry_policy=None):
+        response = self._api_put('agent/check/register', json.dumps(definition),
+                                 retry_policy=self._agent_write_retry_policy(retry_policy))
         return response.status_code == 200
 
-    def register_service(self, id, name, address, port, tags):
-        response = self._api_put('agent/service/register', json.dumps(
-            {'ID': id, 'Name': name, 'Address': address, 'Port': port, 'Tags': tags}))
+    def register_http_check(self, service_id, id, name, url, interval, retry_policy=None):
+        return self.register_check(http_check_definition(service_id, id, name, url, interval), retry_policy)
+
+    def register_script_check(self, service_id, id, name, script_path, interval, retry_policy=None):
+        return self.register_check(
+            script_check_definition(service_id, id, name, script_path, interval), retry_policy)
+
+    def register_checks(self, definitions, deregister_ids=(), max_workers=None, retry_policy=None):
+        # The agent has no batch endpoint for checks (transactions only cover the
+        # catalog), so registrations and deregistrations share a bounded worker pool
+        def run(task):
+            (operation, argument) = task
+            try:
+                return operation(argument, retry_policy)
+            except ConsulError as e:
+                logging.error(e)
+                return False
+        definitions = list(definitions)
+        deregister_ids = list(deregister_ids)
+        tasks = [(self.register_check, definition) for definition in definitions] + \
+                [(self.deregister_check, id) for id in deregister_ids]
+        if max_workers is None:
+            max_workers = self._config.get('max_workers', self.pool_size)
+        results = map_concurrently(run, tasks, max_workers)
+        registered = dict(zip([definition['ID'] for definition in definitions], results))
+        deregistered = dict(zip(deregister_ids, results[len(definitions):]))
+        return (registered, deregistered)
+
+    def deregister_checks(self, ids, max_workers=None, retry_policy=None):
+        (_, deregistered) = self.register_checks([], ids, max_workers, retry_policy)
+        return deregistered
+
+    def register_service(self, id, name, address, port, tags, checks=None, retry_policy=None):
+        definition = {'ID': id, 'Name': name, 'Address': address, 'Port': port, 'Tags': tags}
+        if checks:
+            # The service and its checks are registered together, in a single request
+            definition['Checks'] = [service_check_definition(check) for check in checks]
+        response = self._api_put('agent/service/register', json.dumps(definition),
+                                 retry_policy=self._agent_write_retry_policy(retry_policy))
         return response.status_code == 200
 
-    def wait_for_change(self, key_prefix):
-        modify_index = self._get_modify_index(key_prefix, False)
-        if modify_index is None:
-            self._last_known_modify_index = modify_index
-            #raise ConsulError('Modify index is invalid.')
-        if self._last_known_modify_index is None:
-            logging.info(
-                'There may be changes that have not been processed yet, skipping blocking query.')
-            self._last_known_modify_index = modify_index
-            return
-        self._last_known_modify_index = modify_index
+    def wait_for_change(self, key_prefix, wait=None, retry_policy=None):
+        """
+        Block until something under key_prefix changes, or wait (a Consul
+        duration such as '30s') elapses. Returns whether a change happened.
+        """
+        (self._last_known_modify_index, is_changed) = self._wait_for_change(
+            key_prefix, self._last_known_modify_index, wait, retry_policy)
+        return is_changed
+
+    def _wait_for_change(self, key_prefix, last_known_modify_index, wait=None, retry_policy=None):
+        """ Returns the modify index to wait on next and whether a change happened """
+        wait = wait or self._config.get('blocking_wait', DEFAULT_BLOCKING_WAIT)
+        if not last_known_modify_index:
+            # Nothing seen yet, so wait for the first change after the current state
+            last_known_modify_index = self._get_modify_index(key_prefix, False, retry_policy)
+            if last_known_modify_index is None:
+                logging.info(
+                    'Modify index for key prefix \'{0}\' is missing, backing off.'.format(key_prefix))
+                self._back_off(key_prefix)
+                return (None, False)
         logging.debug(
             'Blocking query to Consul HTTP API to wait for changes in the \'{0}\' key space...'.format(key_prefix))
-        # TODO: Timeout by default is 5 minutes. This can be changed by adding
-        # wait=10s or wait=10m to the query string
-        self._api_get('kv/{0}?index={1}'.format(key_prefix,
-                                                self._last_known_modify_index))
+        try:
+            response = self._api_blocking_get(
+                'kv/{0}?index={1}&wait={2}'.format(key_prefix, last_known_modify_index, format_wait(wait)),
+                wait, retry_policy)
+        except requests.exceptions.Timeout:
+            logging.warning(
+                'Blocking query on key prefix \'{0}\' timed out, backing off.'.format(key_prefix))
+            self._back_off(key_prefix)
+            return (last_known_modify_index, False)
+        modify_index = response.headers.get('X-Consul-Index')
+        if modify_index is None or int(modify_index) <= 0:
+            logging.info(
+                'Modify index for key prefix \'{0}\' is missing or was reset, backing off.'.format(key_prefix))
+            self._back_off(key_prefix)
+            return (None, False)
+        if int(modify_index) == int(last_known_modify_index):
+            self._reset_back_off(key_prefix)
+            return (modify_index, False)
+        if int(modify_index) < int(last_known_modify_index):
+            # The agent's state was replaced, so anything may have changed
+            logging.info(
+                'Modify index for key prefix \'{0}\' went backwards, backing off.'.format(key_prefix))
+            self._back_off(key_prefix)
+        else:
+            self._reset_back_off(key_prefix)
+        if self._read_cache is not None:
+            self._read_cache.invalidate_prefix(key_prefix)
+        return (modify_index, True)
+
+    def _back_off(self, key_prefix):
+        with self._index_backoff_lock:
+            attempt = self._index_backoff_attempts.get(key_prefix, 0)
+            self._index_backoff_attempts[key_prefix] = attempt + 1
+        delay = min(INDEX_BACKOFF_MAX, INDEX_BACKOFF_BASE * 2 ** attempt)
+        self._sleep(random.uniform(delay / 2, delay))
+
+    def _reset_back_off(self, key_prefix):
+        with self._index_backoff_lock:
+            self._index_backoff_attempts.pop(key_prefix, None)
+
+    def write_value(self, key, value, retry_policy=None):
+        # In optimistic mode the modify index seen by an earlier read is used for the
+        # check-and-set directly; it is only looked up again when the CAS is rejected
+        if self._optimistic_writes:
+            with self._cas_indexes_lock:
+                modify_index = self._cas_indexes.get(key)
+            if modify_index is not None:
+                if self._cas_write(key, value, modify_index, retry_policy):
+                    return True
+                logging.debug(
+                    'Cached modify index for key \'{0}\' is stale, retrieving it again'.format(key))
+        modify_index = self._get_modify_index(key, True, retry_policy)
+        return self._cas_write(key, value, modify_index, retry_policy)
 
-    def write_value(self, key, value):
-        modify_index = self._get_modify_index(key, True)
+    def _cas_write(self, key, value, modify_index, retry_policy=None):
+        # A CAS write that timed out may have been applied, and retrying it would
+        # then be rejected, so only writes that were never sent are retried
         response = self._api_put(
-            'kv/{0}?cas={1}'.format(key, modify_index), json.dumps(value))
+            'kv/{0}?cas={1}'.format(key, modify_index), json.dumps(value),
+            retry_policy=self._without_timeout_retries(retry_policy))
+        # A write moves the modify index, so the cached one can no longer be used
+        self._forget_modify_index(key)
+        if self._read_cache is not None:
+            self._read_cache.invalidate(key)
         return response.text == 'true'
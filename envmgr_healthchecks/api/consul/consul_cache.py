@@ -0,0 +1,65 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import copy
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CacheEntry = namedtuple('CacheEntry', ['value', 'modify_index', 'expires_at'])
+
+
+class ConsulReadCache(object):
+    """
+    LRU cache of decoded key-value reads, bounded by size and TTL. Entries are
+    dropped when a different modify index is observed for their key.
+    """
+
+    def __init__(self, max_size, ttl, clock=time.time):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """ Return the cached entry for key, or None on a miss """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry.expires_at <= self._clock():
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+        return entry._replace(value=copy.deepcopy(entry.value))
+
+    def put(self, key, value, modify_index):
+        entry = CacheEntry(copy.deepcopy(value), modify_index, self._clock() + self._ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key, modify_index=None):
+        """ Drop key, unless modify_index is given and matches the cached one """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (modify_index is None or entry.modify_index != modify_index):
+                del self._entries[key]
+
+    def invalidate_prefix(self, key_prefix, modify_indexes=None):
+        """ Drop keys under key_prefix whose modify index is not in modify_indexes """
+        modify_indexes = modify_indexes or {}
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(key_prefix)]:
+                if self._entries[key].modify_index != modify_indexes.get(key):
+                    del self._entries[key]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
@@ -0,0 +1,140 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import logging
+import threading
+
+DEFAULT_WAIT = '5m'
+ERROR_RETRY_DELAY = 5
+# Agents that do not return a content hash cannot block, so they are polled
+POLL_INTERVAL = 30
+
+
+class ServiceCatalogue(object):
+    """ Immutable snapshot of the agent's services, indexed by id, name and tag """
+
+    def __init__(self, services, content_hash=None):
+        self.content_hash = content_hash
+        self.services = services
+        by_name = {}
+        by_tag = {}
+        name_tags = set()
+        for service_id, service in services.iteritems():
+            name = service.get('Service')
+            by_name.setdefault(name, set()).add(service_id)
+            for tag in service.get('Tags') or []:
+                by_tag.setdefault(tag, set()).add(service_id)
+                name_tags.add((name, tag))
+                name_tags.add((service_id, tag))
+        self._by_name = dict((name, frozenset(ids)) for name, ids in by_name.iteritems())
+        self._by_tag = dict((tag, frozenset(ids)) for tag, ids in by_tag.iteritems())
+        self._name_tags = frozenset(name_tags)
+
+    def __len__(self):
+        return len(self.services)
+
+    def __contains__(self, service_id):
+        return service_id in self.services
+
+    def get_service(self, service_id):
+        return self.services.get(service_id)
+
+    def has_service_name(self, name):
+        return name in self._by_name
+
+    def has_tag(self, tag):
+        return tag in self._by_tag
+
+    def is_registered(self, service, tag=None):
+        """ Whether a service with this id or name, and tag when given, is registered """
+        if tag is None:
+            return service in self.services or service in self._by_name
+        return (service, tag) in self._name_tags
+
+    def ids_by_name(self, name):
+        return self._by_name.get(name, frozenset())
+
+    def ids_by_tag(self, tag):
+        return self._by_tag.get(tag, frozenset())
+
+
+class ConsulServiceCatalogue(object):
+    """
+    Shared, thread-safe view of the agent's services. The snapshot is replaced
+    as a whole on every refresh, so readers never see a partial update; a
+    background thread can keep it current through blocking queries.
+    """
+
+    def __init__(self, consul_api, wait=DEFAULT_WAIT):
+        self._api = consul_api
+        self._wait = wait
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._fetch_sequence = 0
+        self._snapshot_sequence = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def snapshot(self):
+        """ The current ServiceCatalogue, fetched on first use """
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.refresh()
+            snapshot = self._snapshot
+        return snapshot
+
+    def refresh(self, block=False):
+        """
+        Fetch the services again, waiting for them to change first when block is
+        set. Returns whether the snapshot changed.
+        """
+        with self._refresh_lock:
+            previous = self._snapshot
+            self._fetch_sequence += 1
+            sequence = self._fetch_sequence
+        content_hash = previous.content_hash if block and previous is not None else None
+        # The lock is not held during the request, so a lookup that misses does
+        # not wait behind the background thread's blocking query
+        (new_hash, services) = self._api.get_services(
+            content_hash=content_hash, wait=self._wait if content_hash else None)
+        with self._refresh_lock:
+            current = self._snapshot
+            if current is not None and new_hash is not None and new_hash == current.content_hash:
+                return False
+            if sequence < self._snapshot_sequence:
+                # A request started later has already replaced the snapshot
+                return False
+            self._snapshot = ServiceCatalogue(services, new_hash)
+            self._snapshot_sequence = sequence
+            return True
+
+    def is_registered(self, service, tag=None, refresh_on_miss=False):
+        """ Whether a service with this id or name (and tag) is registered, by the snapshot """
+        if self.snapshot.is_registered(service, tag):
+            return True
+        if refresh_on_miss and self.refresh():
+            return self.snapshot.is_registered(service, tag)
+        return False
+
+    def start(self):
+        """ Keep the snapshot current from a background thread until stop() """
+        self.snapshot
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                if self._snapshot.content_hash is None:
+                    self._stop_event.wait(POLL_INTERVAL)
+                self.refresh(block=True)
+            except Exception:
+                logging.exception('Failed to refresh Consul service catalogue')
+                self._stop_event.wait(ERROR_RETRY_DELAY)
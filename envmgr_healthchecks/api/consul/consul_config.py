@@ -15,10 +15,18 @@ class ConsulConfig(object):
             'aws': {'access_key_id': None, 'aws_secret_access_key': None,
                     'deployment_logs': {'bucket_name': None, 'key_prefix': None}},
             'consul': {'host': 'localhost', 'port': 8500, 'scheme': 'http',
-                       'acl_token': None, 'version': 'v1'},
+                       'acl_token': None, 'version': 'v1', 'pool_size': 10,
+                       'keep_alive': True, 'connect_timeout': 5, 'read_timeout': None,
+                       'optimistic_writes': False, 'cas_index_cache_size': 10000,
+                       'read_cache_size': 0, 'read_cache_ttl': 60,
+                       'retry_deadline': 120, 'retry_max_attempts': 5, 'retry_max_delay': 60,
+                       'circuit_breaker_after': None,
+                       'blocking_wait': '5m'},
             'sensu': {
                 'healthcheck_search_paths': ['/etc/some_fake_path', '/opt/sensu_server_scripts'],
-                'sensu_check_path': '/etc/sensu/conf.d/checks.local'
+                'sensu_check_path': '/etc/sensu/conf.d/checks.local',
+                'definition_layout': 'per_check',
+                'output_profile': 'pretty'
             },
             'logging': {
                 'version': 1,
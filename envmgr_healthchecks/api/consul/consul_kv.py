@@ -0,0 +1,103 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import base64
+import json
+from collections import Mapping
+
+_WHITESPACE = ' \t\n\r'
+
+
+def decode_value(encoded_value):
+    # Keys created as folders have no value
+    if encoded_value is None:
+        return None
+    return json.loads(base64.b64decode(encoded_value))
+
+
+class EncodedValue(object):
+    """ Value of a key, decoded on request """
+
+    __slots__ = ('encoded',)
+
+    def __init__(self, encoded):
+        self.encoded = encoded
+
+    def decode(self):
+        return decode_value(self.encoded)
+
+
+def iter_json_array(chunks):
+    """
+    Yield the elements of a JSON array one at a time from an iterable of text
+    chunks, holding at most one element plus one chunk in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    in_array = False
+    for chunk in chunks:
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position == len(buffer):
+                break
+            if not in_array:
+                if buffer[position] != '[':
+                    raise ValueError('Expected a JSON array')
+                in_array = True
+                position += 1
+                continue
+            if buffer[position] == ',':
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                (element, end) = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # The element continues in the next chunk
+                break
+            position = end
+            yield element
+    if in_array:
+        raise ValueError('Unterminated JSON array')
+
+
+class KeyValueTree(Mapping):
+    """
+    Read-only mapping of a key-value subtree. Values are kept base64 encoded
+    and only decoded the first time they are accessed.
+    """
+
+    def __init__(self, entries, modify_index=None):
+        self.modify_index = modify_index
+        self._encoded_values = {}
+        self._modify_indexes = {}
+        self._values = {}
+        for entry in entries:
+            self._encoded_values[entry['Key']] = entry.get('Value')
+            self._modify_indexes[entry['Key']] = entry.get('ModifyIndex')
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._values[key] = decode_value(self._encoded_values[key])
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._encoded_values)
+
+    def __len__(self):
+        return len(self._encoded_values)
+
+    def __contains__(self, key):
+        return key in self._encoded_values
+
+    def get_modify_index(self, key):
+        return self._modify_indexes[key]
+
+    @property
+    def modify_indexes(self):
+        return dict(self._modify_indexes)
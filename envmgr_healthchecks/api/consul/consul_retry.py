@@ -0,0 +1,173 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import logging
+import random
+import threading
+import time
+import requests
+
+DEFAULT_DEADLINE = 120
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+DEFAULT_BREAKER_RESET = 30
+# The agent answers 500 for errors that a retry cannot fix, such as an unknown
+# check or an invalid definition, so only gateway and availability errors are retried
+RETRYABLE_STATUS_CODES = frozenset([502, 503, 504])
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Opens once the agent has been unreachable for open_after seconds, failing
+    calls fast until reset_after seconds have passed; then one call is let
+    through to probe the agent again.
+    """
+
+    def __init__(self, open_after, reset_after=DEFAULT_BREAKER_RESET, clock=time.time):
+        self.open_after = open_after
+        self.reset_after = reset_after
+        self._clock = clock
+        self._unreachable_since = None
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None and self._clock() - self._opened_at < self.reset_after
+
+    def before_call(self):
+        if self.is_open:
+            raise CircuitOpenError(
+                'Consul agent has been unreachable for more than {0}s, failing fast'.format(self.open_after))
+
+    def record_success(self):
+        with self._lock:
+            self._unreachable_since = None
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            now = self._clock()
+            if self._unreachable_since is None:
+                self._unreachable_since = now
+            if now - self._unreachable_since >= self.open_after:
+                self._opened_at = now
+
+
+class RetryPolicy(object):
+    """
+    Retries Consul HTTP API calls on connection errors, timeouts and 502, 503
+    and 504 responses, with decorrelated jitter between attempts and a total
+    deadline.
+    """
+
+    def __init__(self, deadline=DEFAULT_DEADLINE, max_attempts=None, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY, retry_on_server_error=True, retry_on_timeout=True,
+                 circuit_breaker=None, clock=time.time, sleep=time.sleep, random_generator=None):
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on_server_error = retry_on_server_error
+        self.retry_on_timeout = retry_on_timeout
+        self.circuit_breaker = circuit_breaker
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random_generator or random.Random()
+        self._retry_counts = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, consul_config):
+        open_after = consul_config.get('circuit_breaker_after', None)
+        return cls(
+            deadline=consul_config.get('retry_deadline', DEFAULT_DEADLINE),
+            max_attempts=consul_config.get('retry_max_attempts', DEFAULT_MAX_ATTEMPTS),
+            max_delay=consul_config.get('retry_max_delay', DEFAULT_MAX_DELAY),
+            circuit_breaker=CircuitBreaker(open_after) if open_after is not None else None)
+
+    def replace(self, **changes):
+        """
+        Copy of this policy with some settings changed. The copy shares the
+        circuit breaker and the retry counts of this policy.
+        """
+        settings = dict(
+            deadline=self.deadline, max_attempts=self.max_attempts, base_delay=self.base_delay,
+            max_delay=self.max_delay, retry_on_server_error=self.retry_on_server_error,
+            retry_on_timeout=self.retry_on_timeout, circuit_breaker=self.circuit_breaker,
+            clock=self._clock, sleep=self._sleep, random_generator=self._random)
+        settings.update(changes)
+        policy = RetryPolicy(**settings)
+        policy._retry_counts = self._retry_counts
+        policy._lock = self._lock
+        return policy
+
+    @property
+    def retry_counts(self):
+        """ Number of retries made so far, by endpoint """
+        with self._lock:
+            return dict(self._retry_counts)
+
+    def call(self, func, endpoint=None, on_retry=None):
+        """
+        Call func until it returns a response that is not retryable, or the
+        attempts or deadline run out. The last response is returned, or the last
+        exception raised, once they do.
+        """
+        start = self._clock()
+        attempt = 0
+        delay = self.base_delay
+        while True:
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.before_call()
+            attempt += 1
+            try:
+                response = func()
+            except Exception as e:
+                if not self._is_retryable_error(e):
+                    raise
+                self._record_failure(e)
+                outcome = e
+            else:
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record_success()
+                if not self._is_retryable_response(response):
+                    return response
+                outcome = response
+
+            delay = min(self.max_delay, self._random.uniform(self.base_delay, delay * 3))
+            is_exhausted = self.max_attempts is not None and attempt >= self.max_attempts
+            if self.deadline is not None and self._clock() - start + delay > self.deadline:
+                is_exhausted = True
+            if is_exhausted:
+                if isinstance(outcome, Exception):
+                    raise outcome
+                return outcome
+            if not isinstance(outcome, Exception):
+                # Release the connection of a response that is thrown away
+                outcome.close()
+            logging.debug('Retrying Consul HTTP API call to {0} in {1:.2f}s (attempt {2})'.format(
+                endpoint, delay, attempt))
+            with self._lock:
+                self._retry_counts[endpoint] = self._retry_counts.get(endpoint, 0) + 1
+            if on_retry is not None:
+                on_retry()
+            self._sleep(delay)
+
+    def _record_failure(self, exception):
+        if self.circuit_breaker is not None and isinstance(exception, requests.exceptions.ConnectionError):
+            self.circuit_breaker.record_failure()
+
+    def _is_retryable_error(self, exception):
+        if isinstance(exception, requests.exceptions.ConnectionError):
+            return True
+        return self.retry_on_timeout and isinstance(exception, requests.exceptions.Timeout)
+
+    def _is_retryable_response(self, response):
+        return self.retry_on_server_error and response.status_code in RETRYABLE_STATUS_CODES
@@ -0,0 +1,147 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import logging
+import Queue
+import random
+import threading
+import time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+from envmgr_healthchecks.api.consul.consul_api import INDEX_BACKOFF_BASE, INDEX_BACKOFF_MAX
+from envmgr_healthchecks.concurrency import map_concurrently
+
+DEFAULT_WAIT = '5m'
+DEFAULT_MAX_WORKERS = 8
+ERROR_RETRY_DELAY = 5
+
+WatchEvent = namedtuple(
+    'WatchEvent', ['prefix', 'old_index', 'new_index', 'changed_keys'])
+
+
+class ConsulWatch(object):
+    """
+    Follows several key prefixes through concurrent blocking queries, keeping
+    a separate modify index per prefix. Change events are passed to every
+    callback and put on the queue, when one is given.
+
+    Every prefix needs a worker of its own for its blocking query, so at most
+    max_workers prefixes (8 by default) can be watched.
+    """
+
+    def __init__(self, consul_api, key_prefixes, wait=DEFAULT_WAIT, callbacks=None, queue=None,
+                 max_workers=None):
+        self._api = consul_api
+        self._key_prefixes = list(key_prefixes)
+        self._wait = wait
+        self._callbacks = list(callbacks or [])
+        self._queue = queue
+        self._max_workers = max_workers or DEFAULT_MAX_WORKERS
+        if len(self._key_prefixes) > self._max_workers:
+            # Extra prefixes would only be queried once another query returned,
+            # so their changes could go unnoticed for several wait periods
+            raise ValueError(
+                'Cannot watch {0} key prefixes with {1} workers, pass max_workers={0} '
+                'or watch a common parent prefix'.format(len(self._key_prefixes), self._max_workers))
+        self._modify_indexes = dict((prefix, 0) for prefix in self._key_prefixes)
+        self._key_modify_indexes = dict((prefix, {}) for prefix in self._key_prefixes)
+        self._backoff_attempts = {}
+        self._backoff_lock = threading.Lock()
+        self._sleep = time.sleep
+
+    def modify_index(self, key_prefix):
+        return self._modify_indexes[key_prefix]
+
+    def poll(self):
+        """ Run one blocking query per key prefix and publish the resulting change events """
+        events = [event for event in map_concurrently(
+            self._poll_prefix, self._key_prefixes, self._max_workers) if event is not None]
+        for event in events:
+            self._publish(event)
+        return events
+
+    def run(self, stop_event):
+        """ Publish change events until stop_event is set; returns within one wait period """
+        completed = Queue.Queue()
+        pool = ThreadPool(processes=max(1, len(self._key_prefixes)))
+
+        def submit(prefix):
+            pool.apply_async(self._poll_prefix_safely, (prefix,), callback=completed.put)
+
+        try:
+            for prefix in self._key_prefixes:
+                submit(prefix)
+            while not stop_event.is_set():
+                try:
+                    (prefix, event) = completed.get(timeout=1)
+                except Queue.Empty:
+                    continue
+                if event is not None:
+                    self._publish(event)
+                if not stop_event.is_set():
+                    submit(prefix)
+        finally:
+            # Queries in flight return within one wait period
+            pool.close()
+            pool.join()
+
+    def _poll_prefix_safely(self, prefix):
+        try:
+            return (prefix, self._poll_prefix(prefix))
+        except Exception:
+            logging.exception(
+                'Failed to watch key prefix \'{0}\''.format(prefix))
+            self._sleep(ERROR_RETRY_DELAY)
+            return (prefix, None)
+
+    def _poll_prefix(self, prefix):
+        old_index = self._modify_indexes[prefix]
+        (new_index, key_indexes) = self._api.get_key_indexes(
+            prefix, index=old_index, wait=self._wait)
+        new_index = int(new_index or 0)
+        if new_index <= 0:
+            # Without an index the next query would not block, so back off instead
+            logging.info(
+                'Modify index for key prefix \'{0}\' is missing, backing off.'.format(prefix))
+            self._back_off(prefix)
+            return None
+        if new_index == old_index:
+            self._reset_back_off(prefix)
+            return None
+        if new_index < old_index:
+            # The index went backwards (e.g. the agent was restored), so every key is reported
+            logging.info(
+                'Modify index for key prefix \'{0}\' was reset, resynchronising.'.format(prefix))
+            self._key_modify_indexes[prefix] = {}
+            self._back_off(prefix)
+        else:
+            self._reset_back_off(prefix)
+
+        known_key_indexes = self._key_modify_indexes[prefix]
+        changed_keys = sorted(
+            [key for key, index in key_indexes.iteritems() if known_key_indexes.get(key) != index] +
+            [key for key in known_key_indexes if key not in key_indexes])
+        self._modify_indexes[prefix] = new_index
+        self._key_modify_indexes[prefix] = key_indexes
+        if not changed_keys:
+            return None
+        return WatchEvent(prefix, old_index, new_index, changed_keys)
+
+    def _back_off(self, prefix):
+        with self._backoff_lock:
+            attempt = self._backoff_attempts.get(prefix, 0)
+            self._backoff_attempts[prefix] = attempt + 1
+        delay = min(INDEX_BACKOFF_MAX, INDEX_BACKOFF_BASE * 2 ** attempt)
+        self._sleep(random.uniform(delay / 2, delay))
+
+    def _reset_back_off(self, prefix):
+        with self._backoff_lock:
+            self._backoff_attempts.pop(prefix, None)
+
+    def _publish(self, event):
+        logging.debug('Change detected in key prefix \'{0}\': {1}'.format(
+            event.prefix, ', '.join(event.changed_keys)))
+        for callback in self._callbacks:
+            callback(event)
+        if self._queue is not None:
+            self._queue.put(event)
@@ -0,0 +1,49 @@
+""" Atomic File Writes """
+
+import os
+import sys
+import tempfile
+
+IS_WINDOWS = os.name == 'nt'
+MOVEFILE_REPLACE_EXISTING = 0x1
+MOVEFILE_WRITE_THROUGH = 0x8
+
+
+def _move_file_ex(source, destination):
+    # os.rename does not replace an existing file on Windows under Python 2
+    import ctypes
+    encoding = sys.getfilesystemencoding()
+    if isinstance(source, str):
+        source = source.decode(encoding)
+    if isinstance(destination, str):
+        destination = destination.decode(encoding)
+    if not ctypes.windll.kernel32.MoveFileExW(
+            source, destination, MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+        raise ctypes.WinError()
+
+
+def replace_file(source, destination):
+    """ Move source over destination, replacing it if it exists, on every platform """
+    if IS_WINDOWS:
+        _move_file_ex(source, destination)
+    else:
+        os.rename(source, destination)
+
+
+def write_file_atomically(path, content, mode=0o644):
+    """
+    Write content to a temporary file next to path and move it into place, so
+    that readers never see a partially written file
+    """
+    (directory, filename) = os.path.split(path)
+    (file_descriptor, temporary_path) = tempfile.mkstemp(
+        prefix='.{0}.'.format(filename), suffix='.tmp', dir=directory or '.')
+    try:
+        with os.fdopen(file_descriptor, 'w') as temporary_file:
+            temporary_file.write(content)
+        os.chmod(temporary_path, mode)
+        replace_file(temporary_path, path)
+    except Exception:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
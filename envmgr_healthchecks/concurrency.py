@@ -0,0 +1,17 @@
+""" Bounded concurrency helpers """
+
+from multiprocessing.pool import ThreadPool
+
+
+def map_concurrently(func, items, max_workers):
+    """ Apply func to every item on at most max_workers threads, preserving order """
+    items = list(items)
+    workers = min(max_workers, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(processes=workers)
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
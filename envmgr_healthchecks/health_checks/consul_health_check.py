@@ -1,9 +1,13 @@
 """ Consul Health Check """
 
+import hashlib
+import json
 import os
-import stat
-from envmgr_healthchecks.health_checks.health_check import HealthCheck
+import time
+from envmgr_healthchecks.health_checks.health_check import DeregistrationReport, HealthCheck
 from envmgr_healthchecks.health_checks.health_check_errors import RegisterError
+from envmgr_healthchecks.health_checks.script_files import prepare_scripts
+from envmgr_healthchecks.api.consul.consul_api import http_check_definition, script_check_definition
 from envmgr_healthchecks.api.consul.consul_config import ConsulConfig
 
 
@@ -22,8 +26,20 @@ class ConsulHealthCheck(HealthCheck):
             api: default will be constructed if you do not provide one
             last_id:
             last_archive_dir:
+            batch: register all checks concurrently and deregister the previous
+                deployment's stale checks in the same pass
+            max_workers: bound on concurrent Consul calls in batch mode and on
+                concurrent script file operations
+            manifest_loader: shared manifest cache is used if you do not provide one
+            metrics: shared metrics are recorded if you do not provide them
+            service_catalogue: shared ConsulServiceCatalogue snapshot of the
+                agent's services
+            require_registered_service: fail registration when the service is
+                not in service_catalogue, default False
         """
-        HealthCheck.__init__(self, name=kwargs.get('name', ''))
+        HealthCheck.__init__(self, name=kwargs.get('name', ''),
+                             manifest_loader=kwargs.get('manifest_loader', None),
+                             metrics=kwargs.get('metrics', None))
         self.logger = kwargs.get('logger', self.logger)
         self.archive_dir = kwargs.get('archive_dir', None)
         self.appspec = kwargs.get('appspec', None)
@@ -31,7 +47,14 @@ class ConsulHealthCheck(HealthCheck):
         self.service_id = kwargs.get('service_id', None)
         self.api = ConsulConfig().get(kwargs.get('api', None))
         self.last_id = kwargs.get('last_id', None)
-        self.last_archive_dir = kwargs.get('last_architve_dir', None)
+        # 'last_architve_dir' is the original, misspelt keyword and is still accepted
+        self.last_archive_dir = kwargs.get(
+            'last_archive_dir', kwargs.get('last_architve_dir', None))
+        self.batch = kwargs.get('batch', False)
+        self.max_workers = kwargs.get('max_workers', None)
+        self.service_catalogue = kwargs.get('service_catalogue', None)
+        self.require_registered_service = kwargs.get('require_registered_service', False)
+        self.deregistration_report = None
 
     def register(self):
         """ Register this health check """
@@ -42,32 +65,28 @@ class ConsulHealthCheck(HealthCheck):
             self.appspec
         )
         if healthchecks is None:
-            return
+            if not self.batch:
+                return
+            # deregister() is skipped in batch mode, so the previous deployment's
+            # checks are still removed when the new one has none
+            healthchecks = {}
 
-        self._validate_checks(healthchecks, scripts_base_dir)
-        deployment_slice = self.service_slice
-        if deployment_slice is not None and deployment_slice.lower() == 'none':
-            deployment_slice = None
+        with self.measure_phase('consul', 'validate'):
+            self._validate_checks(healthchecks, scripts_base_dir)
+            self._validate_service_registered()
+        with self.measure_phase('consul', 'register'):
+            if self.batch:
+                return self._register_batch(healthchecks, scripts_base_dir)
+            self._register_each(healthchecks, scripts_base_dir)
 
+    def _register_each(self, healthchecks, scripts_base_dir):
         for check_id, check in healthchecks.iteritems():
             service_check_id = self.create_service_check_id(
                 self.service_id, check_id)
 
             if check['type'] == 'script':
-                file_path = os.path.join(
-                    self.archive_dir, scripts_base_dir, check['script'])
-
-                # Add execution permission to file
-                file_stats = os.stat(file_path)
-                os.chmod(file_path, file_stats.st_mode | stat.S_IEXEC |
-                         stat.S_IXGRP | stat.S_IXOTH)
-
-                # Pass slice name as argument to healthcheck
-                if deployment_slice is not None:
-                    file_path += ' {0}'.format(deployment_slice)
-
-                self.logger.debug(
-                    'Healthcheck {0} full path: {1}'.format(check_id, file_path))
+                file_path = self._prepare_script(
+                    check_id, check, scripts_base_dir)
                 is_success = self.api.register_script_check(
                     self.service_id,
                     service_check_id,
@@ -91,35 +110,213 @@ class ConsulHealthCheck(HealthCheck):
                 raise RegisterError(
                     'Failed to register Consul health check \'{0}\''.format(check_id))
 
+    def register_service(self, name=None, address='', port=0, tags=None):
+        """
+        Register the service together with its health checks in a single
+        request, so that the service is never registered without its checks.
+        """
+        self.logger.info('Registering Consul service with its healthchecks.')
+        (healthchecks, scripts_base_dir) = self.find_health_checks(
+            'consul',
+            self.archive_dir,
+            self.appspec
+        )
+        healthchecks = healthchecks or {}
+
+        with self.measure_phase('consul', 'validate'):
+            self._validate_checks(healthchecks, scripts_base_dir)
+        with self.measure_phase('consul', 'register'):
+            definitions = [self._create_check_definition(check_id, check, scripts_base_dir)
+                           for check_id, check in sorted(healthchecks.iteritems())]
+            is_success = self.api.register_service(
+                self.service_id, name or self.service_id, address, port, tags or [], checks=definitions)
+        if not is_success:
+            raise RegisterError(
+                'Failed to register Consul service \'{0}\' with {1} health checks'.format(
+                    self.service_id, len(definitions)))
+        self.logger.info(
+            'Successfuly registered Consul service \'{0}\' with {1} health checks'.format(
+                self.service_id, len(definitions)))
+        return sorted(healthchecks)
+
     def deregister(self):
-        """ deregister this health check """
+        """
+        Deregister the previous deployment's checks concurrently, on at most
+        max_workers threads, and return a DeregistrationReport. In batch mode
+        they are deregistered by register() instead, which then sets
+        deregistration_report.
+        """
+        start = time.time()
+        if self.batch:
+            self.logger.info(
+                'Skipping {0} stage, previous deployment checks are deregistered '
+                'during batch registration.'.format(self.name))
+            return DeregistrationReport([], [], time.time() - start)
+        healthchecks = self._find_previous_health_checks() or {}
+        check_ids = dict((self.create_service_check_id(self.service_id, check_id), check_id)
+                         for check_id in healthchecks)
+        with self.measure_phase('consul', 'deregister'):
+            results = self.api.deregister_checks(sorted(check_ids), self.max_workers) if check_ids else {}
+        return self._report_deregistration(check_ids, results, start)
+
+    def _report_deregistration(self, check_ids, results, start):
+        deregistered = []
+        failed = []
+        for service_check_id, check_id in sorted(check_ids.iteritems()):
+            if results.get(service_check_id, False):
+                self.logger.info(
+                    'Successfuly deregistered Consul health check \'{0}\''.format(check_id))
+                deregistered.append(check_id)
+            else:
+                self.logger.warning(
+                    'Failed to deregister Consul health check \'{0}\''.format(check_id))
+                failed.append(check_id)
+        self.deregistration_report = DeregistrationReport(deregistered, failed, time.time() - start)
+        if check_ids:
+            self.logger.info(
+                'Deregistered Consul health checks: {0} deregistered, {1} failed in {2:.3f}s.'.format(
+                    len(deregistered), len(failed), self.deregistration_report.elapsed))
+        return self.deregistration_report
+
+    def _find_previous_health_checks(self):
         if self.last_id is None:
             self.logger.info(
                 'Skipping {0} stage as there is no previous deployment.'.format(self.name))
-        else:
-            self.logger.info(
-                'Deregistering Consul healthchecks from previous deployment.')
-            previous_appspec = self._get_previous_deployment_appspec(
-                self.last_archive_dir)
-            if previous_appspec is None:
-                self.logger.warning(
-                    'Previous deployment directory not found, id: {0}'.format(self.last_id))
-            else:
-                (healthchecks, _) = self.find_health_checks(
-                    'consul', self.last_archive_dir, previous_appspec)
-                if healthchecks is None:
-                    return
-                for check_id, _ in healthchecks.iteritems():
-                    service_check_id = self.create_service_check_id(
-                        self.service_id, check_id)
-                    is_success = self.api.deregister_check(
-                        service_check_id)
-                    if is_success:
-                        self.logger.info(
-                            'Successfuly deregistered Consul health check \'{0}\''.format(check_id))
-                    else:
-                        self.logger.warning(
-                            'Failed to deregister Consul health check \'{0}\''.format(check_id))
+            return None
+        self.logger.info(
+            'Deregistering Consul healthchecks from previous deployment.')
+        previous_appspec = self._get_previous_deployment_appspec(
+            self.last_archive_dir)
+        if previous_appspec is None:
+            self.logger.warning(
+                'Previous deployment directory not found, id: {0}'.format(self.last_id))
+            return None
+        (healthchecks, _) = self.find_health_checks(
+            'consul', self.last_archive_dir, previous_appspec)
+        return healthchecks
+
+    def reconcile(self):
+        """ Register only added or changed checks and deregister removed ones """
+        self.logger.info('Reconciling Consul healthchecks.')
+        (healthchecks, scripts_base_dir) = self.find_health_checks(
+            'consul',
+            self.archive_dir,
+            self.appspec
+        )
+        healthchecks = healthchecks or {}
+        with self.measure_phase('consul', 'validate'):
+            self._validate_checks(healthchecks, scripts_base_dir)
+
+        desired = {}
+        for check_id, check in healthchecks.iteritems():
+            definition = self._create_check_definition(
+                check_id, check, scripts_base_dir)
+            # The fingerprint is stored with the check so later deployments can tell it is unchanged
+            definition['Notes'] = self._create_check_fingerprint(definition)
+            desired[definition['ID']] = definition
+
+        # Only checks created by the registrar for this service are considered
+        check_id_prefix = self.create_service_check_id(self.service_id, '')
+        current = {}
+        for service_check_id, check in self.api.get_checks().iteritems():
+            if check.get('ServiceID') == self.service_id and service_check_id.startswith(check_id_prefix):
+                current[service_check_id] = check
+
+        added = sorted(id for id in desired if id not in current)
+        updated = sorted(id for id in desired
+                         if id in current and current[id].get('Notes') != desired[id]['Notes'])
+        removed = sorted(id for id in current if id not in desired)
+        unchanged = sorted(set(desired) - set(added) - set(updated))
+
+        (registered, deregistered) = self.api.register_checks(
+            [desired[id] for id in added + updated], removed, self.max_workers)
+        failed_registrations = sorted(id for id, is_success in registered.iteritems() if not is_success)
+        failed_deregistrations = sorted(id for id, is_success in deregistered.iteritems() if not is_success)
+
+        # A full redeployment deregisters every current check and registers every desired one
+        api_calls = 1 + len(added) + len(updated) + len(removed)
+        report = {
+            'added': added,
+            'updated': updated,
+            'removed': removed,
+            'unchanged': unchanged,
+            'failed': failed_registrations + failed_deregistrations,
+            'api_calls_saved': max(0, len(current) + len(desired) - api_calls)
+        }
+        self.logger.info(
+            'Reconciled Consul health checks: {0} added, {1} updated, {2} removed, {3} unchanged, '
+            '{4} API calls saved.'.format(len(added), len(updated), len(removed), len(unchanged),
+                                          report['api_calls_saved']))
+        if failed_registrations:
+            raise RegisterError(
+                'Failed to register Consul health checks: {0}'.format(', '.join(failed_registrations)))
+        return report
+
+    def _create_check_fingerprint(self, definition):
+        content = json.dumps(definition, sort_keys=True)
+        return 'healthcheck-registrar:{0}'.format(hashlib.sha1(content).hexdigest())
+
+    def _register_batch(self, healthchecks, scripts_base_dir):
+        definitions = {}
+        for check_id, check in healthchecks.iteritems():
+            definitions[check_id] = self._create_check_definition(
+                check_id, check, scripts_base_dir)
+
+        # Checks that are re-registered under the same id are replaced by the
+        # agent, so only those missing from the new manifest are deregistered
+        previous_healthchecks = self._find_previous_health_checks() or {}
+        stale_ids = dict((self.create_service_check_id(self.service_id, check_id), check_id)
+                         for check_id in previous_healthchecks if check_id not in healthchecks)
+
+        start = time.time()
+        (registered, deregistered) = self.api.register_checks(
+            definitions.values(), sorted(stale_ids), self.max_workers)
+        # The stale checks share one concurrent pass with the registrations, so
+        # the report's wall time covers both
+        self._report_deregistration(stale_ids, deregistered, start)
+
+        results = {}
+        for check_id, definition in definitions.iteritems():
+            results[check_id] = registered.get(definition['ID'], False)
+            if results[check_id]:
+                self.logger.info(
+                    'Successfuly registered Consul health check \'{0}\''.format(check_id))
+        failed = sorted(check_id for check_id, is_success in results.iteritems() if not is_success)
+        if failed:
+            raise RegisterError(
+                'Failed to register Consul health checks: {0}'.format(', '.join(failed)))
+        return results
+
+    def _create_check_definition(self, check_id, check, scripts_base_dir):
+        service_check_id = self.create_service_check_id(
+            self.service_id, check_id)
+        if check['type'] == 'script':
+            return script_check_definition(
+                self.service_id,
+                service_check_id,
+                check['name'],
+                self._prepare_script(check_id, check, scripts_base_dir),
+                check['interval'])
+        return http_check_definition(
+            self.service_id,
+            service_check_id,
+            check['name'],
+            check['http'],
+            check['interval'])
+
+    def _prepare_script(self, check_id, check, scripts_base_dir):
+        # Execution permission was added when the checks were validated
+        file_path = os.path.join(
+            self.archive_dir, scripts_base_dir, check['script'])
+
+        # Pass slice name as argument to healthcheck
+        deployment_slice = self.service_slice
+        if deployment_slice is not None and deployment_slice.lower() != 'none':
+            file_path += ' {0}'.format(deployment_slice)
+
+        self.logger.debug(
+            'Healthcheck {0} full path: {1}'.format(check_id, file_path))
+        return file_path
 
     def _validate_checks(self, healthchecks, scripts_base_dir):
         ids_list = [identifier.lower() for identifier in healthchecks.keys()]
@@ -132,18 +329,32 @@ class ConsulHealthCheck(HealthCheck):
             raise RegisterError(
                 'Consul health checks require unique names (case insensitive)')
 
+        script_checks = []
         for check_id, check in healthchecks.iteritems():
             self._validate_check(check_id, check)
             if check['type'] == 'script':
                 if check['script'].startswith('/'):
                     check['script'] = check['script'][1:]
+                script_checks.append(check)
 
-                file_path = os.path.join(
-                    self.archive_dir, scripts_base_dir, check['script'])
-                if not os.path.exists(file_path):
-                    raise RegisterError('Couldn\'t find health check script in '
-                                        'package with path: {0}'.format(
-                                            os.path.join(scripts_base_dir, check['script'])))
+        # Every script is stat'ed and made executable once, ahead of registration
+        file_paths = [os.path.join(self.archive_dir, scripts_base_dir, check['script'])
+                      for check in script_checks]
+        with self.measure_phase('consul', 'scripts'):
+            file_stats = prepare_scripts(file_paths, self.max_workers)
+        for check, file_path in zip(script_checks, file_paths):
+            if file_stats[file_path] is None:
+                raise RegisterError('Couldn\'t find health check script in '
+                                    'package with path: {0}'.format(
+                                        os.path.join(scripts_base_dir, check['script'])))
+
+    def _validate_service_registered(self):
+        # The agent rejects checks of an unknown service, so fail before registering any
+        if not self.require_registered_service or self.service_catalogue is None:
+            return
+        if not self.service_catalogue.is_registered(self.service_id, refresh_on_miss=True):
+            raise RegisterError(
+                'Consul service \'{0}\' is not registered with the agent'.format(self.service_id))
 
     def _validate_check(self, check_id, check):
         if not 'type' in check or (check['type'] != 'script' and check['type'] != 'http'):
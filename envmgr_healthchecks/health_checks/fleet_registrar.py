@@ -0,0 +1,159 @@
+""" Fleet Registrar """
+
+import logging
+import sys
+import time
+from collections import namedtuple
+from envmgr_healthchecks.concurrency import map_concurrently
+from envmgr_healthchecks.health_checks.consul_health_check import ConsulHealthCheck
+from envmgr_healthchecks.health_checks.manifest_loader import shared_manifest_loader
+from envmgr_healthchecks.health_checks.sensu_heath_check import SensuHealthCheck
+from envmgr_healthchecks.metrics import shared_metrics
+
+DEFAULT_MAX_WORKERS = 4
+
+
+class ServiceDeployment(namedtuple('ServiceDeployment', [
+        'service_id', 'archive_dir', 'appspec', 'service_slice', 'last_id', 'last_archive_dir'])):
+    """ One service deployment on the host """
+
+    def __new__(cls, service_id, archive_dir, appspec=None, service_slice=None,
+                last_id=None, last_archive_dir=None):
+        return super(ServiceDeployment, cls).__new__(
+            cls, service_id, archive_dir, appspec, service_slice, last_id, last_archive_dir)
+
+
+class ServiceResult(namedtuple('ServiceResult', [
+        'service_id', 'consul', 'sensu', 'error', 'elapsed', 'consul_deregistration', 'sensu_deregistration'])):
+    """
+    Outcome of registering the health checks of one service deployment. The
+    deregistration fields hold the DeregistrationReport of the previous
+    deployment's checks, or None when registration failed before it.
+    """
+
+    @property
+    def is_success(self):
+        return self.error is None
+
+
+class FleetRegistrar(object):
+    """
+    Registers the Consul and Sensu health checks of many service deployments
+    concurrently, sharing one Consul API connection pool and manifest cache.
+    """
+
+    def __init__(self, api, **kwargs):
+        """
+        Keyword Arguments:
+            logger: default will be provided if none given
+            platform: linux/windows
+            instance_tags: tags of the instance, added to Sensu check definitions
+            sensu: Sensu configuration
+            max_workers: number of services registered at the same time
+            check_max_workers: bound on concurrent Consul calls and script file
+                operations within each service
+            Both are capped so that max_workers * check_max_workers does not
+            exceed the pool_size of the shared Consul API connection pool.
+            batch: register each service's Consul checks in batch mode
+            manifest_loader: shared manifest cache is used if you do not provide one
+            service_catalogue: ConsulServiceCatalogue shared by every service
+            metrics: shared metrics are recorded, and flushed after each run, if you
+                do not provide them
+        """
+        self.api = api
+        self.logger = kwargs.get('logger', logging.getLogger('FleetRegistrar'))
+        self.platform = kwargs.get('platform', None)
+        self.instance_tags = kwargs.get('instance_tags', {})
+        self.sensu = kwargs.get('sensu', None)
+        (self.max_workers, self.check_max_workers) = self._get_worker_limits(
+            kwargs.get('max_workers', None) or DEFAULT_MAX_WORKERS,
+            kwargs.get('check_max_workers', None))
+        self.batch = kwargs.get('batch', True)
+        self.manifest_loader = kwargs.get('manifest_loader', shared_manifest_loader)
+        self.metrics = kwargs.get('metrics', shared_metrics)
+        self.service_catalogue = kwargs.get('service_catalogue', None)
+
+    def _get_worker_limits(self, max_workers, check_max_workers):
+        # More concurrent requests than pooled connections would open and discard
+        # extra connections instead of reusing the keep-alive ones
+        pool_size = self.api.pool_size
+        if max_workers > pool_size:
+            self.logger.warning(
+                'Registering {0} services at a time would exceed the Consul connection pool '
+                'size of {1}, registering {1} at a time.'.format(max_workers, pool_size))
+            max_workers = pool_size
+        per_service = pool_size // max_workers
+        return (max_workers, min(check_max_workers or per_service, per_service))
+
+    def register(self, deployments):
+        """ Register every deployment, returns a ServiceResult for each, in order """
+        start = time.time()
+        results = map_concurrently(self._register_service, deployments, self.max_workers)
+        failed = [result.service_id for result in results if not result.is_success]
+        self.metrics.flush()
+        self.logger.info('Registered health checks of {0} services in {1:.2f}s, {2} failed{3}'.format(
+            len(results), time.time() - start, len(failed),
+            ': {0}'.format(', '.join(failed)) if failed else ''))
+        return results
+
+    def _register_service(self, deployment):
+        start = time.time()
+        consul_result = None
+        sensu_result = None
+        consul_health_check = None
+        sensu_deregistration = None
+        try:
+            consul_health_check = self._create_consul_health_check(deployment)
+            consul_health_check.deregister()
+            consul_result = consul_health_check.register()
+            sensu_health_check = self._create_sensu_health_check(deployment)
+            sensu_deregistration = sensu_health_check.deregister()
+            sensu_result = sensu_health_check.register()
+            error = None
+        except Exception:
+            error = str(sys.exc_info()[1])
+            self.logger.exception('Failed to register health checks of service \'{0}\''.format(
+                deployment.service_id))
+        elapsed = time.time() - start
+        self.metrics.timing('healthcheck.service.duration', elapsed, success=str(error is None).lower())
+        # In batch mode the previous checks are deregistered by register(), so the
+        # report is taken from the health check rather than from deregister()
+        consul_deregistration = consul_health_check.deregistration_report \
+            if consul_health_check is not None else None
+        return ServiceResult(
+            deployment.service_id, consul_result, sensu_result, error, elapsed,
+            consul_deregistration, sensu_deregistration)
+
+    def _create_consul_health_check(self, deployment):
+        return ConsulHealthCheck(
+            name='ConsulHealthCheck',
+            logger=self.logger,
+            api=self.api,
+            service_id=deployment.service_id,
+            service_slice=deployment.service_slice,
+            archive_dir=deployment.archive_dir,
+            appspec=deployment.appspec,
+            last_id=deployment.last_id,
+            last_archive_dir=deployment.last_archive_dir,
+            batch=self.batch,
+            max_workers=self.check_max_workers,
+            manifest_loader=self.manifest_loader,
+            metrics=self.metrics,
+            service_catalogue=self.service_catalogue)
+
+    def _create_sensu_health_check(self, deployment):
+        return SensuHealthCheck(
+            name='SensuHealthCheck',
+            logger=self.logger,
+            platform=self.platform,
+            instance_tags=self.instance_tags,
+            sensu=self.sensu,
+            service_id=deployment.service_id,
+            service_slice=deployment.service_slice,
+            archive_dir=deployment.archive_dir,
+            appspec=deployment.appspec,
+            last_id=deployment.last_id,
+            last_archive_dir=deployment.last_archive_dir,
+            max_workers=self.check_max_workers,
+            manifest_loader=self.manifest_loader,
+            metrics=self.metrics)
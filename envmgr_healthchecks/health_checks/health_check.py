@@ -1,20 +1,36 @@
 """ Health Check """
 
 import os
-import yaml
 import logging
+from collections import namedtuple
+from envmgr_healthchecks.health_checks.manifest_loader import shared_manifest_loader
+from envmgr_healthchecks.metrics import shared_metrics
+
+
+class DeregistrationReport(namedtuple('DeregistrationReport', ['deregistered', 'failed', 'elapsed'])):
+    """ Checks of the previous deployment that were or failed to be deregistered, and the wall time taken """
+
+    @property
+    def is_success(self):
+        return not self.failed
 
 
 class HealthCheck(object):
     """ Health Check Base """
-    def __init__(self, name=None):
+    def __init__(self, name=None, manifest_loader=None, metrics=None):
         self.logger = logging.getLogger("HealthCheck")
         self.name = name
+        self.manifest_loader = manifest_loader or shared_manifest_loader
+        self.metrics = metrics or shared_metrics
 
     def create_service_check_id(self, service_id, check_id):
         """ create a service id """
         return str(service_id) + ':' + str(check_id)
 
+    def measure_phase(self, check_type, phase):
+        """ Time a registration phase into the healthcheck.phase.duration histogram """
+        return self.metrics.timer('healthcheck.phase.duration', check_type=check_type, phase=phase)
+
     def find_health_checks(self, check_type, archive_dir, appspec):
         """ find the health checks """
         relative_path = os.path.join(
@@ -25,8 +41,8 @@ class HealthCheck(object):
         if os.path.exists(absolute_filepath):
             self.logger.debug('Found {0}'.format(relative_path))
             scripts_base_dir = os.path.join('healthchecks', check_type)
-            healthchecks_stream = file(absolute_filepath, 'r')
-            healthchecks_object = yaml.load(healthchecks_stream)
+            with self.measure_phase(check_type, 'parse'):
+                healthchecks_object = self.manifest_loader.load(absolute_filepath)
             if not isinstance(healthchecks_object, dict):
                 self.logger.error(
                     '{0} doesn\'t contain valid definition of healthchecks'.format(relative_path))
@@ -49,7 +65,7 @@ class HealthCheck(object):
         self.logger.debug(
             'Loading existing deployment appspec file from {0}.' .format(appspec_filepath))
         if os.path.exists(appspec_filepath):
-            appspec_stream = file(appspec_filepath, 'r')
-            return yaml.load(appspec_stream)
+            with self.measure_phase('appspec', 'parse'):
+                return self.manifest_loader.load(appspec_filepath)
         else:
             return None
@@ -0,0 +1,45 @@
+""" Health Check Manifest Loader """
+
+import copy
+import os
+import threading
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+class ManifestLoader(object):
+    """ Parses YAML manifests, caching them by path, modification time and size """
+
+    def __init__(self):
+        self._manifests = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path):
+        """ Return a private copy of the parsed manifest at path """
+        file_stat = os.stat(path)
+        signature = (file_stat.st_mtime, file_stat.st_size)
+        with self._lock:
+            cached = self._manifests.get(path)
+            if cached is not None and cached[0] == signature:
+                self.hits += 1
+                return copy.deepcopy(cached[1])
+            self.misses += 1
+        with open(path, 'r') as stream:
+            manifest = yaml.load(stream, Loader=SafeLoader)
+        with self._lock:
+            self._manifests[path] = (signature, manifest)
+        # Callers normalise the checks they are given, so the cached copy is never handed out
+        return copy.deepcopy(manifest)
+
+    def clear(self):
+        with self._lock:
+            self._manifests.clear()
+
+
+shared_manifest_loader = ManifestLoader()
@@ -0,0 +1,30 @@
+""" Health Check Script Files """
+
+import os
+import stat
+from envmgr_healthchecks.concurrency import map_concurrently
+
+EXECUTE_BITS = stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def _prepare_script(path):
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+    if file_stat.st_mode & EXECUTE_BITS != EXECUTE_BITS:
+        os.chmod(path, file_stat.st_mode | EXECUTE_BITS)
+    return file_stat
+
+
+def prepare_scripts(paths, max_workers=None):
+    """
+    Stat every unique script path once and add execute permission where it is
+    missing. Returns a dict of path to stat result, or None for missing files.
+    """
+    unique_paths = sorted(set(paths))
+    file_stats = map_concurrently(
+        _prepare_script, unique_paths, max_workers or DEFAULT_MAX_WORKERS)
+    return dict(zip(unique_paths, file_stats))
@@ -0,0 +1,119 @@
+""" Sensu Check Validator """
+
+import re
+from jsonschema import Draft4Validator
+from envmgr_healthchecks.health_checks.health_check_errors import RegisterError
+
+NAME_EXPRESSION = r'^[\w\.-]+$'
+
+EMAIL_EXPRESSION = r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
+
+SENSU_CHECK_SCHEMA = {
+    "$schema": "http://json-schema.org/schema#",
+
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "interval": {"type": "number"},
+        "realert_every": {"type": "number"},
+        "timeout": {"type": "number"},
+        "occurrences": {"type": "number"},
+        "refresh": {"type": "number"},
+        "tip": {"type": ["string", "boolean"]},
+        "runbook": {"type": ["string", "boolean"]},
+        "standalone": {"type": "boolean"},
+        "aggregate": {"type": "boolean"},
+        "ticketing_enabled": {"type": "boolean"},
+        "paging_enabled": {"type": "boolean"},
+        "project": {"type": "boolean"},
+        "team": {"type": "string"},
+        "override_notification_settings": {"type": "string"},
+        "notification_email": {
+            "type": "array",
+            "items": {
+                "type": "string",
+                "pattern": EMAIL_EXPRESSION
+            }
+        },
+        "override_notification_email": {
+            "type": "array",
+            "items": {
+                "type": "string",
+                "pattern": EMAIL_EXPRESSION
+            }
+        },
+        "override_chat_channel": {
+            "type": "array",
+            "items": {"type": "string"}
+        },
+
+        "page": {"type": "boolean"}
+    },
+    "required": ["name", "interval"]
+}
+
+
+class SensuCheckValidator(object):
+    """ Validates Sensu check definitions against a schema and patterns compiled once """
+
+    def __init__(self, schema=SENSU_CHECK_SCHEMA):
+        Draft4Validator.check_schema(schema)
+        self.schema = schema
+        self._schema_validator = Draft4Validator(schema)
+        self._name_pattern = re.compile(NAME_EXPRESSION)
+
+    def validate(self, check_id, check):
+        """ Raise the first schema ValidationError or RegisterError found in check """
+        for error in self._schema_validator.iter_errors(check):
+            raise error
+        for message in self._rule_errors(check_id, check):
+            raise RegisterError(message)
+
+    def validate_manifest(self, checks):
+        """ Return every error found in a manifest of checks, in a single pass """
+        errors = []
+        for check_id, check in sorted(checks.iteritems()):
+            errors.extend('Health check \'{0}\': {1}'.format(check_id, error.message)
+                          for error in self._schema_validator.iter_errors(check))
+            errors.extend(self._rule_errors(check_id, check))
+        errors.extend(self.unique_id_errors(checks))
+        errors.extend(self.unique_name_errors(checks))
+        return errors
+
+    def unique_id_errors(self, checks):
+        check_ids = [check_id.lower() for check_id in checks.keys()]
+        if len(check_ids) != len(set(check_ids)):
+            return ['Sensu check definitions require unique ids (case insensitive)']
+        return []
+
+    def unique_name_errors(self, checks):
+        check_names = [check.get('name') for check in checks.values()]
+        if len(check_names) != len(set(check_names)):
+            return ['Sensu check definitions require unique names (case insensitive)']
+        return []
+
+    def _rule_errors(self, check_id, check):
+        errors = []
+        name = check.get('name')
+        if isinstance(name, basestring) and not self._name_pattern.match(name):
+            errors.append('Health check name \'{0}\' doesn\'t match required '
+                          'Sensu name expression {1}'.format(name, '/{0}/'.format(NAME_EXPRESSION)))
+        if 'local_script' in check and 'server_script' in check:
+            errors.append(
+                'Failed to register health check \'{0}\', you can use either '
+                '\'local_script\' or \'server_script\', but not both.'.format(check_id))
+        if not ('local_script' in check or 'server_script' in check):
+            errors.append(
+                'Failed to register health check \'{0}\', you need at least one of: '
+                '\'local_script\' or \'server_script\''.format(check_id))
+        if 'standalone' in check and 'aggregate' in check:
+            if check['standalone'] is True and check['aggregate'] is True:
+                errors.append(
+                    'Either standalone or aggregate can be True at the same time')
+            if check['standalone'] is False and check['aggregate'] is False:
+                errors.append(
+                    'Either standalone or aggregate can be False at the same time')
+        return errors
+
+
+shared_sensu_check_validator = SensuCheckValidator()
@@ -0,0 +1,57 @@
+""" Sensu Check Definition Encoder """
+
+import json
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+PRETTY = 'pretty'
+COMPACT = 'compact'
+CANONICAL = 'canonical'
+
+DEFAULT_PROFILE = PRETTY
+
+
+def _encode_pretty(definition):
+    return json.dumps(definition, sort_keys=True, indent=4, separators=(',', ': '))
+
+
+def _encode_canonical(definition):
+    # Always the stdlib encoder, so the bytes (and their digest) do not depend on
+    # which optional encoder a host has installed
+    return json.dumps(definition, sort_keys=True, separators=(',', ':'), ensure_ascii=True)
+
+
+def _create_compact_encoder():
+    if ujson is not None:
+        return lambda definition: ujson.dumps(definition, escape_forward_slashes=False)
+    if simplejson is not None:
+        return lambda definition: simplejson.dumps(definition, separators=(',', ':'))
+    return lambda definition: json.dumps(definition, separators=(',', ':'))
+
+
+ENCODERS = {
+    PRETTY: _encode_pretty,
+    COMPACT: _create_compact_encoder(),
+    CANONICAL: _encode_canonical
+}
+
+
+def get_definition_encoder(profile=None):
+    """
+    Return the function serialising a check definition with the given profile:
+    'pretty' (indented, sorted keys), 'compact' (fastest available encoder, no
+    whitespace) or 'canonical' (compact, sorted keys, byte-stable).
+    """
+    try:
+        return ENCODERS[profile or DEFAULT_PROFILE]
+    except KeyError:
+        raise ValueError('Unknown Sensu definition output profile \'{0}\', expected one of: {1}'.format(
+            profile, ', '.join(sorted(ENCODERS))))
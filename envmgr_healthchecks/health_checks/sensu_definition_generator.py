@@ -0,0 +1,96 @@
+""" Sensu Check Definition Generator """
+
+WINDOWS_COMMAND_TEMPLATE = (
+    'powershell.exe -NonInteractive -NoProfile -ExecutionPolicy Bypass -file "{0}"')
+
+
+class SensuCheckDefinitionGenerator(object):
+    """
+    Generates Sensu check definitions for one deployment. The slice, command
+    template and instance tag fields are worked out once, when it is created.
+    """
+
+    def __init__(self, logger, platform=None, service_slice=None, instance_tags=None):
+        self.logger = logger
+        self.command_template = WINDOWS_COMMAND_TEMPLATE if platform == 'windows' else '{0}'
+        if service_slice is not None and service_slice.lower() == 'none':
+            service_slice = None
+        self.deployment_slice = service_slice
+        self.tag_fields = dict(
+            ('ttl_' + key.lower(), value) for key, value in (instance_tags or {}).iteritems()
+            if not key.startswith('aws:'))
+
+    def generate_all(self, checks, script_paths):
+        """ Return {check_id: definition} for a manifest, given {check_id: script path} """
+        return dict(
+            (check_id, self.generate(check, script_paths[check_id]))
+            for check_id, check in checks.iteritems())
+
+    def generate(self, check, script_absolute_path):
+        definition = {
+            'aggregate': check.get('aggregate', False),
+            'alert_after': check.get('alert_after', 600),
+            'command': self._get_command(check, script_absolute_path),
+            'handlers': ['default'],
+            'interval': check.get('interval'),
+            'notification_email': self._get_override_notification_email(check),
+            'occurrences': check.get('occurrences', 5),
+            'page': check.get('paging_enabled', False),
+            'project': check.get('project', False),
+            'realert_every': check.get('realert_every', 30),
+            'runbook': check.get('runbook', 'Please provide useful '
+                                 'information to resolve alert'),
+            'sla': check.get('sla', 'No SLA defined'),
+            'slack_channel': self._get_override_chat_channel(check),
+            'standalone': check.get('standalone', True),
+            'subscribers': ['sensu-base'],
+            'tags': [],
+            'team': self._get_override_notification_settings(check),
+            'ticket': check.get('ticketing_enabled', False),
+            'timeout': check.get('timeout', 120),
+            'tip': check.get('tip', 'Fill me up with information')
+        }
+        definition.update(self.tag_fields)
+        return {'checks': {check['name']: definition}}
+
+    def _get_command(self, check, script_absolute_path):
+        command = self.command_template.format(script_absolute_path)
+        script_args = check.get('script_arguments', '')
+
+        # Append slice value for local scripts
+        if 'local_script' in check:
+            script_args = ' '.join(
+                filter(None, (script_args, self.deployment_slice)))
+
+        return '{0} {1}'.format(command, script_args).rstrip()
+
+    def _get_override_chat_channel(self, check):
+        override_chat_channel = check.get('override_chat_channel', None)
+        if override_chat_channel is not None:
+            return ','.join(override_chat_channel)
+        return 'undef'
+
+    def _get_override_notification_email(self, check):
+        override_notification_email = check.get(
+            'override_notification_email', None)
+        if override_notification_email is None:
+            if check.get('notification_email') is not None:
+                self.logger.warning(
+                    '\'notification_email\' property is deprecated, please use '
+                    '\'override_notification_email\' instead')
+                override_notification_email = check.get(
+                    'notification_email', None)
+        if override_notification_email is not None:
+            return ','.join(override_notification_email)
+        return 'undef'
+
+    def _get_override_notification_settings(self, check):
+        override_notification_settings = check.get(
+            'override_notification_settings', None)
+        if override_notification_settings is None:
+            if check.get('team', None) is not None:
+                self.logger.warning(
+                    '\'team\' property is deprecated, please use \'override_'
+                    'notification_settings\' instead')
+                override_notification_settings = check.get('team', None)
+        return override_notification_settings
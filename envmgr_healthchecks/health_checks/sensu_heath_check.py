@@ -1,20 +1,29 @@
 """ Sensu Health Check """
 
 import os
-import stat
+import errno
 import json
 import sys
-import re
-from jsonschema import Draft4Validator
-from envmgr_healthchecks.health_checks.health_check import HealthCheck
+import hashlib
+import time
+from envmgr_healthchecks.atomic_files import write_file_atomically
+from envmgr_healthchecks.concurrency import map_concurrently
+from envmgr_healthchecks.health_checks.health_check import DeregistrationReport, HealthCheck
 from envmgr_healthchecks.health_checks.health_check_errors import RegisterError
+from envmgr_healthchecks.health_checks.script_files import DEFAULT_MAX_WORKERS, prepare_scripts
+from envmgr_healthchecks.health_checks.sensu_check_validator import shared_sensu_check_validator
+from envmgr_healthchecks.health_checks.sensu_definition_encoder import get_definition_encoder
+from envmgr_healthchecks.health_checks.sensu_definition_generator import SensuCheckDefinitionGenerator
+from envmgr_healthchecks.health_checks.sensu_plugin_index import shared_sensu_plugin_index
 
 
 class SensuHealthCheck(HealthCheck):
     """ Sensu Health Check """
 
     def __init__(self, name=None, **kwargs):
-        HealthCheck.__init__(self, name=name)
+        HealthCheck.__init__(self, name=name,
+                             manifest_loader=kwargs.get('manifest_loader', None),
+                             metrics=kwargs.get('metrics', None))
         self.platform = kwargs.get('platform', None)
         self.instance_tags = kwargs.get('instance_tags', None)
         self.sensu = kwargs.get('sensu', None)
@@ -27,10 +36,21 @@ class SensuHealthCheck(HealthCheck):
         self.check_id = kwargs.get('check_id', None)
         self.check = kwargs.get('check', None)
         self.logger = kwargs.get('logger', self.logger)
-        self.schema = self._get_schema()
+        self.validator = kwargs.get('validator', shared_sensu_check_validator)
+        self.schema = self.validator.schema
+        self.plugin_index = kwargs.get('plugin_index', shared_sensu_plugin_index)
+        self.max_workers = kwargs.get('max_workers', None)
+        self.definition_changes = {'changed': [], 'unchanged': [], 'removed': []}
+        self._definition_generator = None
+        self._definition_generator_key = None
 
     def deregister(self):
-        """ deregister this health check """
+        """
+        Remove the previous deployment's check definitions and return a
+        DeregistrationReport
+        """
+        start = time.time()
+        failed = []
         if self.last_id is None:
             self.logger.info(
                 'Skipping {0} stage as there is no previous deployment.'.format(self.name))
@@ -45,14 +65,47 @@ class SensuHealthCheck(HealthCheck):
             else:
                 (healthchecks, _) = self.find_health_checks(
                     'sensu', self.last_archive_dir, previous_appspec)
-                if healthchecks is None:
-                    return
-                for check_id, _ in healthchecks.iteritems():
-                    check_definition_absolute_path = os.path.join(
-                        self.sensu['sensu_check_path'],
-                        self._create_sensu_definition_filename(self.service_id, check_id))
-                    if os.path.exists(check_definition_absolute_path):
-                        os.remove(check_definition_absolute_path)
+                if healthchecks is not None:
+                    failed = self._remove_previous_definitions(healthchecks)
+        return DeregistrationReport(
+            list(self.definition_changes['removed']), failed, time.time() - start)
+
+    def _remove_previous_definitions(self, healthchecks):
+        # Definitions the new deployment registers again are left in place, so
+        # that register() only rewrites the ones whose content changed
+        current_check_ids = self._find_current_check_ids()
+        if self._uses_bundle_layout():
+            self._remove_from_bundle(dict(
+                (check_id, check) for check_id, check in healthchecks.iteritems()
+                if check_id not in current_check_ids))
+        check_ids = sorted(check_id for check_id in healthchecks
+                           if check_id not in current_check_ids or self._uses_bundle_layout())
+        paths = [os.path.join(self.sensu['sensu_check_path'],
+                              self._create_sensu_definition_filename(self.service_id, check_id))
+                 for check_id in check_ids]
+        # Every definition file is removed in one pass, without a stat before each removal
+        with self.measure_phase('sensu', 'deregister'):
+            results = map_concurrently(
+                self._remove_definition_file, paths, self.max_workers or DEFAULT_MAX_WORKERS)
+        failed = []
+        for check_id, (is_removed, error) in zip(check_ids, results):
+            if error is not None:
+                self.logger.warning(
+                    'Failed to remove Sensu check definition \'{0}\': {1}'.format(check_id, error))
+                failed.append(check_id)
+            elif is_removed and check_id not in current_check_ids and \
+                    check_id not in self.definition_changes['removed']:
+                self.definition_changes['removed'].append(check_id)
+        return failed
+
+    def _remove_definition_file(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return (False, None)
+            return (False, str(e))
+        return (True, None)
 
     def register(self):
         """ Register this health check """
@@ -61,25 +114,98 @@ class SensuHealthCheck(HealthCheck):
             'sensu', self.archive_dir, self.appspec)
         if sensu_checks is None:
             self.logger.info('No Sensu checks to register.')
-            return
-        self._validate_checks(
-            sensu_checks, scripts_base_dir)
-        for check_id, check in sensu_checks.iteritems():
-            self._register_check(
-                self.check_id, self.check)
+            return self.definition_changes
+        with self.measure_phase('sensu', 'validate'):
+            self._validate_checks(
+                sensu_checks, scripts_base_dir)
+        self.definition_changes['changed'] = []
+        self.definition_changes['unchanged'] = []
+        with self.measure_phase('sensu', 'generate'):
+            check_definitions = self._create_check_definitions(sensu_checks)
+        with self.measure_phase('sensu', 'write'):
+            if self._uses_bundle_layout():
+                self._register_bundle(check_definitions)
+            else:
+                for check_id, check_definition in check_definitions.iteritems():
+                    is_changed = self._register_check(
+                        check_id, check_definition)
+                    self.definition_changes['changed' if is_changed else 'unchanged'].append(check_id)
+        self.logger.info('Sensu check definitions: {0} changed, {1} unchanged, {2} removed.'.format(
+            len(self.definition_changes['changed']), len(self.definition_changes['unchanged']),
+            len(self.definition_changes['removed'])))
+        return self.definition_changes
+
+    def has_definition_changes(self):
+        """ Whether the Sensu client needs to reload its configuration """
+        return bool(self.definition_changes['changed'] or self.definition_changes['removed'])
+
+    def _find_current_check_ids(self):
+        if self.archive_dir is None:
+            return set()
+        (healthchecks, _) = self.find_health_checks(
+            'sensu', self.archive_dir, self.appspec or {})
+        return set(healthchecks or {})
+
+    def _uses_bundle_layout(self):
+        return self.sensu.get('definition_layout', 'per_check') == 'bundle'
 
     def _create_sensu_definition_filename(self, service_id, check_id):
         return '{0}-{1}.json'.format(service_id, check_id)
 
-    def _register_check(self, check_id, check):
+    def _create_sensu_bundle_filename(self, service_id):
+        return '{0}.json'.format(service_id)
+
+    def _get_bundle_path(self):
+        return os.path.join(
+            self.sensu['sensu_check_path'], self._create_sensu_bundle_filename(self.service_id))
+
+    def _register_bundle(self, check_definitions):
+        bundle_absolute_path = self._get_bundle_path()
+        existing_definitions = self._read_definition_file(
+            bundle_absolute_path).get('checks', {})
+        bundle = {'checks': {}}
+        for check_id, check_definition in check_definitions.iteritems():
+            bundle['checks'].update(check_definition['checks'])
+            is_changed = any(existing_definitions.get(name) != definition
+                             for name, definition in check_definition['checks'].iteritems())
+            self.definition_changes['changed' if is_changed else 'unchanged'].append(check_id)
+        try:
+            self._write_check_definition_file(bundle, bundle_absolute_path)
+        except Exception:
+            self.logger.exception(sys.exc_info()[1])
+            raise RegisterError(
+                'Failed to register Sensu checks bundle \'{0}\''.format(bundle_absolute_path))
+
+    def _remove_from_bundle(self, removed_checks):
+        bundle_absolute_path = self._get_bundle_path()
+        bundle = self._read_definition_file(bundle_absolute_path)
+        definitions = bundle.get('checks', {})
+        for check_id, check in removed_checks.iteritems():
+            if definitions.pop(check.get('name'), None) is not None:
+                self.definition_changes['removed'].append(check_id)
+        if not definitions:
+            if os.path.exists(bundle_absolute_path):
+                os.remove(bundle_absolute_path)
+        elif self.definition_changes['removed']:
+            self._write_check_definition_file(bundle, bundle_absolute_path)
+
+    def _read_definition_file(self, path):
+        try:
+            with open(path, 'r') as definition_file:
+                return json.load(definition_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _create_check_definitions(self, checks):
+        script_paths = dict(
+            (check_id, self._get_script_path(check_id, check))
+            for check_id, check in checks.iteritems())
+        return self._get_definition_generator().generate_all(checks, script_paths)
+
+    def _get_script_path(self, check_id, check):
+        # Execution permission on local scripts was added when the checks were validated
         if 'local_script' in check:
             script_absolute_path = check['local_script']
-            self.logger.info(
-                'Setting mode on file: {0}'.format(script_absolute_path))
-            file_stat = os.stat(script_absolute_path)
-            os.chmod(
-                script_absolute_path,
-                file_stat.st_mode | stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH)
         elif 'server_script' in check:
             script_absolute_path = check['server_script']
         else:
@@ -89,67 +215,76 @@ class SensuHealthCheck(HealthCheck):
         self.logger.debug('Sensu check {0} script path: {1}'.format(
             check_id, script_absolute_path))
 
-        check_definition = self._generate_check_definition(
-            check, script_absolute_path)
+        return script_absolute_path
+
+    def _register_check(self, check_id, check_definition):
         check_definition_filename = self._create_sensu_definition_filename(
             self.service_id, check_id)
         check_definition_absolute_path = os.path.join(
             self.sensu['sensu_check_path'], check_definition_filename)
-        is_success = self._write_check_definition_file(
-            check_definition, check_definition_absolute_path)
-        if not is_success:
+        try:
+            return self._write_check_definition_file(
+                check_definition, check_definition_absolute_path)
+        except Exception:
+            self.logger.exception(sys.exc_info()[1])
             raise RegisterError(
                 'Failed to register Sensu check \'{0}\''.format(check_id))
 
     def _write_check_definition_file(self, check_definition, check_definition_absolute_path):
-        try:
-            with open(check_definition_absolute_path, 'w') as check_definition_file:
-                check_definition_file.write(json.dumps(
-                    check_definition, sort_keys=True, indent=4, separators=(',', ': ')))
-            self.logger.info('Created Sensu check definition: {0}'.format(
+        """ Write the definition unless the file already has the same content, returns whether it was written """
+        encode = get_definition_encoder(self.sensu.get('output_profile'))
+        content = encode(check_definition)
+        if self._get_file_digest(check_definition_absolute_path) == hashlib.sha1(content).hexdigest():
+            self.logger.debug('Sensu check definition is unchanged: {0}'.format(
                 check_definition_absolute_path))
-            return True
-        except Exception:
-            self.logger.exception(sys.exc_info()[1])
             return False
 
+        # The Sensu client never reads a partially written file
+        write_file_atomically(check_definition_absolute_path, content)
+        self.logger.info('Created Sensu check definition: {0}'.format(
+            check_definition_absolute_path))
+        return True
+
+    def _get_file_digest(self, path):
+        try:
+            with open(path, 'r') as existing_file:
+                return hashlib.sha1(existing_file.read()).hexdigest()
+        except IOError:
+            return None
+
     def _validate_checks(self, checks, scripts_base_dir):
-        for check_id, check in checks.iteritems():
-            self._validate_check_properties(
-                check_id, check)
+        errors = self.validator.validate_manifest(checks)
+        if errors:
+            raise RegisterError(
+                'Invalid Sensu check definitions:\n{0}'.format('\n'.join(errors)))
+        if any('server_script' in check for check in checks.values()):
+            self.plugin_index.refresh(self.sensu['healthcheck_search_paths'])
+        # Every local script is stat'ed and made executable once, ahead of registration
+        with self.measure_phase('sensu', 'scripts'):
+            script_stats = prepare_scripts(
+                [self._get_local_script_path(check, scripts_base_dir)
+                 for check in checks.values() if 'local_script' in check],
+                self.max_workers)
+        for check in checks.values():
             self._validate_check_script(
-                check, scripts_base_dir)
-        self._validate_unique_ids(checks)
-        self._validate_unique_names(checks)
+                check, scripts_base_dir, script_stats)
 
     def _validate_check_properties(self, check_id, check):
-        Draft4Validator(self.schema).validate(check)
-        if not re.match(r'^[\w\.-]+$', check['name']):
-            raise RegisterError('Health check name \'{0}\' doesn\'t match required '
-                                'Sensu name expression {1}'.format(check['name'], r'/^[\w\.-]+$/'))
-        if 'local_script' in check and 'server_script' in check:
-            raise RegisterError(
-                'Failed to register health check \'{0}\', you can use either '
-                '\'local_script\' or \'server_script\', but not both.'.format(check_id))
-        if not ('local_script' in check or 'server_script' in check):
-            raise RegisterError(
-                'Failed to register health check \'{0}\', you need at least one of: '
-                '\'local_script\' or \'server_script\''.format(check_id))
-        if 'standalone' in check and 'aggregate' in check:
-            if check['standalone'] is True and check['aggregate'] is True:
-                raise RegisterError(
-                    'Either standalone or aggregate can be True at the same time')
-            if check['standalone'] is False and check['aggregate'] is False:
-                raise RegisterError(
-                    'Either standalone or aggregate can be False at the same time')
+        self.validator.validate(check_id, check)
 
-    def _validate_check_script(self, check, local_scripts_base_dir):
+    def _get_local_script_path(self, check, local_scripts_base_dir):
+        if check['local_script'].startswith('/'):
+            check['local_script'] = check['local_script'][1:]
+        return os.path.join(
+            self.archive_dir, local_scripts_base_dir, check['local_script'])
+
+    def _validate_check_script(self, check, local_scripts_base_dir, script_stats=None):
         if 'local_script' in check:
-            if check['local_script'].startswith('/'):
-                check['local_script'] = check['local_script'][1:]
-            absolute_file_path = os.path.join(
-                self.archive_dir, local_scripts_base_dir, check['local_script'])
-            if not os.path.exists(absolute_file_path):
+            absolute_file_path = self._get_local_script_path(
+                check, local_scripts_base_dir)
+            if script_stats is None:
+                script_stats = prepare_scripts([absolute_file_path])
+            if script_stats.get(absolute_file_path) is None:
                 raise RegisterError(
                     'Couldn\'t find Sensu check script in package with path: {0}'.format(
                         os.path.join(local_scripts_base_dir, check['local_script'])))
@@ -164,157 +299,25 @@ class SensuHealthCheck(HealthCheck):
             check['server_script'] = absolute_file_path
 
     def _find_sensu_plugin(self, plugin_paths, script_filename):
-        for plugin_path in plugin_paths:
-            script_filepath = os.path.join(plugin_path, script_filename)
-            if os.path.exists(script_filepath):
-                return script_filepath
-        return None
+        return self.plugin_index.find(plugin_paths, script_filename)
 
     def _validate_unique_ids(self, checks):
-        check_ids = [check_id.lower() for check_id in checks.keys()]
-        if len(check_ids) != len(set(check_ids)):
-            raise RegisterError(
-                'Sensu check definitions require unique ids (case insensitive)')
+        for message in self.validator.unique_id_errors(checks):
+            raise RegisterError(message)
 
     def _validate_unique_names(self, checks):
-        check_names = [check['name'] for check in checks.values()]
-        if len(check_names) != len(set(check_names)):
-            raise RegisterError(
-                'Sensu check definitions require unique names (case insensitive)')
+        for message in self.validator.unique_name_errors(checks):
+            raise RegisterError(message)
+
+    def _get_definition_generator(self):
+        # Rebuilt only when the deployment it was compiled for changes
+        key = (self.platform, self.service_slice,
+               tuple(sorted((self.instance_tags or {}).iteritems())))
+        if self._definition_generator is None or self._definition_generator_key != key:
+            self._definition_generator = SensuCheckDefinitionGenerator(
+                self.logger, self.platform, self.service_slice, self.instance_tags)
+            self._definition_generator_key = key
+        return self._definition_generator
 
     def _generate_check_definition(self, check, script_absolute_path):
-        platform = self.platform
-        instance_tags = self.instance_tags
-        logger = self.logger
-        deployment_slice = self.service_slice
-        if deployment_slice is not None and deployment_slice.lower() == 'none':
-            deployment_slice = None
-
-        def _get_command():
-            if platform == 'windows':
-                command = '{0} "{1}"'.format(
-                    'powershell.exe -NonInteractive -NoProfile -ExecutionPolicy '
-                    'Bypass -file', script_absolute_path)
-            else:
-                command = script_absolute_path
-
-            script_args = check.get('script_arguments', '')
-
-            # Append slice value for local scripts
-            if 'local_script' in check:
-                script_args = ' '.join(
-                    filter(None, (script_args, deployment_slice)))
-
-            return '{0} {1}'.format(command, script_args).rstrip()
-
-        def _get_override_chat_channel():
-            override_chat_channel = check.get('override_chat_channel', None)
-            if override_chat_channel is not None:
-                return ','.join(override_chat_channel)
-            return 'undef'
-
-        def _get_override_notification_email(check):
-            override_notification_email = check.get(
-                'override_notification_email', None)
-            if override_notification_email is None:
-                if check.get('notification_email') is not None:
-                    logger.warning(
-                        '\'notification_email\' property is deprecated, please use '
-                        '\'override_notification_email\' instead')
-                    override_notification_email = check.get(
-                        'notification_email', None)
-            if override_notification_email is not None:
-                return ','.join(override_notification_email)
-            return 'undef'
-
-        def _get_override_notification_settings():
-            override_notification_settings = check.get(
-                'override_notification_settings', None)
-            if override_notification_settings is None:
-                if check.get('team', None) is not None:
-                    logger.warning(
-                        '\'team\' property is deprecated, please use \'override_'
-                        'notification_settings\' instead')
-                    override_notification_settings = check.get('team', None)
-            return override_notification_settings
-
-        check_definition = {
-            'checks': {
-                check['name']: {
-                    'aggregate': check.get('aggregate', False),
-                    'alert_after': check.get('alert_after', 600),
-                    'command': _get_command(),
-                    'handlers': ['default'],
-                    'interval': check.get('interval'),
-                    'notification_email': _get_override_notification_email(check),
-                    'occurrences': check.get('occurrences', 5),
-                    'page': check.get('paging_enabled', False),
-                    'project': check.get('project', False),
-                    'realert_every': check.get('realert_every', 30),
-                    'runbook': check.get('runbook', 'Please provide useful '
-                                         'information to resolve alert'),
-                    'sla': check.get('sla', 'No SLA defined'),
-                    'slack_channel': _get_override_chat_channel(),
-                    'standalone': check.get('standalone', True),
-                    'subscribers': ['sensu-base'],
-                    'tags': [],
-                    'team': _get_override_notification_settings(),
-                    'ticket': check.get('ticketing_enabled', False),
-                    'timeout': check.get('timeout', 120),
-                    'tip': check.get('tip', 'Fill me up with information')
-                }
-            }
-        }
-
-        custom_instance_tags = {
-            k: v for k, v in instance_tags.iteritems() if not k.startswith('aws:')}
-        for key, value in custom_instance_tags.iteritems():
-            name = check['name']
-            check_definition['checks'][name]['ttl_' + key.lower()] = value
-
-        return check_definition
-
-    def _get_schema(self):
-        return {
-            "$schema": "http://json-schema.org/schema#",
-
-            "type": "object",
-            "properties": {
-                "name": {"type": "string"},
-                "interval": {"type": "number"},
-                "realert_every": {"type": "number"},
-                "timeout": {"type": "number"},
-                "occurrences": {"type": "number"},
-                "refresh": {"type": "number"},
-                "tip": {"type": ["string", "boolean"]},
-                "runbook": {"type": ["string", "boolean"]},
-                "standalone": {"type": "boolean"},
-                "aggregate": {"type": "boolean"},
-                "ticketing_enabled": {"type": "boolean"},
-                "paging_enabled": {"type": "boolean"},
-                "project": {"type": "boolean"},
-                "team": {"type": "string"},
-                "override_notification_settings": {"type": "string"},
-                "notification_email": {
-                    "type": "array",
-                    "items": {
-                        "type": "string",
-                        "pattern": r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
-                    }
-                },
-                "override_notification_email": {
-                    "type": "array",
-                    "items": {
-                        "type": "string",
-                        "pattern": r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
-                    }
-                },
-                "override_chat_channel": {
-                    "type": "array",
-                    "items": {"type": "string"}
-                },
-
-                "page": {"type": "boolean"}
-            },
-            "required": ["name", "interval"]
-        }
+        return self._get_definition_generator().generate(check, script_absolute_path)
@@ -0,0 +1,66 @@
+""" Sensu Plugin Index """
+
+import os
+import threading
+
+
+class SensuPluginIndex(object):
+    """
+    Filename to absolute path index of the Sensu plugin search paths. Each
+    directory is listed once and listed again only when its mtime changes.
+    """
+
+    def __init__(self):
+        self._listings = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, plugin_paths):
+        """ Stat every search path once and rebuild the index if any of them changed """
+        plugin_paths = tuple(plugin_paths)
+        with self._lock:
+            is_changed = plugin_paths not in self._indexes
+            for plugin_path in plugin_paths:
+                try:
+                    mtime = os.stat(plugin_path).st_mtime
+                except OSError:
+                    mtime = None
+                listing = self._listings.get(plugin_path)
+                if listing is None or listing[0] != mtime:
+                    filenames = self._list_directory(plugin_path) if mtime is not None else []
+                    self._listings[plugin_path] = (mtime, filenames)
+                    is_changed = True
+            if is_changed:
+                # Other combinations of search paths are rebuilt when next used
+                self._indexes = {}
+                index = {}
+                # Earlier search paths take precedence
+                for plugin_path in reversed(plugin_paths):
+                    for filename in self._listings[plugin_path][1]:
+                        index[filename] = os.path.join(plugin_path, filename)
+                self._indexes[plugin_paths] = index
+            return self._indexes[plugin_paths]
+
+    def _list_directory(self, plugin_path):
+        try:
+            return os.listdir(plugin_path)
+        except OSError:
+            return []
+
+    def find(self, plugin_paths, script_filename):
+        """ Return the path of script_filename in the first search path containing it, or None """
+        plugin_paths = tuple(plugin_paths)
+        if os.path.dirname(script_filename):
+            # Nested plugin paths are not indexed
+            for plugin_path in plugin_paths:
+                script_filepath = os.path.join(plugin_path, script_filename)
+                if os.path.exists(script_filepath):
+                    return script_filepath
+            return None
+        index = self._indexes.get(plugin_paths)
+        if index is None:
+            index = self.refresh(plugin_paths)
+        return index.get(script_filename)
+
+
+shared_sensu_plugin_index = SensuPluginIndex()
@@ -0,0 +1,190 @@
+""" Registrar Metrics """
+
+import bisect
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from envmgr_healthchecks.atomic_files import write_file_atomically
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _tags_key(tags):
+    return tuple(sorted(tags.iteritems()))
+
+
+class Histogram(object):
+    """ Latency histogram in seconds with cumulative buckets, as Prometheus exposes them """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def cumulative_counts(self):
+        counts = []
+        total = 0
+        for bucket_count in self.bucket_counts:
+            total += bucket_count
+            counts.append(total)
+        return counts
+
+
+class InMemorySink(object):
+    """ Aggregates timings into histograms and counters keyed by name and tags """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def timing(self, name, seconds, tags):
+        key = (name, _tags_key(tags))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def increment(self, name, value, tags):
+        key = (name, _tags_key(tags))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get_histogram(self, name, **tags):
+        return self.histograms.get((name, _tags_key(tags)))
+
+    def get_counter(self, name, **tags):
+        return self.counters.get((name, _tags_key(tags)), 0)
+
+    def flush(self):
+        pass
+
+
+class StatsdSink(object):
+    """
+    Sends every timing and counter as a StatsD line, with DogStatsD style tags, to
+    a UDP address or to the path of a local unix datagram socket
+    """
+
+    def __init__(self, address=('127.0.0.1', 8125), prefix='healthchecks.'):
+        self.address = address
+        self.prefix = prefix
+        family = socket.AF_UNIX if isinstance(address, basestring) else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+
+    def timing(self, name, seconds, tags):
+        self._send(name, '{0:.3f}|ms'.format(seconds * 1000), tags)
+
+    def increment(self, name, value, tags):
+        self._send(name, '{0}|c'.format(value), tags)
+
+    def _send(self, name, value, tags):
+        line = '{0}{1}:{2}'.format(self.prefix, name, value)
+        if tags:
+            line += '|#' + ','.join('{0}:{1}'.format(key, tag) for key, tag in sorted(tags.iteritems()))
+        try:
+            self._socket.sendto(line, self.address)
+        except socket.error:
+            # Metrics are best effort and never fail a deployment
+            pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._socket.close()
+
+
+class PrometheusTextfileSink(InMemorySink):
+    """ Writes the aggregated metrics to a file for the node exporter textfile collector """
+
+    def __init__(self, path, buckets=DEFAULT_BUCKETS):
+        InMemorySink.__init__(self, buckets)
+        self.path = path
+
+    def flush(self):
+        write_file_atomically(self.path, self.render())
+
+    def render(self):
+        with self._lock:
+            histograms = sorted(self.histograms.iteritems())
+            counters = sorted(self.counters.iteritems())
+        lines = []
+        declared = set()
+        for (name, tags), histogram in histograms:
+            metric_name = self._metric_name(name) + '_seconds'
+            if metric_name not in declared:
+                lines.append('# TYPE {0} histogram'.format(metric_name))
+                declared.add(metric_name)
+            for bucket, count in zip(histogram.buckets, histogram.cumulative_counts()):
+                lines.append('{0}_bucket{1} {2}'.format(
+                    metric_name, self._labels(tags + (('le', repr(float(bucket))),)), count))
+            lines.append('{0}_bucket{1} {2}'.format(
+                metric_name, self._labels(tags + (('le', '+Inf'),)), histogram.count))
+            lines.append('{0}_sum{1} {2!r}'.format(metric_name, self._labels(tags), histogram.sum))
+            lines.append('{0}_count{1} {2}'.format(metric_name, self._labels(tags), histogram.count))
+        for (name, tags), value in counters:
+            metric_name = self._metric_name(name) + '_total'
+            if metric_name not in declared:
+                lines.append('# TYPE {0} counter'.format(metric_name))
+                declared.add(metric_name)
+            lines.append('{0}{1} {2}'.format(metric_name, self._labels(tags), value))
+        return '\n'.join(lines) + '\n'
+
+    def _metric_name(self, name):
+        return 'healthchecks_' + name.replace('.', '_')
+
+    def _labels(self, tags):
+        if not tags:
+            return ''
+        return '{' + ','.join('{0}="{1}"'.format(
+            key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in tags) + '}'
+
+
+class Metrics(object):
+    """ Records timings and counters and forwards them to every sink """
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def timing(self, name, seconds, **tags):
+        for sink in self.sinks:
+            sink.timing(name, seconds, tags)
+
+    def increment(self, name, value=1, **tags):
+        for sink in self.sinks:
+            sink.increment(name, value, tags)
+
+    @contextmanager
+    def timer(self, name, **tags):
+        start = time.time()
+        try:
+            yield
+        finally:
+            if self.sinks:
+                self.timing(name, time.time() - start, **tags)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+
+shared_metrics = Metrics()
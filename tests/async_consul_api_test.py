@@ -0,0 +1,60 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import base64
+import json
+import responses
+import threading
+import unittest
+from envmgr_healthchecks.api.consul.async_consul_api import AsyncConsulApi
+from mock import Mock, patch
+
+consul_config = {'scheme': 'http', 'host': 'localhost',
+                 'port': 8500, 'version': 'v1', 'acl_token': None}
+
+
+class TestAsyncConsulApi(unittest.TestCase):
+    @responses.activate
+    def test_concurrent_calls_return_results(self):
+        value = [{'Key': 'key', 'Value': base64.b64encode(json.dumps(
+            {'property': 'some_value'})), 'ModifyIndex': 100}]
+        responses.add(
+            responses.GET, 'http://localhost:8500/v1/kv/key', json=value, status=200)
+        responses.add(
+            responses.PUT, 'http://localhost:8500/v1/agent/check/register', status=200)
+        with AsyncConsulApi(consul_config, max_workers=4) as consul_api:
+            pending = [consul_api.register_http_check(
+                'Ping', 'check_{0}'.format(index), 'Ping', 'http://127.0.0.1/ping', '10s')
+                for index in range(8)]
+            value = consul_api.get_value('key')
+            self.assertEqual([result.get(5) for result in pending], [True] * 8)
+            self.assertEqual(value.get(5), {'property': 'some_value'})
+
+    def test_wait_for_change_tracks_index_per_key_prefix(self):
+        indexes = {'prefix1': '10', 'prefix2': '20'}
+        with AsyncConsulApi(consul_config, max_workers=2) as consul_api:
+            with patch.object(consul_api._api, '_get_modify_index',
+                              side_effect=lambda key, *args: indexes[key]), \
+                    patch.object(consul_api._api, '_api_get', side_effect=lambda url, **kwargs: Mock(
+                        headers={'X-Consul-Index': '11' if 'prefix1' in url else '20'})) as mock_get:
+                self.assertTrue(consul_api.wait_for_change('prefix1').get(5))
+                self.assertFalse(consul_api.wait_for_change('prefix2').get(5))
+            queried_urls = sorted(call[0][0] for call in mock_get.call_args_list)
+            self.assertEqual(queried_urls, ['kv/prefix1?index=10&wait=5m', 'kv/prefix2?index=20&wait=5m'])
+            self.assertEqual(consul_api._last_known_modify_indexes,
+                             {'prefix1': '11', 'prefix2': '20'})
+
+    def test_blocking_queries_do_not_hold_up_other_calls(self):
+        release = threading.Event()
+
+        def wait_for_change(*args):
+            release.wait(5)
+            return ('11', True)
+        with AsyncConsulApi(consul_config, max_workers=1, max_blocking_queries=2) as consul_api:
+            with patch.object(consul_api._api, '_wait_for_change', side_effect=wait_for_change), \
+                    patch.object(consul_api._api, 'get_value', return_value='value'):
+                changes = [consul_api.wait_for_change('prefix{0}'.format(i)) for i in range(2)]
+                self.assertEqual(consul_api.get_value('key').get(1), 'value')
+                self.assertFalse(any(change.ready() for change in changes))
+                release.set()
+                self.assertEqual([change.get(5) for change in changes], [True, True])
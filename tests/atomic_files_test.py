@@ -0,0 +1,41 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from envmgr_healthchecks import atomic_files
+from envmgr_healthchecks.atomic_files import replace_file, write_file_atomically
+
+
+class TestAtomicFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'definition.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_existing_file_is_replaced_without_leaving_temporary_files(self):
+        write_file_atomically(self.path, 'old')
+        write_file_atomically(self.path, 'new')
+        with open(self.path) as written_file:
+            self.assertEqual(written_file.read(), 'new')
+        self.assertEqual(os.listdir(self.directory), ['definition.json'])
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)
+
+    def test_temporary_file_is_removed_when_replace_fails(self):
+        with patch.object(atomic_files, 'replace_file', side_effect=OSError('replace failed')):
+            with self.assertRaises(OSError):
+                write_file_atomically(self.path, 'content')
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_windows_replaces_with_move_file_ex(self):
+        with patch.object(atomic_files, 'IS_WINDOWS', True), \
+                patch.object(atomic_files, '_move_file_ex') as move_file_ex, \
+                patch.object(atomic_files.os, 'rename') as rename:
+            replace_file('source', self.path)
+        move_file_ex.assert_called_once_with('source', self.path)
+        self.assertFalse(rename.called)
@@ -1,9 +1,10 @@
 import base64
 import json
+import requests
 import responses
 import unittest
 from envmgr_healthchecks.api.consul.consul_api import ConsulApi, ConsulError
-from mock import patch
+from mock import Mock, patch
 
 consul_config = {'scheme': 'http', 'host': 'localhost',
                  'port': 8500, 'version': 'v1', 'acl_token': None}
@@ -130,3 +131,248 @@ class TestConsulApi(unittest.TestCase):
         is_success = consul_api.register_service(
             id='service_id', name='service_name', address='127.0.0.1', port=8080, tags=['tag'])
         self.assertEqual(is_success, False)
+
+    @responses.activate
+    def test_register_service_with_checks_in_one_request(self):
+        responses.add(
+            responses.PUT, 'http://localhost:8500/v1/agent/service/register', status=200)
+        consul_api = ConsulApi(consul_config)
+        is_success = consul_api.register_service(
+            id='service_id', name='service_name', address='127.0.0.1', port=8080, tags=['tag'],
+            checks=[{'ServiceID': 'service_id', 'ID': 'service_id:check', 'Name': 'check',
+                     'HTTP': 'http://localhost/health', 'Interval': '10s'}])
+        self.assertEqual(is_success, True)
+        self.assertEqual(len(responses.calls), 1)
+        definition = json.loads(responses.calls[0].request.body)
+        self.assertEqual(definition['Checks'], [{'CheckID': 'service_id:check', 'Name': 'check',
+                                                 'HTTP': 'http://localhost/health', 'Interval': '10s'}])
+
+    @responses.activate
+    def test_requests_share_pooled_session(self):
+        responses.add(responses.GET, 'http://localhost:8500/v1/agent/self',
+                      json={'some': 'content'}, status=200)
+        responses.add(
+            responses.PUT, 'http://localhost:8500/v1/agent/check/deregister/check_id', status=200)
+        consul_api = ConsulApi(consul_config)
+        with patch.object(consul_api._session, 'get', wraps=consul_api._session.get) as mock_get, \
+                patch.object(consul_api._session, 'put', wraps=consul_api._session.put) as mock_put:
+            consul_api.check_connectivity()
+            consul_api.deregister_check('check_id')
+            self.assertEqual(mock_get.call_count, 1)
+            self.assertEqual(mock_put.call_count, 1)
+
+    @responses.activate
+    def test_keep_alive_can_be_disabled(self):
+        responses.add(responses.GET, 'http://localhost:8500/v1/agent/self',
+                      json={'some': 'content'}, status=200)
+        config = dict(consul_config, keep_alive=False)
+        consul_api = ConsulApi(config)
+        consul_api.check_connectivity()
+        self.assertEqual(responses.calls[0].request.headers['Connection'], 'close')
+
+    def test_close_releases_connection_pool(self):
+        consul_api = ConsulApi(consul_config)
+        with patch.object(consul_api._session, 'close') as mock_close:
+            with consul_api:
+                pass
+            mock_close.assert_called_once_with()
+
+    @responses.activate
+    def test_register_checks_reports_result_per_check(self):
+        responses.add(
+            responses.PUT, 'http://localhost:8500/v1/agent/check/register', status=200)
+        responses.add(
+            responses.PUT, 'http://localhost:8500/v1/agent/check/deregister/stale_check', status=200)
+        responses.add(
+            responses.PUT, 'http://localhost:8500/v1/agent/check/deregister/unknown_check', status=404)
+        consul_api = ConsulApi(consul_config)
+        definitions = [
+            {'ServiceID': 'Ping', 'ID': 'http_check', 'Name': 'Ping',
+             'HTTP': 'http://127.0.0.1:8080/ping', 'Interval': '10s'},
+            {'ServiceID': 'Ping', 'ID': 'script_check', 'Name': 'Script',
+             'Script': '/opt/ping/check.sh', 'Interval': '10s'}]
+        (registered, deregistered) = consul_api.register_checks(
+            definitions, ['stale_check', 'unknown_check'], max_workers=4)
+        self.assertEqual(registered, {'http_check': True, 'script_check': True})
+        self.assertEqual(deregistered, {'stale_check': True, 'unknown_check': False})
+        self.assertEqual(len(responses.calls), 4)
+
+    @responses.activate
+    def test_get_key_indexes_issues_blocking_recursive_query(self):
+        entries = [{'Key': 'prefix/a', 'Value': None, 'ModifyIndex': 7},
+                   {'Key': 'prefix/b', 'Value': None, 'ModifyIndex': 9}]
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/prefix', json=entries,
+                      status=200, adding_headers={'X-Consul-Index': '9'})
+        consul_api = ConsulApi(consul_config)
+        (modify_index, key_indexes) = consul_api.get_key_indexes('prefix', index=5, wait='10s')
+        self.assertEqual(modify_index, '9')
+        self.assertEqual(key_indexes, {'prefix/a': 7, 'prefix/b': 9})
+        self.assertIn('recurse&index=5&wait=10s', responses.calls[0].request.url)
+
+    @responses.activate
+    def test_optimistic_write_uses_modify_index_from_previous_read(self):
+        key = 'key'
+        value = [{'Key': key, 'Value': base64.b64encode(json.dumps(
+            {'property': 'some_value'})), 'ModifyIndex': 100}]
+        responses.add(
+            responses.GET, 'http://localhost:8500/v1/kv/{0}'.format(key), json=value, status=200)
+        responses.add(
+            responses.PUT, 'http://localhost:8500/v1/kv/{0}'.format(key), body='true', status=200)
+        consul_api = ConsulApi(dict(consul_config, optimistic_writes=True))
+        consul_api.get_value(key)
+        self.assertEqual(consul_api.write_value(key, {'property': 'new_value'}), True)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertTrue(responses.calls[1].request.url.endswith('kv/key?cas=100'))
+
+    @responses.activate
+    def test_optimistic_write_retrieves_modify_index_when_cas_fails(self):
+        key = 'key'
+        responses.add(
+            responses.PUT, 'http://localhost:8500/v1/kv/{0}'.format(key), body='false', status=200)
+        responses.add(
+            responses.PUT, 'http://localhost:8500/v1/kv/{0}'.format(key), body='true', status=200)
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/{0}'.format(key), json=[],
+                      status=200, adding_headers={'X-Consul-Index': '120'})
+        consul_api = ConsulApi(dict(consul_config, optimistic_writes=True))
+        consul_api._remember_modify_index(key, 100)
+        self.assertEqual(consul_api.write_value(key, {'property': 'new_value'}), True)
+        self.assertEqual([call.request.url.split('/')[-1] for call in responses.calls],
+                         ['key?cas=100', 'key?index', 'key?cas=120'])
+
+    @responses.activate
+    def test_get_tree_reads_subtree_in_one_request(self):
+        entries = [{'Key': 'prefix/', 'Value': None, 'ModifyIndex': 3},
+                   {'Key': 'prefix/a', 'Value': base64.b64encode(json.dumps({'a': 1})), 'ModifyIndex': 7},
+                   {'Key': 'prefix/b', 'Value': base64.b64encode(json.dumps('b')), 'ModifyIndex': 9}]
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/prefix', json=entries,
+                      status=200, adding_headers={'X-Consul-Index': '9'})
+        consul_api = ConsulApi(consul_config)
+        tree = consul_api.get_tree('prefix')
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(dict(tree), {'prefix/': None, 'prefix/a': {'a': 1}, 'prefix/b': 'b'})
+        self.assertEqual(tree.get_modify_index('prefix/a'), 7)
+        self.assertEqual(tree.modify_index, '9')
+
+    @responses.activate
+    def test_get_tree_for_unknown_key_prefix(self):
+        responses.add(
+            responses.GET, 'http://localhost:8500/v1/kv/prefix', status=404)
+        consul_api = ConsulApi(consul_config)
+        self.assertEqual(len(consul_api.get_tree('prefix')), 0)
+
+    @responses.activate
+    def test_iter_tree_yields_entries_with_lazy_values(self):
+        entries = [{'Key': 'prefix/a', 'Value': base64.b64encode(json.dumps({'a': 1})), 'ModifyIndex': 7},
+                   {'Key': 'prefix/b', 'Value': base64.b64encode(json.dumps('b')), 'ModifyIndex': 9}]
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/prefix', json=entries,
+                      status=200)
+        consul_api = ConsulApi(consul_config)
+        actual_entries = [(key, modify_index, value.decode())
+                          for (key, modify_index, value) in consul_api.iter_tree('prefix')]
+        self.assertEqual(actual_entries, [('prefix/a', 7, {'a': 1}), ('prefix/b', 9, 'b')])
+        # Modify indexes are only kept for optimistic writes
+        self.assertEqual(len(consul_api._cas_indexes), 0)
+
+    @responses.activate
+    def test_modify_indexes_kept_for_optimistic_writes_are_bounded(self):
+        entries = [{'Key': 'prefix/{0}'.format(i), 'Value': None, 'ModifyIndex': i} for i in range(5)]
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/prefix', json=entries,
+                      status=200)
+        consul_api = ConsulApi(dict(consul_config, optimistic_writes=True, cas_index_cache_size=2))
+        self.assertEqual(len(list(consul_api.iter_tree('prefix'))), 5)
+        self.assertEqual(dict(consul_api._cas_indexes), {'prefix/3': 3, 'prefix/4': 4})
+        consul_api.get_tree('prefix')
+        self.assertEqual(dict(consul_api._cas_indexes), {'prefix/3': 3, 'prefix/4': 4})
+
+    @responses.activate
+    def test_iter_tree_for_unknown_key_prefix(self):
+        responses.add(
+            responses.GET, 'http://localhost:8500/v1/kv/prefix', status=404)
+        consul_api = ConsulApi(consul_config)
+        self.assertEqual(list(consul_api.iter_tree('prefix')), [])
+
+    @responses.activate
+    def test_get_value_is_served_from_read_cache(self):
+        key = 'key'
+        value = [{'Key': key, 'Value': base64.b64encode(json.dumps(
+            {'property': 'some_value'})), 'ModifyIndex': 100}]
+        responses.add(
+            responses.GET, 'http://localhost:8500/v1/kv/{0}'.format(key), json=value, status=200)
+        consul_api = ConsulApi(dict(consul_config, read_cache_size=10))
+        self.assertEqual(consul_api.get_value(key), {'property': 'some_value'})
+        self.assertEqual(consul_api.get_value(key), {'property': 'some_value'})
+        self.assertEqual(consul_api.key_exists(key), True)
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(consul_api.get_read_cache_stats(), {'hits': 2, 'misses': 1, 'size': 1})
+
+    @responses.activate
+    def test_key_exists_lists_keys_instead_of_reading_value(self):
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/key',
+                      json=['key', 'key/child', 'keys'], status=200)
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/other', status=404)
+        consul_api = ConsulApi(consul_config)
+        self.assertEqual(consul_api.key_exists('key'), True)
+        self.assertEqual(consul_api.key_exists('other'), False)
+        self.assertIn('?keys', responses.calls[0].request.url)
+
+    @responses.activate
+    def test_get_checks(self):
+        checks = {'service:check': {'CheckID': 'service:check', 'ServiceID': 'service', 'Notes': ''}}
+        responses.add(responses.GET, 'http://localhost:8500/v1/agent/checks',
+                      json=checks, status=200)
+        consul_api = ConsulApi(consul_config)
+        self.assertEqual(consul_api.get_checks(), checks)
+
+    @responses.activate
+    def test_wait_for_change_blocks_with_wait_and_client_timeout(self):
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/prefix',
+                      adding_headers={'X-Consul-Index': '10'}, status=200)
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/prefix',
+                      adding_headers={'X-Consul-Index': '12'}, status=200)
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/prefix',
+                      adding_headers={'X-Consul-Index': '12'}, status=200)
+        consul_api = ConsulApi(consul_config)
+        with patch.object(consul_api._session, 'get', wraps=consul_api._session.get) as mock_get:
+            self.assertTrue(consul_api.wait_for_change('prefix', wait='32s'))
+            self.assertFalse(consul_api.wait_for_change('prefix', wait='32s'))
+        self.assertIn('kv/prefix?index=10&wait=32s', responses.calls[1].request.url)
+        self.assertIn('kv/prefix?index=12&wait=32s', responses.calls[2].request.url)
+        self.assertEqual(mock_get.call_args[1]['timeout'], (5, 39.0))
+
+    @responses.activate
+    def test_wait_for_change_backs_off_when_index_is_missing_or_goes_backwards(self):
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/prefix', status=200)
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/prefix', status=200)
+        consul_api = ConsulApi(consul_config)
+        consul_api._sleep = Mock()
+        self.assertFalse(consul_api.wait_for_change('prefix'))
+        self.assertFalse(consul_api.wait_for_change('prefix'))
+        # The delay grows with every consecutive missing index instead of polling in a loop
+        (first_delay, second_delay) = [call[0][0] for call in consul_api._sleep.call_args_list]
+        self.assertTrue(0.5 <= first_delay <= 1 < second_delay <= 2)
+
+        responses.reset()
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/prefix',
+                      adding_headers={'X-Consul-Index': '5'}, status=200)
+        (modify_index, is_changed) = consul_api._wait_for_change('prefix', '100')
+        self.assertEqual((modify_index, is_changed), ('5', True))
+        self.assertEqual(consul_api._sleep.call_count, 3)
+
+    def test_wait_for_change_reports_no_change_when_blocking_query_times_out(self):
+        consul_api = ConsulApi(consul_config)
+        consul_api._sleep = Mock()
+        with patch.object(consul_api._session, 'get', side_effect=requests.exceptions.ReadTimeout()) as get:
+            self.assertEqual(consul_api._wait_for_change('prefix', '7', '1s'), ('7', False))
+        # The default policy does not retry the blocking query, so its timeout bounds the call
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(consul_api._sleep.call_count, 1)
+        self.assertEqual(consul_api.get_retry_counts(), {})
+
+    def test_blocking_queries_are_not_retried_on_timeout(self):
+        consul_api = ConsulApi(consul_config)
+        with patch.object(consul_api._session, 'get', side_effect=requests.exceptions.ReadTimeout()) as get:
+            with self.assertRaises(requests.exceptions.Timeout):
+                consul_api.get_key_indexes('prefix', index='7', wait='1s')
+            with self.assertRaises(requests.exceptions.Timeout):
+                consul_api.get_services('hash', '1s')
+        self.assertEqual(get.call_count, 2)
@@ -0,0 +1,40 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import unittest
+from envmgr_healthchecks.api.consul.consul_cache import ConsulReadCache
+
+
+class TestConsulReadCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000
+        self.cache = ConsulReadCache(2, 60, clock=lambda: self.now)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.put('a', 1, 10)
+        self.cache.put('b', 2, 11)
+        self.cache.get('a')
+        self.cache.put('c', 3, 12)
+        self.assertEqual(self.cache.get('b'), None)
+        self.assertEqual(self.cache.get('a').value, 1)
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 1, 'size': 2})
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.put('a', 1, 10)
+        self.now += 61
+        self.assertEqual(self.cache.get('a'), None)
+
+    def test_entries_are_invalidated_by_new_modify_index(self):
+        self.cache.put('prefix/a', {'a': 1}, 10)
+        self.cache.put('prefix/b', {'b': 1}, 11)
+        self.cache.invalidate('prefix/a', 10)
+        self.assertEqual(self.cache.get('prefix/a').modify_index, 10)
+        self.cache.invalidate_prefix('prefix/', {'prefix/a': 10, 'prefix/b': 15})
+        self.assertEqual(self.cache.get('prefix/b'), None)
+        self.cache.invalidate('prefix/a', 12)
+        self.assertEqual(self.cache.get('prefix/a'), None)
+
+    def test_cached_values_are_copied(self):
+        self.cache.put('a', {'a': 1}, 10)
+        self.cache.get('a').value['a'] = 2
+        self.assertEqual(self.cache.get('a').value, {'a': 1})
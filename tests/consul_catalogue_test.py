@@ -0,0 +1,112 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import responses
+import threading
+import unittest
+from mock import Mock
+from envmgr_healthchecks.api.consul.consul_api import ConsulApi
+from envmgr_healthchecks.api.consul.consul_catalogue import ConsulServiceCatalogue, ServiceCatalogue
+from envmgr_healthchecks.health_checks.consul_health_check import ConsulHealthCheck
+from envmgr_healthchecks.health_checks.health_check_errors import RegisterError
+
+consul_config = {'scheme': 'http', 'host': 'localhost',
+                 'port': 8500, 'version': 'v1', 'acl_token': None}
+
+SERVICES = {
+    'web-blue': {'ID': 'web-blue', 'Service': 'web', 'Tags': ['blue', 'http']},
+    'web-green': {'ID': 'web-green', 'Service': 'web', 'Tags': ['green', 'http']},
+    'db': {'ID': 'db', 'Service': 'db', 'Tags': None}
+}
+
+
+class TestServiceCatalogue(unittest.TestCase):
+    def test_services_are_indexed_by_id_name_and_tag(self):
+        catalogue = ServiceCatalogue(SERVICES, 'hash')
+        self.assertIn('web-blue', catalogue)
+        self.assertTrue(catalogue.is_registered('web'))
+        self.assertTrue(catalogue.is_registered('db'))
+        self.assertTrue(catalogue.is_registered('web', 'green'))
+        self.assertTrue(catalogue.is_registered('web-blue', 'blue'))
+        self.assertFalse(catalogue.is_registered('web-blue', 'green'))
+        self.assertFalse(catalogue.is_registered('api'))
+        self.assertEqual(catalogue.ids_by_tag('http'), frozenset(['web-blue', 'web-green']))
+        self.assertEqual(catalogue.ids_by_name('web'), frozenset(['web-blue', 'web-green']))
+
+
+class TestConsulServiceCatalogue(unittest.TestCase):
+    def test_blocking_refresh_waits_on_content_hash(self):
+        consul_api = Mock()
+        consul_api.get_services.side_effect = [('hash1', {}), ('hash1', {}), ('hash2', SERVICES)]
+        catalogue = ConsulServiceCatalogue(consul_api, wait='1m')
+        self.assertFalse(catalogue.is_registered('web'))
+        self.assertFalse(catalogue.refresh(block=True))
+        self.assertTrue(catalogue.refresh(block=True))
+        self.assertTrue(catalogue.is_registered('web', 'blue'))
+        consul_api.get_services.assert_called_with(content_hash='hash1', wait='1m')
+
+    def test_missing_service_refreshes_snapshot_once(self):
+        consul_api = Mock()
+        consul_api.get_services.side_effect = [('hash1', {}), ('hash2', SERVICES)]
+        catalogue = ConsulServiceCatalogue(consul_api)
+        self.assertTrue(catalogue.is_registered('db', refresh_on_miss=True))
+        self.assertTrue(catalogue.is_registered('db', refresh_on_miss=True))
+        self.assertEqual(consul_api.get_services.call_count, 2)
+        consul_api.get_services.assert_called_with(content_hash=None, wait=None)
+
+    def test_missing_service_lookup_does_not_wait_for_blocking_refresh(self):
+        is_blocking = threading.Event()
+        release = threading.Event()
+
+        def get_services(content_hash=None, wait=None):
+            if content_hash is None:
+                return ('hash2', SERVICES) if is_blocking.is_set() else ('hash1', {})
+            is_blocking.set()
+            release.wait(10)
+            return ('hash1', {})
+        consul_api = Mock()
+        consul_api.get_services.side_effect = get_services
+        catalogue = ConsulServiceCatalogue(consul_api)
+        catalogue.snapshot
+        refresh_thread = threading.Thread(target=catalogue.refresh, kwargs={'block': True})
+        refresh_thread.start()
+        try:
+            self.assertTrue(is_blocking.wait(10))
+            self.assertTrue(catalogue.is_registered('web', refresh_on_miss=True))
+            self.assertFalse(release.is_set())
+        finally:
+            release.set()
+            refresh_thread.join()
+        # The older blocking request does not replace the newer snapshot
+        self.assertTrue(catalogue.is_registered('web'))
+
+    @responses.activate
+    def test_consul_api_blocks_on_agent_services_hash(self):
+        responses.add(responses.GET, 'http://localhost:8500/v1/agent/services', json=SERVICES,
+                      adding_headers={'X-Consul-ContentHash': 'hash2'}, status=200)
+        consul_api = ConsulApi(consul_config)
+        self.assertEqual(consul_api.get_services('hash1', '10s'), ('hash2', SERVICES))
+        self.assertIn('agent/services?hash=hash1&wait=10s', responses.calls[0].request.url)
+
+    def create_health_check(self, consul_api, require_registered_service):
+        return ConsulHealthCheck(
+            name='ConsulHealthCheck', logger=Mock(), api=consul_api, service_id='api',
+            archive_dir='', service_catalogue=ConsulServiceCatalogue(consul_api),
+            require_registered_service=require_registered_service,
+            appspec={'consul_healthchecks': {'check': {
+                'name': 'check', 'type': 'http', 'http': 'http://localhost/health', 'interval': '10s'}}})
+
+    def test_checks_of_an_unregistered_service_are_rejected_when_required(self):
+        consul_api = Mock()
+        consul_api.get_services.return_value = ('hash', SERVICES)
+        health_check = self.create_health_check(consul_api, require_registered_service=True)
+        with self.assertRaisesRegexp(RegisterError, 'Consul service \'api\' is not registered'):
+            health_check.register()
+        self.assertFalse(consul_api.register_http_check.called)
+
+    def test_service_registration_is_not_required_by_default(self):
+        consul_api = Mock()
+        health_check = self.create_health_check(consul_api, require_registered_service=False)
+        health_check.register()
+        self.assertTrue(consul_api.register_http_check.called)
+        self.assertFalse(consul_api.get_services.called)
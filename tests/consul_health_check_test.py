@@ -197,6 +197,146 @@ class TestHealthChecks(unittest.TestCase):
             self.tested_fn.api.register_http_check.assert_called_once_with(
                 'my-mock-service', 'my-mock-service:test_http_check', 'test-http', 'http://acme.com/healthcheck', '20')
 
+    @patch('os.stat')
+    @patch('os.chmod')
+    @patch('os.path.exists', return_value=True)
+    def test_batch_registration_replaces_previous_deployment_checks(self, exists, chmod, stat):
+        checks = {
+            'test_check': self.create_check(True, 'test-script', 'test-script.py', '10'),
+            'test_http_check': self.create_check(False, 'test-http', 'http://acme.com/healthcheck', '20')
+        }
+        previous_checks = {
+            'test_check': self.create_check(True, 'test-script', 'test-script.py', '10'),
+            'old_check': self.create_check(False, 'old-http', 'http://acme.com/old', '20')
+        }
+        self.tested_fn.batch = True
+        self.tested_fn.last_id = 'previous-deployment'
+        self.tested_fn.api.register_checks.return_value = (
+            {'my-mock-service:test_check': True, 'my-mock-service:test_http_check': True},
+            {'my-mock-service:old_check': True})
+
+        with patch.object(ConsulHealthCheck, '_get_previous_deployment_appspec', return_value={}), \
+                patch.object(ConsulHealthCheck, 'find_health_checks',
+                             side_effect=[(checks, ''), (previous_checks, '')]):
+            results = self.tested_fn.register()
+        self.assertEqual(results, {'test_check': True, 'test_http_check': True})
+        (definitions, stale_ids, _), _ = self.tested_fn.api.register_checks.call_args
+        self.assertEqual(stale_ids, ['my-mock-service:old_check'])
+        self.assertEqual(sorted(definition['ID'] for definition in definitions),
+                         ['my-mock-service:test_check', 'my-mock-service:test_http_check'])
+        self.assertFalse(self.tested_fn.api.register_script_check.called)
+
+    def test_batch_registration_without_checks_deregisters_previous_checks(self):
+        previous_checks = {
+            'old_check': self.create_check(False, 'old-http', 'http://acme.com/old', '20')
+        }
+        self.tested_fn.batch = True
+        self.tested_fn.last_id = 'previous-deployment'
+        self.tested_fn.api.register_checks.return_value = ({}, {'my-mock-service:old_check': True})
+
+        with patch.object(ConsulHealthCheck, '_get_previous_deployment_appspec', return_value={}), \
+                patch.object(ConsulHealthCheck, 'find_health_checks',
+                             side_effect=[(None, ''), (previous_checks, '')]):
+            results = self.tested_fn.register()
+        self.assertEqual(results, {})
+        self.tested_fn.api.register_checks.assert_called_once_with([], ['my-mock-service:old_check'], None)
+        self.assertEqual(self.tested_fn.deregistration_report.deregistered, ['old_check'])
+
+    @patch('os.path.exists', return_value=True)
+    def test_batch_registration_reports_failed_checks(self, exists):
+        checks = {
+            'check_1': self.create_check(False, 'http-1', 'http://acme.com/1', '20'),
+            'check_2': self.create_check(False, 'http-2', 'http://acme.com/2', '20')
+        }
+        self.tested_fn.batch = True
+        self.tested_fn.api.register_checks.return_value = (
+            {'my-mock-service:check_1': True, 'my-mock-service:check_2': False}, {})
+
+        with patch.object(ConsulHealthCheck, 'find_health_checks') as mock_health_check:
+            mock_health_check.return_value = (checks, '')
+            with self.assertRaisesRegexp(RegisterError, 'Failed to register Consul health checks: check_2'):
+                self.tested_fn.register()
+
+    def test_reconcile_only_changes_differing_checks(self):
+        checks = {
+            'unchanged': self.create_check(False, 'unchanged', 'http://acme.com/unchanged', '20'),
+            'updated': self.create_check(False, 'updated', 'http://acme.com/updated', '20'),
+            'added': self.create_check(False, 'added', 'http://acme.com/added', '20')
+        }
+        unchanged_definition = {'ServiceID': 'my-mock-service', 'ID': 'my-mock-service:unchanged',
+                                'Name': 'unchanged', 'HTTP': 'http://acme.com/unchanged', 'Interval': '20'}
+        self.tested_fn.api.get_checks.return_value = {
+            'my-mock-service:unchanged': {
+                'ServiceID': 'my-mock-service',
+                'Notes': self.tested_fn._create_check_fingerprint(unchanged_definition)},
+            'my-mock-service:updated': {'ServiceID': 'my-mock-service', 'Notes': ''},
+            'my-mock-service:removed': {'ServiceID': 'my-mock-service', 'Notes': ''},
+            'other-service:check': {'ServiceID': 'other-service', 'Notes': ''},
+            'service:my-mock-service': {'ServiceID': 'my-mock-service', 'Notes': ''}
+        }
+        self.tested_fn.api.register_checks.return_value = (
+            {'my-mock-service:added': True, 'my-mock-service:updated': True},
+            {'my-mock-service:removed': True})
+
+        with patch.object(ConsulHealthCheck, 'find_health_checks', return_value=(checks, '')):
+            report = self.tested_fn.reconcile()
+        (definitions, removed, _), _ = self.tested_fn.api.register_checks.call_args
+        self.assertEqual([definition['ID'] for definition in definitions],
+                         ['my-mock-service:added', 'my-mock-service:updated'])
+        self.assertEqual(removed, ['my-mock-service:removed'])
+        self.assertEqual(report['unchanged'], ['my-mock-service:unchanged'])
+        self.assertEqual(report['failed'], [])
+        self.assertEqual(report['api_calls_saved'], 2)
+
+    @patch('os.stat')
+    @patch('os.chmod')
+    @patch('os.path.exists', return_value=True)
+    def test_service_registration_includes_checks(self, exists, chmod, stat):
+        checks = {
+            'test_check': self.create_check(True, 'test-script', 'test-script.py', '10'),
+            'test_http_check': self.create_check(False, 'test-http', 'http://acme.com/healthcheck', '20')
+        }
+        self.tested_fn.api.register_service.return_value = True
+
+        with patch.object(ConsulHealthCheck, 'find_health_checks', return_value=(checks, '')):
+            registered = self.tested_fn.register_service(name='my-service', port=8080, tags=['blue'])
+        self.assertEqual(registered, ['test_check', 'test_http_check'])
+        (service_id, name, address, port, tags), kwargs = self.tested_fn.api.register_service.call_args
+        self.assertEqual((service_id, name, port, tags), ('my-mock-service', 'my-service', 8080, ['blue']))
+        self.assertEqual([definition['ID'] for definition in kwargs['checks']],
+                         ['my-mock-service:test_check', 'my-mock-service:test_http_check'])
+        self.assertFalse(self.tested_fn.api.register_script_check.called)
+        self.assertFalse(self.tested_fn.api.register_http_check.called)
+
+    def test_failed_service_registration_raises(self):
+        checks = {'test_http_check': self.create_check(False, 'test-http', 'http://acme.com/healthcheck', '20')}
+        self.tested_fn.api.register_service.return_value = False
+
+        with patch.object(ConsulHealthCheck, 'find_health_checks', return_value=(checks, '')):
+            with self.assertRaisesRegexp(RegisterError, 'Failed to register Consul service \'my-mock-service\''):
+                self.tested_fn.register_service()
+
+    def test_deregistration_reports_each_previous_check(self):
+        previous_checks = {
+            'check_1': self.create_check(False, 'http-1', 'http://acme.com/1', '20'),
+            'check_2': self.create_check(False, 'http-2', 'http://acme.com/2', '20')
+        }
+        self.tested_fn.last_id = 'previous-deployment'
+        self.tested_fn.max_workers = 4
+        self.tested_fn.logger.warning = Mock()
+        self.tested_fn.api.deregister_checks.return_value = {
+            'my-mock-service:check_1': True, 'my-mock-service:check_2': False}
+
+        with patch.object(ConsulHealthCheck, '_get_previous_deployment_appspec', return_value={}), \
+                patch.object(ConsulHealthCheck, 'find_health_checks', return_value=(previous_checks, '')):
+            report = self.tested_fn.deregister()
+        self.tested_fn.api.deregister_checks.assert_called_once_with(
+            ['my-mock-service:check_1', 'my-mock-service:check_2'], 4)
+        self.assertEqual(report.deregistered, ['check_1'])
+        self.assertEqual(report.failed, ['check_2'])
+        self.assertFalse(report.is_success)
+        self.assertFalse(self.tested_fn.api.deregister_check.called)
+
     def create_check(self, is_script, name, value, interval):
         check = {'name': name, 'interval': interval}
         if is_script:
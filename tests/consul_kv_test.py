@@ -0,0 +1,24 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import json
+import unittest
+from envmgr_healthchecks.api.consul.consul_kv import iter_json_array
+
+
+class TestIterJsonArray(unittest.TestCase):
+    def test_elements_split_across_chunks(self):
+        elements = [{'Key': 'a', 'Value': 'x' * 50, 'ModifyIndex': 1},
+                    {'Key': 'b', 'Value': None, 'ModifyIndex': 2},
+                    {'Key': 'c', 'Value': '[],', 'ModifyIndex': 3}]
+        content = json.dumps(elements, indent=2)
+        for chunk_size in (1, 7, 64, len(content)):
+            chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+            self.assertEqual(list(iter_json_array(chunks)), elements)
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array([' [', ' ]'])), [])
+
+    def test_unterminated_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['[{"Key": "a"}, {"Key"']))
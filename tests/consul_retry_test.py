@@ -0,0 +1,182 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import random
+import unittest
+import requests
+import responses
+from mock import Mock
+from envmgr_healthchecks.api.consul.consul_api import ConsulApi, ConsulError
+from envmgr_healthchecks.api.consul.consul_retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+consul_config = {'scheme': 'http', 'host': 'localhost',
+                 'port': 8500, 'version': 'v1', 'acl_token': None}
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def create_policy(clock, **kwargs):
+    return RetryPolicy(clock=clock, sleep=clock.sleep, random_generator=random.Random(1), **kwargs)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_connection_errors_are_retried_with_decorrelated_jitter(self):
+        clock = FakeClock()
+        policy = create_policy(clock, max_delay=10)
+        response = Mock(status_code=200)
+        func = Mock(side_effect=[requests.exceptions.ConnectionError()] * 5 + [response])
+        self.assertIs(policy.call(func, 'agent/self'), response)
+        self.assertEqual(policy.retry_counts, {'agent/self': 5})
+        previous = policy.base_delay
+        for delay in clock.sleeps:
+            self.assertTrue(policy.base_delay <= delay <= min(10, previous * 3))
+            previous = delay
+        self.assertNotEqual(len(set(clock.sleeps)), 1)
+
+    def test_deadline_bounds_total_retry_time(self):
+        clock = FakeClock()
+        policy = create_policy(clock, deadline=30)
+        func = Mock(side_effect=requests.exceptions.ConnectionError())
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            policy.call(func, 'agent/self')
+        self.assertTrue(sum(clock.sleeps) <= 30)
+        self.assertTrue(func.call_count > 1)
+
+    def test_server_errors_are_retried_until_attempts_run_out(self):
+        clock = FakeClock()
+        policy = create_policy(clock, max_attempts=3)
+        response = Mock(status_code=503)
+        self.assertIs(policy.call(Mock(return_value=response), 'kv'), response)
+        self.assertEqual(policy.retry_counts, {'kv': 2})
+
+    def test_other_errors_are_not_retried(self):
+        policy = create_policy(FakeClock())
+        func = Mock(side_effect=ValueError())
+        with self.assertRaises(ValueError):
+            policy.call(func, 'kv')
+        self.assertEqual(func.call_count, 1)
+
+    def test_replaced_policy_shares_retry_counts(self):
+        clock = FakeClock()
+        policy = create_policy(clock)
+        blocking_policy = policy.replace(retry_on_timeout=False)
+        func = Mock(side_effect=requests.exceptions.ReadTimeout())
+        with self.assertRaises(requests.exceptions.Timeout):
+            blocking_policy.call(func, 'kv')
+        self.assertEqual(func.call_count, 1)
+        blocking_policy.call(Mock(side_effect=[requests.exceptions.ConnectionError(), Mock(status_code=200)]), 'kv')
+        self.assertEqual(policy.retry_counts, {'kv': 1})
+        self.assertTrue(policy.retry_on_timeout)
+
+    def test_circuit_breaker_fails_fast_once_agent_is_unreachable(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(open_after=10, reset_after=30, clock=clock)
+        policy = create_policy(clock, deadline=None, max_attempts=20, circuit_breaker=breaker)
+        func = Mock(side_effect=requests.exceptions.ConnectionError())
+        with self.assertRaises(CircuitOpenError):
+            policy.call(func, 'agent/self')
+        attempts = func.call_count
+        with self.assertRaises(CircuitOpenError):
+            policy.call(func, 'agent/self')
+        self.assertEqual(func.call_count, attempts)
+
+        clock.now += 30
+        func.side_effect = None
+        func.return_value = Mock(status_code=200)
+        policy.call(func, 'agent/self')
+        self.assertFalse(breaker.is_open)
+
+
+class TestConsulApiRetries(unittest.TestCase):
+    @responses.activate
+    def test_server_errors_are_retried_before_raising(self):
+        responses.add(responses.GET, 'http://localhost:8500/v1/agent/self', body='busy', status=503)
+        responses.add(responses.GET, 'http://localhost:8500/v1/agent/self', body='{}', status=200)
+        clock = FakeClock()
+        consul_api = ConsulApi(consul_config, retry_policy=create_policy(clock))
+        consul_api.check_connectivity()
+        self.assertEqual(consul_api.get_retry_counts(), {'agent/self': 1})
+
+    @responses.activate
+    def test_error_message_is_kept_for_internal_errors(self):
+        responses.add(responses.GET, 'http://localhost:8500/v1/agent/self', body='busy', status=500)
+        consul_api = ConsulApi(consul_config, retry_policy=create_policy(FakeClock(), max_attempts=2))
+        with self.assertRaises(ConsulError) as cm:
+            consul_api.check_connectivity()
+        self.assertEqual(str(cm.exception), 'Consul HTTP API internal error. Response content: busy')
+
+    def test_open_circuit_is_reported_as_consul_error(self):
+        clock = FakeClock()
+        policy = create_policy(clock, deadline=None, max_attempts=1,
+                               circuit_breaker=CircuitBreaker(open_after=0, clock=clock))
+        consul_api = ConsulApi(consul_config, retry_policy=policy)
+        consul_api._session.get = Mock(side_effect=requests.exceptions.ConnectionError())
+        with self.assertRaises(ConsulError) as cm:
+            consul_api.check_connectivity()
+        self.assertIn('Failed to establish connection', str(cm.exception))
+        with self.assertRaises(ConsulError) as cm:
+            consul_api.check_connectivity()
+        self.assertIn('failing fast', str(cm.exception))
+        self.assertEqual(consul_api._session.get.call_count, 1)
+
+    def test_cas_writes_are_not_retried_after_a_timeout(self):
+        consul_api = ConsulApi(consul_config, retry_policy=create_policy(FakeClock()))
+        consul_api._session.put = Mock(side_effect=requests.exceptions.ReadTimeout())
+        with self.assertRaises(requests.exceptions.Timeout):
+            consul_api._cas_write('key', 'value', 7)
+        self.assertEqual(consul_api._session.put.call_count, 1)
+
+    def test_config_built_policy_bounds_attempts(self):
+        policy = RetryPolicy.from_config(consul_config)
+        self.assertEqual(policy.max_attempts, 5)
+        self.assertEqual(RetryPolicy.from_config(dict(consul_config, retry_max_attempts=2)).max_attempts, 2)
+
+    @responses.activate
+    def test_unknown_check_fails_without_retrying(self):
+        responses.add(responses.PUT, 'http://localhost:8500/v1/agent/check/deregister/missing',
+                      body='Unknown check "missing"', status=500)
+        clock = FakeClock()
+        consul_api = ConsulApi(consul_config, retry_policy=create_policy(clock))
+        with self.assertRaises(ConsulError):
+            consul_api.deregister_check('missing')
+        self.assertEqual(consul_api.deregister_checks(['missing']), {'missing': False})
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(clock.sleeps, [])
+
+    def test_agent_writes_give_up_sooner(self):
+        clock = FakeClock()
+        consul_api = ConsulApi(consul_config, retry_policy=create_policy(clock, deadline=None, max_attempts=None))
+        consul_api._session.put = Mock(return_value=Mock(status_code=503, text='', content=''))
+        self.assertFalse(consul_api.register_check({'ID': 'check'}))
+        self.assertTrue(sum(clock.sleeps) <= 30)
+        self.assertTrue(max(clock.sleeps) <= 5)
+
+    @responses.activate
+    def test_public_calls_take_a_retry_policy(self):
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/key', body='busy', status=503)
+        responses.add(responses.GET, 'http://localhost:8500/v1/kv/key', json=[], status=404)
+        clock = FakeClock()
+        consul_api = ConsulApi(consul_config, retry_policy=create_policy(clock, max_attempts=1))
+        self.assertIsNone(consul_api.get_value('key', retry_policy=create_policy(clock, max_attempts=2)))
+        self.assertEqual(len(clock.sleeps), 1)
+
+    def test_assigned_policy_applies_to_blocking_and_cas_calls(self):
+        clock = FakeClock()
+        consul_api = ConsulApi(consul_config)
+        consul_api.retry_policy = create_policy(clock, max_attempts=3)
+        consul_api._session.put = Mock(side_effect=requests.exceptions.ConnectionError())
+        with self.assertRaises(ConsulError):
+            consul_api._cas_write('key', 'value', 7)
+        self.assertEqual(consul_api._session.put.call_count, 3)
+        self.assertEqual(len(clock.sleeps), 2)
@@ -0,0 +1,84 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import Queue
+import threading
+import unittest
+from envmgr_healthchecks.api.consul.consul_watch import ConsulWatch, WatchEvent
+from mock import MagicMock, Mock
+
+
+class TestConsulWatch(unittest.TestCase):
+    def setUp(self):
+        self.responses = {
+            'service1': [('10', {'service1/a': 5, 'service1/b': 10}),
+                         ('12', {'service1/a': 12}),
+                         ('12', {'service1/a': 12})],
+            'service2': [('20', {'service2/a': 20}),
+                         ('20', {'service2/a': 20}),
+                         ('20', {'service2/a': 20})]
+        }
+        self.consul_api = MagicMock()
+        self.consul_api.get_key_indexes.side_effect = \
+            lambda prefix, index, wait: self.responses[prefix].pop(0)
+
+    def test_poll_reports_changes_per_key_prefix(self):
+        callback = MagicMock()
+        watch = ConsulWatch(self.consul_api, ['service1', 'service2'], wait='10s', callbacks=[callback])
+
+        events = watch.poll()
+        self.assertEqual(sorted(events), [
+            WatchEvent('service1', 0, 10, ['service1/a', 'service1/b']),
+            WatchEvent('service2', 0, 20, ['service2/a'])])
+
+        events = watch.poll()
+        self.assertEqual(events, [WatchEvent('service1', 10, 12, ['service1/a', 'service1/b'])])
+        self.consul_api.get_key_indexes.assert_any_call('service1', index=10, wait='10s')
+        self.consul_api.get_key_indexes.assert_any_call('service2', index=20, wait='10s')
+
+        self.assertEqual(watch.poll(), [])
+        self.assertEqual(callback.call_count, 3)
+        self.assertEqual(watch.modify_index('service1'), 12)
+
+    def test_run_publishes_events_to_queue(self):
+        events = Queue.Queue()
+        stop_event = threading.Event()
+        watch = ConsulWatch(self.consul_api, ['service1'], queue=events,
+                            callbacks=[lambda event: event.new_index == 12 and stop_event.set()])
+        watch.run(stop_event)
+        self.assertEqual(events.get_nowait().new_index, 10)
+        self.assertEqual(events.get_nowait().new_index, 12)
+
+    def test_missing_index_backs_off_instead_of_polling(self):
+        self.responses['service1'] = [(None, {}), (None, {}), ('0', {}), ('10', {'service1/a': 10}),
+                                      ('3', {'service1/a': 3})]
+        watch = ConsulWatch(self.consul_api, ['service1'], wait='10s')
+        watch._sleep = Mock()
+        self.assertEqual(watch.poll(), [])
+        self.assertEqual(watch.poll(), [])
+        self.assertEqual(watch.poll(), [])
+        delays = [args[0] for args, _ in watch._sleep.call_args_list]
+        self.assertEqual(len(delays), 3)
+        self.assertTrue(0.5 <= delays[0] <= 1 and 1 <= delays[1] <= 2 and 2 <= delays[2] <= 4)
+        self.assertEqual(watch.modify_index('service1'), 0)
+
+        self.assertEqual(watch.poll(), [WatchEvent('service1', 0, 10, ['service1/a'])])
+        self.assertEqual(watch._sleep.call_count, 3)
+        # A backwards index is reported, and backs off again from the first delay
+        self.assertEqual(watch.poll(), [WatchEvent('service1', 10, 3, ['service1/a'])])
+        self.assertTrue(0.5 <= watch._sleep.call_args[0][0] <= 1)
+
+    def test_more_prefixes_than_workers_are_rejected(self):
+        prefixes = ['service{0}'.format(i) for i in range(50)]
+        with self.assertRaisesRegexp(ValueError, 'Cannot watch 50 key prefixes with 8 workers'):
+            ConsulWatch(self.consul_api, prefixes)
+        self.assertEqual(ConsulWatch(self.consul_api, prefixes, max_workers=50)._max_workers, 50)
+
+    def test_run_waits_for_queries_in_flight_and_sleeps_after_errors(self):
+        stop_event = threading.Event()
+        self.consul_api.get_key_indexes.side_effect = RuntimeError('agent unavailable')
+        watch = ConsulWatch(self.consul_api, ['service1'])
+        watch._sleep = Mock(side_effect=lambda seconds: stop_event.set())
+        watch.run(stop_event)
+        watch._sleep.assert_called_once_with(5)
+        self.assertEqual(self.consul_api.get_key_indexes.call_count, 1)
@@ -0,0 +1,121 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import Mock
+from envmgr_healthchecks.health_checks.fleet_registrar import FleetRegistrar, ServiceDeployment
+from envmgr_healthchecks.metrics import InMemorySink, Metrics
+
+
+class MockLogger(object):
+    def __init__(self):
+        self.info = Mock()
+        self.error = Mock()
+        self.debug = Mock()
+        self.warning = Mock()
+        self.exception = Mock()
+
+
+def create_appspec(name):
+    return {
+        'consul_healthchecks': {
+            'check_http': {'name': name + '-http', 'type': 'http',
+                           'http': 'http://localhost/health', 'interval': '10s'}
+        },
+        'sensu_healthchecks': {
+            'check_sensu': {'name': name + '-sensu', 'server_script': 'check.sh', 'interval': 10}
+        }
+    }
+
+
+def register_checks(definitions, deregister_ids=(), max_workers=None):
+    registered = dict((definition['ID'], definition['ServiceID'] != 'broken') for definition in definitions)
+    return (registered, dict((check_id, True) for check_id in deregister_ids))
+
+
+class TestFleetRegistrar(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sensu_check_path = os.path.join(self.directory, 'checks')
+        os.makedirs(self.sensu_check_path)
+        open(os.path.join(self.directory, 'check.sh'), 'w').close()
+        self.api = Mock(pool_size=10)
+        self.api.register_checks.side_effect = register_checks
+        self.sink = InMemorySink()
+        self.sut = FleetRegistrar(
+            self.api,
+            logger=MockLogger(),
+            platform='linux',
+            instance_tags={},
+            sensu={'healthcheck_search_paths': [self.directory],
+                   'sensu_check_path': self.sensu_check_path},
+            max_workers=2,
+            metrics=Metrics([self.sink]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_registers_every_service_with_a_shared_api(self):
+        deployments = [ServiceDeployment(service_id, self.directory, create_appspec(service_id))
+                       for service_id in ('service-a', 'service-b', 'service-c')]
+        results = self.sut.register(deployments)
+        self.assertEqual([result.service_id for result in results], ['service-a', 'service-b', 'service-c'])
+        self.assertTrue(all(result.is_success for result in results))
+        self.assertEqual(results[0].consul, {'check_http': True})
+        self.assertEqual(results[0].sensu['changed'], ['check_sensu'])
+        self.assertEqual(self.api.register_checks.call_count, 3)
+        self.assertEqual(len(os.listdir(self.sensu_check_path)), 3)
+
+    def test_previous_deployment_checks_are_reported_on_the_result(self):
+        previous_dir = os.path.join(self.directory, 'previous')
+        os.makedirs(previous_dir)
+        previous_appspec = create_appspec('service-a')
+        previous_appspec['consul_healthchecks']['old_check'] = {
+            'name': 'old-http', 'type': 'http', 'http': 'http://localhost/old', 'interval': '10s'}
+        previous_appspec['sensu_healthchecks']['old_sensu'] = {
+            'name': 'old-sensu', 'server_script': 'check.sh', 'interval': 10}
+        with open(os.path.join(previous_dir, 'appspec.yml'), 'w') as appspec_file:
+            json.dump(previous_appspec, appspec_file)
+        open(os.path.join(self.sensu_check_path, 'service-a-old_sensu.json'), 'w').close()
+
+        (result, ) = self.sut.register([ServiceDeployment(
+            'service-a', self.directory, create_appspec('service-a'),
+            last_id='previous', last_archive_dir=previous_dir)])
+        self.assertTrue(result.is_success)
+        self.assertEqual(result.consul_deregistration.deregistered, ['old_check'])
+        self.assertEqual(result.consul_deregistration.failed, [])
+        self.assertEqual(result.sensu_deregistration.deregistered, ['old_sensu'])
+        self.assertEqual(os.listdir(self.sensu_check_path), ['service-a-check_sensu.json'])
+
+    def test_concurrent_consul_calls_fit_in_the_connection_pool(self):
+        self.assertEqual((self.sut.max_workers, self.sut.check_max_workers), (2, 5))
+        sut = FleetRegistrar(self.api, logger=MockLogger(), max_workers=4, check_max_workers=8)
+        self.assertEqual((sut.max_workers, sut.check_max_workers), (4, 2))
+        sut = FleetRegistrar(self.api, logger=MockLogger(), max_workers=16)
+        self.assertEqual((sut.max_workers, sut.check_max_workers), (10, 1))
+        self.sut.register([ServiceDeployment('service-a', self.directory, create_appspec('service-a'))])
+        self.assertEqual(self.api.register_checks.call_args[0][2], 5)
+
+    def test_a_failing_service_does_not_stop_the_others(self):
+        deployments = [ServiceDeployment('broken', self.directory, create_appspec('broken')),
+                       ServiceDeployment('service-a', self.directory, create_appspec('service-a'))]
+        (broken, service_a) = self.sut.register(deployments)
+        self.assertFalse(broken.is_success)
+        self.assertEqual(broken.error, 'Failed to register Consul health checks: check_http')
+        self.assertIsNone(broken.sensu)
+        self.assertTrue(service_a.is_success)
+        self.assertEqual(os.listdir(self.sensu_check_path), ['service-a-check_sensu.json'])
+
+    def test_phases_of_every_service_are_timed(self):
+        deployments = [ServiceDeployment(service_id, self.directory, create_appspec(service_id))
+                       for service_id in ('service-a', 'service-b')]
+        self.sut.register(deployments)
+        for check_type, phase in (('consul', 'validate'), ('consul', 'register'),
+                                  ('sensu', 'validate'), ('sensu', 'generate'), ('sensu', 'write')):
+            self.assertEqual(self.sink.get_histogram(
+                'healthcheck.phase.duration', check_type=check_type, phase=phase).count, 2)
+        self.assertEqual(self.sink.get_histogram('healthcheck.service.duration', success='true').count, 2)
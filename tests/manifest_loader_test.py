@@ -0,0 +1,50 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import os
+import shutil
+import tempfile
+import unittest
+from envmgr_healthchecks.health_checks.consul_health_check import ConsulHealthCheck
+from envmgr_healthchecks.health_checks.manifest_loader import ManifestLoader
+from envmgr_healthchecks.health_checks.sensu_heath_check import SensuHealthCheck
+
+MANIFEST = """
+consul_healthchecks:
+  check_1:
+    name: check-1
+    type: http
+    http: http://localhost/health
+    interval: 10s
+"""
+
+
+class TestManifestLoader(unittest.TestCase):
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.manifest_dir = os.path.join(self.archive_dir, 'healthchecks', 'consul')
+        os.makedirs(self.manifest_dir)
+        self.manifest_path = os.path.join(self.manifest_dir, 'healthchecks.yml')
+        with open(self.manifest_path, 'w') as manifest_file:
+            manifest_file.write(MANIFEST)
+        self.loader = ManifestLoader()
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+
+    def test_manifest_is_parsed_once_and_shared(self):
+        consul_health_check = ConsulHealthCheck(manifest_loader=self.loader)
+        sensu_health_check = SensuHealthCheck(manifest_loader=self.loader)
+        (healthchecks, _) = consul_health_check.find_health_checks('consul', self.archive_dir, {})
+        healthchecks['check_1']['name'] = 'changed'
+        (healthchecks, _) = sensu_health_check.find_health_checks('consul', self.archive_dir, {})
+        self.assertEqual(healthchecks['check_1']['name'], 'check-1')
+        self.assertEqual((self.loader.hits, self.loader.misses), (1, 1))
+
+    def test_changed_manifest_is_parsed_again(self):
+        self.loader.load(self.manifest_path)
+        with open(self.manifest_path, 'a') as manifest_file:
+            manifest_file.write('    timeout: 5\n')
+        manifest = self.loader.load(self.manifest_path)
+        self.assertEqual(manifest['consul_healthchecks']['check_1']['timeout'], 5)
+        self.assertEqual((self.loader.hits, self.loader.misses), (0, 2))
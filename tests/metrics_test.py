@@ -0,0 +1,97 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+import requests
+import responses
+from mock import Mock, patch
+from envmgr_healthchecks.api.consul.consul_api import ConsulApi, consul_endpoint
+from envmgr_healthchecks.api.consul.consul_retry import RetryPolicy
+from envmgr_healthchecks.metrics import InMemorySink, Metrics, PrometheusTextfileSink, StatsdSink
+
+consul_config = {'scheme': 'http', 'host': 'localhost',
+                 'port': 8500, 'version': 'v1', 'acl_token': None}
+
+
+class TestMetrics(unittest.TestCase):
+    def test_timer_records_into_histogram(self):
+        sink = InMemorySink(buckets=(0.1, 1.0))
+        metrics = Metrics([sink])
+        with patch('envmgr_healthchecks.metrics.time.time', side_effect=[10.0, 10.5]):
+            with metrics.timer('phase.duration', phase='parse'):
+                pass
+        metrics.timing('phase.duration', 5.0, phase='parse')
+        histogram = sink.get_histogram('phase.duration', phase='parse')
+        self.assertEqual(histogram.count, 2)
+        self.assertEqual(histogram.sum, 5.5)
+        self.assertEqual(histogram.cumulative_counts(), [0, 1])
+
+    def test_statsd_sink_sends_lines(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        sink = StatsdSink(receiver.getsockname())
+        try:
+            Metrics([sink]).increment('consul.request.retries', 2, endpoint='kv')
+            self.assertEqual(receiver.recv(1024), 'healthchecks.consul.request.retries:2|c|#endpoint:kv')
+        finally:
+            sink.close()
+            receiver.close()
+
+    def test_prometheus_textfile_sink_writes_histograms_and_counters(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'healthchecks.prom')
+            metrics = Metrics([PrometheusTextfileSink(path, buckets=(0.5,))])
+            metrics.timing('consul.request.duration', 0.25, endpoint='kv', method='GET')
+            metrics.increment('consul.request.bytes_sent', 10, endpoint='kv', method='PUT')
+            metrics.flush()
+            with open(path) as metrics_file:
+                self.assertEqual(metrics_file.read().splitlines(), [
+                    '# TYPE healthchecks_consul_request_duration_seconds histogram',
+                    'healthchecks_consul_request_duration_seconds_bucket{endpoint="kv",method="GET",le="0.5"} 1',
+                    'healthchecks_consul_request_duration_seconds_bucket{endpoint="kv",method="GET",le="+Inf"} 1',
+                    'healthchecks_consul_request_duration_seconds_sum{endpoint="kv",method="GET"} 0.25',
+                    'healthchecks_consul_request_duration_seconds_count{endpoint="kv",method="GET"} 1',
+                    '# TYPE healthchecks_consul_request_bytes_sent_total counter',
+                    'healthchecks_consul_request_bytes_sent_total{endpoint="kv",method="PUT"} 10'])
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestConsulApiMetrics(unittest.TestCase):
+    def test_endpoint_names_have_low_cardinality(self):
+        self.assertEqual(consul_endpoint('kv/some/key?index'), 'kv')
+        self.assertEqual(consul_endpoint('agent/check/deregister/service:check'), 'agent/check/deregister')
+        self.assertEqual(consul_endpoint('agent/services'), 'agent/services')
+
+    @responses.activate
+    def test_requests_are_timed_and_counted(self):
+        responses.add(responses.PUT, 'http://localhost:8500/v1/agent/check/register', status=200)
+        responses.add(responses.GET, 'http://localhost:8500/v1/agent/checks', body='{}', status=200)
+        sink = InMemorySink()
+        consul_api = ConsulApi(consul_config, Metrics([sink]))
+        consul_api.register_check({'ID': 'check'})
+        consul_api.get_checks()
+        self.assertEqual(sink.get_histogram(
+            'consul.request.duration', endpoint='agent/check/register', method='PUT').count, 1)
+        self.assertEqual(sink.get_counter(
+            'consul.request.bytes_sent', endpoint='agent/check/register', method='PUT'), len('{"ID": "check"}'))
+        self.assertEqual(sink.get_counter(
+            'consul.request.bytes_received', endpoint='agent/checks', method='GET'), 2)
+
+    def test_connection_errors_are_counted_as_retries(self):
+        sink = InMemorySink()
+        consul_api = ConsulApi(consul_config, Metrics([sink]), RetryPolicy(sleep=Mock()))
+        response = Mock(status_code=200, text='{}', content='{}', headers={})
+        with patch.object(consul_api._session, 'get', side_effect=[
+                requests.exceptions.ConnectionError(), requests.exceptions.ConnectionError(), response]):
+            consul_api.check_connectivity()
+        self.assertEqual(sink.get_counter(
+            'consul.request.retries', endpoint='agent/self', method='GET'), 2)
+        self.assertEqual(sink.get_histogram(
+            'consul.request.duration', endpoint='agent/self', method='GET').count, 3)
@@ -0,0 +1,35 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from mock import patch
+from envmgr_healthchecks.health_checks.script_files import EXECUTE_BITS, prepare_scripts
+
+
+class TestPrepareScripts(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.script = os.path.join(self.directory, 'check.sh')
+        self.executable_script = os.path.join(self.directory, 'executable.sh')
+        for path in (self.script, self.executable_script):
+            open(path, 'w').close()
+        os.chmod(self.script, 0o644)
+        os.chmod(self.executable_script, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_scripts_are_stated_once_and_made_executable(self):
+        missing_script = os.path.join(self.directory, 'missing.sh')
+        with patch('os.stat', wraps=os.stat) as mock_stat, patch('os.chmod', wraps=os.chmod) as mock_chmod:
+            file_stats = prepare_scripts(
+                [self.script, self.executable_script, self.script, missing_script], max_workers=4)
+        self.assertEqual(mock_stat.call_count, 3)
+        mock_chmod.assert_called_once_with(self.script, stat.S_IFREG | 0o644 | EXECUTE_BITS)
+        self.assertEqual(file_stats[missing_script], None)
+        self.assertTrue(os.stat(self.script).st_mode & EXECUTE_BITS == EXECUTE_BITS)
+        self.assertEqual(sorted(file_stats), sorted([self.script, self.executable_script, missing_script]))
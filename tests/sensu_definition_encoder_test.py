@@ -0,0 +1,36 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import json
+import unittest
+from envmgr_healthchecks.health_checks.sensu_definition_encoder import get_definition_encoder
+
+DEFINITION = {'checks': {'check-1': {
+    'command': '/opt/check.sh', 'interval': 10, 'standalone': True,
+    'subscribers': ['sensu-client'], 'team': u'caf\xe9'}}}
+
+
+class TestSensuDefinitionEncoder(unittest.TestCase):
+    def test_pretty_profile_is_the_default(self):
+        encode = get_definition_encoder(None)
+        self.assertEqual(encode(DEFINITION), json.dumps(
+            DEFINITION, sort_keys=True, indent=4, separators=(',', ': ')))
+
+    def test_compact_profile_has_no_whitespace(self):
+        content = get_definition_encoder('compact')(DEFINITION)
+        self.assertEqual(json.loads(content), DEFINITION)
+        self.assertNotIn('\n', content)
+        self.assertNotIn(': ', content)
+
+    def test_canonical_profile_is_byte_stable(self):
+        encode = get_definition_encoder('canonical')
+        reordered = {'checks': {'check-1': dict(reversed(list(DEFINITION['checks']['check-1'].items())))}}
+        self.assertEqual(encode(DEFINITION), encode(reordered))
+        self.assertEqual(
+            encode(DEFINITION),
+            '{"checks":{"check-1":{"command":"/opt/check.sh","interval":10,"standalone":true,'
+            '"subscribers":["sensu-client"],"team":"caf\\u00e9"}}}')
+
+    def test_unknown_profile_is_rejected(self):
+        with self.assertRaises(ValueError):
+            get_definition_encoder('tiny')
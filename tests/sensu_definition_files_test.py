@@ -0,0 +1,127 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import Mock, patch
+from envmgr_healthchecks.health_checks.sensu_heath_check import SensuHealthCheck
+
+
+class MockLogger(object):
+    def __init__(self):
+        self.info = Mock()
+        self.error = Mock()
+        self.debug = Mock()
+        self.warning = Mock()
+        self.exception = Mock()
+
+
+def create_check(name, interval=10):
+    return {'name': name, 'server_script': 'check.sh', 'interval': interval}
+
+
+class TestSensuDefinitionFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.plugins_path = os.path.join(self.directory, 'plugins')
+        self.sensu_check_path = os.path.join(self.directory, 'checks')
+        os.makedirs(self.plugins_path)
+        os.makedirs(self.sensu_check_path)
+        open(os.path.join(self.plugins_path, 'check.sh'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_sut(self, checks, last_id=None, definition_layout='per_check', output_profile='pretty'):
+        return SensuHealthCheck(
+            name='SensuHealthCheck',
+            logger=MockLogger(),
+            platform='linux',
+            instance_tags={},
+            service_id='my-service',
+            archive_dir=self.directory,
+            appspec={'sensu_healthchecks': checks},
+            last_id=last_id,
+            last_archive_dir=self.directory,
+            sensu={'healthcheck_search_paths': [self.plugins_path],
+                   'sensu_check_path': self.sensu_check_path,
+                   'definition_layout': definition_layout,
+                   'output_profile': output_profile})
+
+    def test_only_changed_definitions_are_written(self):
+        checks = {'check_1': create_check('check-1'), 'check_2': create_check('check-2')}
+        summary = self.create_sut(checks).register()
+        self.assertEqual(sorted(summary['changed']), ['check_1', 'check_2'])
+        self.assertEqual(sorted(os.listdir(self.sensu_check_path)),
+                         ['my-service-check_1.json', 'my-service-check_2.json'])
+
+        checks['check_2']['interval'] = 20
+        sut = self.create_sut(checks)
+        summary = sut.register()
+        self.assertEqual(summary, {'changed': ['check_2'], 'unchanged': ['check_1'], 'removed': []})
+        self.assertTrue(sut.has_definition_changes())
+
+        sut = self.create_sut(checks)
+        sut.register()
+        self.assertFalse(sut.has_definition_changes())
+
+    def test_deregister_keeps_definitions_of_checks_registered_again(self):
+        previous_checks = {'check_1': create_check('check-1'), 'check_2': create_check('check-2')}
+        self.create_sut(previous_checks).register()
+
+        sut = self.create_sut({'check_1': create_check('check-1')}, last_id='previous')
+        with patch.object(SensuHealthCheck, '_get_previous_deployment_appspec',
+                          return_value={'sensu_healthchecks': previous_checks}), \
+                patch.object(SensuHealthCheck, 'find_health_checks',
+                             side_effect=[(previous_checks, ''), ({'check_1': create_check('check-1')}, '')]):
+            report = sut.deregister()
+        self.assertEqual(report.deregistered, ['check_2'])
+        self.assertEqual(report.failed, [])
+        self.assertEqual(os.listdir(self.sensu_check_path), ['my-service-check_1.json'])
+        summary = sut.register()
+        self.assertEqual(summary, {'changed': [], 'unchanged': ['check_1'], 'removed': ['check_2']})
+
+    def test_bundle_layout_writes_one_file_per_service(self):
+        checks = {'check_1': create_check('check-1'), 'check_2': create_check('check-2')}
+        summary = self.create_sut(checks, definition_layout='bundle').register()
+        self.assertEqual(sorted(summary['changed']), ['check_1', 'check_2'])
+        self.assertEqual(os.listdir(self.sensu_check_path), ['my-service.json'])
+        with open(os.path.join(self.sensu_check_path, 'my-service.json')) as bundle_file:
+            bundle = json.load(bundle_file)
+        self.assertEqual(sorted(bundle['checks'].keys()), ['check-1', 'check-2'])
+
+        checks['check_2']['interval'] = 20
+        summary = self.create_sut(checks, definition_layout='bundle').register()
+        self.assertEqual(summary, {'changed': ['check_2'], 'unchanged': ['check_1'], 'removed': []})
+
+    def test_bundle_deregister_drops_only_removed_checks(self):
+        previous_checks = {'check_1': create_check('check-1'), 'check_2': create_check('check-2')}
+        self.create_sut(previous_checks).register()
+        self.create_sut(previous_checks, definition_layout='bundle').register()
+
+        current_checks = {'check_1': create_check('check-1')}
+        sut = self.create_sut(current_checks, last_id='previous', definition_layout='bundle')
+        with patch.object(SensuHealthCheck, '_get_previous_deployment_appspec',
+                          return_value={'sensu_healthchecks': previous_checks}), \
+                patch.object(SensuHealthCheck, 'find_health_checks',
+                             side_effect=[(previous_checks, ''), (current_checks, '')]):
+            report = sut.deregister()
+        self.assertEqual(report.deregistered, ['check_2'])
+        self.assertEqual(report.failed, [])
+        # Per check definitions left by an earlier layout are removed too
+        self.assertEqual(os.listdir(self.sensu_check_path), ['my-service.json'])
+        with open(os.path.join(self.sensu_check_path, 'my-service.json')) as bundle_file:
+            self.assertEqual(list(json.load(bundle_file)['checks'].keys()), ['check-1'])
+
+    def test_changing_output_profile_rewrites_definitions_once(self):
+        checks = {'check_1': create_check('check-1')}
+        self.create_sut(checks).register()
+        summary = self.create_sut(checks, output_profile='canonical').register()
+        self.assertEqual(summary['changed'], ['check_1'])
+        summary = self.create_sut(checks, output_profile='canonical').register()
+        self.assertEqual(summary['unchanged'], ['check_1'])
+        with open(os.path.join(self.sensu_check_path, 'my-service-check_1.json')) as definition_file:
+            self.assertNotIn('\n', definition_file.read())
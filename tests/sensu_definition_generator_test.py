@@ -0,0 +1,51 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import unittest
+from mock import Mock, patch
+from envmgr_healthchecks.health_checks.sensu_definition_generator import SensuCheckDefinitionGenerator
+from envmgr_healthchecks.health_checks.sensu_heath_check import SensuHealthCheck
+
+
+class TestSensuCheckDefinitionGenerator(unittest.TestCase):
+    def test_instance_level_fields_are_computed_once(self):
+        sut = SensuCheckDefinitionGenerator(
+            Mock(), platform='linux', service_slice='None',
+            instance_tags={'Role': 'web', 'aws:cloudformation:stack-id': 'stack'})
+        self.assertIsNone(sut.deployment_slice)
+        self.assertEqual(sut.tag_fields, {'ttl_role': 'web'})
+
+    def test_generate_all_produces_a_definition_per_check(self):
+        sut = SensuCheckDefinitionGenerator(
+            Mock(), platform='windows', service_slice='blue', instance_tags={'Role': 'web'})
+        checks = {
+            'check_1': {'name': 'check-1', 'local_script': 'a.ps1', 'interval': 10},
+            'check_2': {'name': 'check-2', 'server_script': 'b.ps1', 'interval': 10,
+                        'script_arguments': '-x'}
+        }
+        definitions = sut.generate_all(checks, {'check_1': 'C:\\a.ps1', 'check_2': 'C:\\b.ps1'})
+        check_1 = definitions['check_1']['checks']['check-1']
+        check_2 = definitions['check_2']['checks']['check-2']
+        self.assertEqual(
+            check_1['command'],
+            'powershell.exe -NonInteractive -NoProfile -ExecutionPolicy Bypass -file "C:\\a.ps1" blue')
+        self.assertEqual(
+            check_2['command'],
+            'powershell.exe -NonInteractive -NoProfile -ExecutionPolicy Bypass -file "C:\\b.ps1" -x')
+        self.assertEqual(check_1['ttl_role'], 'web')
+        self.assertEqual(check_2['ttl_role'], 'web')
+
+
+class TestSensuHealthCheckDefinitionGenerator(unittest.TestCase):
+    def test_generator_is_reused_until_the_deployment_changes(self):
+        sut = SensuHealthCheck(logger=Mock(), platform='linux', instance_tags={}, service_slice='blue')
+        check = {'name': 'check-1', 'local_script': 'check.sh', 'interval': 10}
+        with patch('envmgr_healthchecks.health_checks.sensu_heath_check.SensuCheckDefinitionGenerator',
+                   wraps=SensuCheckDefinitionGenerator) as generator_class:
+            sut._generate_check_definition(check, '/check.sh')
+            sut._generate_check_definition(check, '/check.sh')
+            self.assertEqual(generator_class.call_count, 1)
+            sut.service_slice = 'green'
+            definition = sut._generate_check_definition(check, '/check.sh')
+            self.assertEqual(generator_class.call_count, 2)
+        self.assertEqual(definition['checks']['check-1']['command'], '/check.sh green')
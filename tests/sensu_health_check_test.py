@@ -439,3 +439,23 @@ class TestRegisterSensuHealthChecks(unittest.TestCase):
             check, check['server_script'])
         self.assertEqual(check_definition['checks']['sensu-check1']['command'],
                          'powershell.exe -NonInteractive -NoProfile -ExecutionPolicy Bypass -file "C:\\Programs Files (x86)\\Sensu\\plugins\\check-windows-service.ps1" -ServiceName service_name')
+
+    def test_validate_checks_reports_every_error(self):
+        checks = {
+            'check_1': {
+                'name': 'missing interval',
+                'local_script': 'script.sh'
+            },
+            'check_2': {
+                'name': 'check-2',
+                'interval': '10s'
+            }
+        }
+        with self.assertRaises(RegisterError) as cm:
+            self.sensu_health_check._validate_checks(checks, '')
+        errors = str(cm.exception).split('\n')[1:]
+        self.assertEqual(errors, [
+            "Health check 'check_1': 'interval' is a required property",
+            "Health check name 'missing interval' doesn't match required Sensu name expression /^[\\w\\.-]+$/",
+            "Health check 'check_2': '10s' is not of type 'number'",
+            "Failed to register health check 'check_2', you need at least one of: 'local_script' or 'server_script'"])
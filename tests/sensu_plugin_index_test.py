@@ -0,0 +1,49 @@
+# Copyright (c) Trainline Limited, 2016-2017. All rights reserved. See
+# LICENSE.txt in the project root for license information.
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from envmgr_healthchecks.health_checks.sensu_plugin_index import SensuPluginIndex
+
+
+class TestSensuPluginIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.first_path = os.path.join(self.directory, 'first')
+        self.second_path = os.path.join(self.directory, 'second')
+        os.makedirs(self.first_path)
+        os.makedirs(self.second_path)
+        for path in (os.path.join(self.first_path, 'shared.sh'), os.path.join(self.second_path, 'shared.sh'),
+                     os.path.join(self.second_path, 'second.sh')):
+            open(path, 'w').close()
+        self.plugin_paths = [self.first_path, self.second_path, os.path.join(self.directory, 'missing')]
+        self.index = SensuPluginIndex()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_first_search_path_wins(self):
+        self.assertEqual(self.index.find(self.plugin_paths, 'shared.sh'),
+                         os.path.join(self.first_path, 'shared.sh'))
+        self.assertEqual(self.index.find(self.plugin_paths, 'second.sh'),
+                         os.path.join(self.second_path, 'second.sh'))
+        self.assertEqual(self.index.find(self.plugin_paths, 'unknown.sh'), None)
+
+    def test_directories_are_listed_once(self):
+        with patch('os.listdir', wraps=os.listdir) as mock_listdir:
+            self.index.refresh(self.plugin_paths)
+            for _ in range(10):
+                self.index.find(self.plugin_paths, 'second.sh')
+            self.index.refresh(self.plugin_paths)
+        self.assertEqual(mock_listdir.call_count, 2)
+
+    def test_changed_directory_is_listed_again(self):
+        self.index.refresh(self.plugin_paths)
+        open(os.path.join(self.first_path, 'new.sh'), 'w').close()
+        os.utime(self.first_path, (0, 0))
+        self.index.refresh(self.plugin_paths)
+        self.assertEqual(self.index.find(self.plugin_paths, 'new.sh'),
+                         os.path.join(self.first_path, 'new.sh'))